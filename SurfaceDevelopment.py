@@ -11,17 +11,55 @@ print(my_addin_path)
 if not my_addin_path in sys.path:
    sys.path.append(my_addin_path) 
 
-import math, glob, pickle
+import math, glob
 
 try:
     from .flatten import FlatLoop
-    from flat.raw import RawLoop
+    from flat.raw import fitTolerance
+    from flat.ode23 import SolverOptions, defaultOptions
+    from flat.pipeline import extractSteps, integrateSteps, closeSamples, writeSamples, samplesExtension
+    from flat.archive import writeArchive
+    from flat.nest import Part, nest
+    from flat.decimate import DecimationStats, simplify, edgeStyle
+    from flat.instrument import Profiler
+    from flat.store import LoopStore, fingerprint, faceFingerprint
+    from flat.screen import screenFace
+    from flat.export import openWriter, formats
+    from flat.schedule import Scheduler
+    from flat.body import BodyWalk, faceLoops, sampleSteps, placeHoles
 except Exception as e:
     print(e)
 
 _app = None
 _ui  = None
 
+# seconds of work between progress updates, when Fusion gets to handle its events
+_timeSlice = .1
+
+# outlines are simplified to this fraction of the gap for nesting (the gap is
+# widened to make up for it), the rotations parts may be nested with and the
+# space between sheets in the sketch
+_nestTolerance = .1
+_nestRotations = (0, 90, 180, 270)
+_sheetSpacing = 10.
+
+# names of the integration choices to flat.pipeline engines, automatic picks
+# a step method per edge from its tolerance and how far it turns
+_integrations = {'Quadrature': 'quad', 'Automatic per edge': 'auto', 'Bogacki-Shampine': 'ode23',
+                 'Dormand-Prince': 'ode45', 'Gauss-Legendre': 'gauss'}
+
+# names of the edge curve choices to the styles used by addSketchSpline
+_edgeCurves = {'Fitted splines': 'spline', 'Polylines': 'polyline', 'Automatic': 'auto'}
+
+# with a closure budget every edge starts at these cheap tolerances and only
+# the edges that keep a loop from closing are flattened again more tightly
+_budgetRelTol = 1.e-3
+_budgetFitTol = .02
+
+# flattened loops kept between runs, keyed by a fingerprint of the face geometry
+_cacheBytes = 256*1024*1024
+_cacheEntries = 10000
+
 # global set of event handlers to keep them referenced for the duration of the command
 _handlers = []
 
@@ -34,48 +72,306 @@ class FlattenCommandExecuteHandler(adsk.core.CommandEventHandler):
             command = args.firingEvent.sender
             inputs = command.commandInputs
 
-            # faces to flatten
-            flattened = []
-            input0 = inputs[0]
-            for isel in range(input0.selectionCount):
-                facesel = input0.selection(isel)
-                face = facesel.entity
-                loops = face.loops
-                outerLoop = loops[0]
-                raw = RawLoop(outerLoop)
-                raw.assemble()
-                flattened.append(raw)
-
-            saveRaw(flattened)
-            input1 = inputs[1]     # sketch
-            sel1 = input1.selection(0)
-            plane = sel1.entity
-            product = _app.activeProduct
-            design = adsk.fusion.Design.cast(product)
-            root = design.rootComponent
-            sketch = root.sketches.add(plane)
-            lines = sketch.sketchCurves.sketchLines
-
-            # add all the flattened loops to a sketch spaced out along the x axis
-            x = 0.
-            y = 0.
-            for loop in flattened:
-                dx = x - loop.boundingBox[0]
-                dy = y - loop.boundingBox[1]
-
-                for edge in loop.edges:
-                    xe, ye = edge.xy()
-                    xe = [pxe+dx for pxe in xe]
-                    ye = [pye+dy for pye in ye]
-                    addSketchSpline(xe, ye, sketch)
-                
-                x = x + loop.boundingBox[2] + 1.
-
+            # evaluator calls, solver counts and stage times per face and edge
+            profiler = Profiler(inputs.itemById('Profile').value)
+
+            # the nested outlines go to the sketch, a DXF or SVG file or both
+            drawSketch = inputs.itemById('DrawSketch').value
+            exportName = inputs.itemById('ExportFile').value.strip()
+            if exportName and os.path.splitext(exportName)[1].lower() not in formats:
+                _ui.messageBox('The export file name has to end in one of {}'.format(', '.join(sorted(formats))))
+                return
+            if drawSketch and inputs[1].selectionCount == 0:
+                _ui.messageBox('Select a construction plane for the sketch')
+                return
+
+            # loops flattened by earlier runs are reused when their geometry is unchanged
+            store = None
+            if inputs.itemById('UseCache').value:
+                store = openStore()
+
+            # the faces are flattened one by one in time slices behind a progress dialog,
+            # a cancel keeps the loops that are done
+            progress = ProgressDialogSink('Flatten')
+            try:
+                scheduler = Scheduler(progress, _timeSlice)
+                job = FlattenJob(inputs, profiler, store)
+                faces = selectedFaces(inputs[0])
+                order = range(len(faces))
+                if job.wholeBody:
+                    # faces that share edges are flattened one after the other
+                    job.walk = BodyWalk(faces)
+                    order = job.walk.order
+                for iface in order:
+                    scheduler.add(job.faceSteps(faces[iface], iface), job.faceUnits(faces[iface]),
+                                  'Flattening face {}'.format(iface + 1))
+                flattenedAll = scheduler.run()
+                done = flattenedAll
+
+                finished = job.finished()
+                with profiler.stage('save'):
+                    saveRaw(finished)
+                    if job.samples:
+                        saveSamples(job.samples)
+                if done and finished:
+                    # nest the flattened loops onto sheets and draw them
+                    scheduler.add(job.nestSteps(finished), len(finished) + 1, 'Nesting')
+                    scheduler.add(job.drawSteps(finished, drawSketch, exportName),
+                                  job.drawUnits(finished), 'Drawing')
+                    done = scheduler.run()
+            finally:
+                progress.close()
+            saveProfile(profiler)
+
+            reports = (screenReport(job.rejected, job.near), sketchReport(job.stats))
+            report = '\n'.join(line for line in reports if line)
+            if not flattenedAll:
+                report = 'Cancelled with {} of the {} selected faces flattened, they are saved and cached.\n{}'.format(
+                    len(finished), len(faces), report)
+            elif not done:
+                report = 'Cancelled while drawing, the flattened loops are saved and cached.\n{}'.format(report)
+            if report.strip():
+                _ui.messageBox(report.strip())
         except:
             unimport()
             if _ui:
                 _ui.messageBox('Failed:\n{}'.format(traceback.format_exc()))
 
+# the work of one run of the command as flat.schedule steps, each face is
+# screened, sampled, integrated and assembled in turn, then the flattened
+# loops are nested and drawn
+class FlattenJob:
+    def __init__(self, inputs, profiler, store):
+        self.inputs = inputs
+        self.profiler = profiler
+        self.store = store
+
+        # closure error allowed per loop, 0 flattens every edge at the default tolerances
+        self.budget = inputs.itemById('ClosureBudget').value
+        self.engine = _integrations[inputs.itemById('Integration').selectedItem.name]
+        if self.budget > 0.:
+            self.tolerances = (_budgetRelTol, _budgetFitTol, self.budget)
+            (self.options, self.fitTol) = (SolverOptions(_budgetRelTol), _budgetFitTol)
+        else:
+            self.tolerances = (defaultOptions.rtol, fitTolerance, 0.)
+            (self.options, self.fitTol) = (None, None)
+
+        # with whole bodies every loop of a face is flattened, the holes go into
+        # the outline, and faces share the curve geometry of their common edges
+        # through the flat.body.BodyWalk of the selection
+        self.wholeBody = inputs.itemById('WholeBody').value
+        self.walk = None
+
+        # faces that are not developable are turned away before any integration
+        self.screen = inputs.itemById('Screen').value
+        self.rejected = []
+        self.near = []
+
+        # per loop of the faces that pass the screen
+        self.outerLoops = []
+        self.flattened = []
+        # samples of the outer loops flattened in this run, for offline.py
+        self.samples = []
+        self.stats = DecimationStats()
+
+    # steps faceSteps takes, about
+    def faceUnits(self, face):
+        loops = faceLoops(face) if self.wholeBody else [face.loops[0]]
+        return sum(2 * loop.coEdges.count + 3 for loop in loops) + 2
+
+    # the flattened loops so far, all of them once every face is done
+    def finished(self):
+        return [raw for raw in self.flattened if raw is not None]
+
+    # run steps timed as a profiler stage without the time between them
+    def timed(self, steps, name, face=None):
+        while True:
+            with self.profiler.stage(name, face):
+                try:
+                    next(steps)
+                except StopIteration as stop:
+                    return stop.value
+            yield
+
+    # screen, sample, integrate and assemble the outer loop of the face
+    # selected as number isel, with whole bodies its holes too, or take it
+    # from the cache
+    def faceSteps(self, face, isel):
+        profiler = self.profiler
+        if self.screen:
+            with profiler.stage('screen'):
+                result = screenFace(face)
+            if not result.flattens:
+                self.rejected.append((isel, result))
+                if self.walk is not None:
+                    self.walk.skip(isel)
+                return
+            if result.kind == 'near':
+                self.near.append((isel, result))
+            yield
+
+        # loops are numbered by the faces that pass the screen, the edges of a
+        # face's holes are numbered after those of its outer loop
+        iloop = len(self.outerLoops)
+        loops = []
+        first = 0
+        for loop in (faceLoops(face) if self.walk is not None else [face.loops[0]]):
+            loops.append(profiler.loop(loop, iloop, first))
+            first = first + loop.coEdges.count
+        self.outerLoops.append(loops[0])
+        self.flattened.append(None)
+        key = None
+        if self.store is not None:
+            with profiler.stage('fingerprint', iloop):
+                if self.walk is not None:
+                    key = faceFingerprint(loops, (self.engine, 'body') + self.tolerances)
+                else:
+                    key = fingerprint(loops[0], (self.engine,) + self.tolerances)
+                raw = self.store.get(key)
+            if raw is not None:
+                self.flattened[iloop] = raw
+                if self.walk is not None:
+                    self.walk.skip(isel)
+                return
+            yield
+
+        if self.walk is not None:
+            steps = sampleSteps(self.walk, loops, self.options, self.fitTol)
+            faceSamples = yield from self.timed(steps, 'extract', iloop)
+            samples = faceSamples.loops
+        else:
+            steps = extractSteps(loops[0], self.options, self.fitTol)
+            samples = [(yield from self.timed(steps, 'extract', iloop))]
+        self.samples.append(samples[0])
+
+        raws = []
+        first = 0
+        for loop, loopSamples in zip(loops, samples):
+            times = []
+            raw = yield from self.timed(integrateSteps(loopSamples, self.engine, times), 'integrate', iloop)
+            with profiler.stage('assemble', iloop):
+                raw.assemble()
+            profiler.solver(iloop, raw, times, first)
+            yield
+
+            # sample the worst edges again until the loop closes within budget
+            if self.budget > 0.:
+                with profiler.stage('closure budget', iloop):
+                    raw = closeSamples(loop, loopSamples, raw, self.budget, self.engine)
+                profiler.solver(iloop, raw, None, first)
+                yield
+            raws.append(raw)
+            first = first + len(raw.edges)
+
+        raw = raws[0]
+        if len(raws) > 1:
+            with profiler.stage('holes', iloop):
+                placeHoles(raw, raws[1:], faceSamples.starts, face, self.options)
+
+        if self.store is not None:
+            with profiler.stage('cache'):
+                self.store.put(key, raw)
+        self.flattened[iloop] = raw
+
+    # nest the loops onto sheets, the sheets are spaced out along the x axis
+    def nestSteps(self, loops):
+        inputs = self.inputs
+        self.width = inputs.itemById('SheetWidth').value
+        self.height = inputs.itemById('SheetHeight').value
+        gap = inputs.itemById('SheetGap').value
+        tolerance = gap * _nestTolerance
+        parts = []
+        for loop in loops:
+            with self.profiler.stage('nest'):
+                parts.append(Part.fromLoop(loop, tolerance))
+            yield
+        with self.profiler.stage('nest'):
+            self.sheets = nest(parts, self.width, self.height, gap, _nestRotations)
+
+    # steps drawSteps takes, about
+    def drawUnits(self, loops):
+        return sum(len(l.edges) for loop in loops for l in [loop] + loop.holes) + 1
+
+    # draw the nested loops in a sketch with compute deferred so it solves once
+    # at the end, and write them to the export file loop by loop as they are
+    # placed, one step per edge drawn
+    def drawSteps(self, loops, drawSketch, exportName):
+        inputs = self.inputs
+        profiler = self.profiler
+        (width, height) = (self.width, self.height)
+        tolerance = inputs.itemById('CutTolerance').value
+        mode = _edgeCurves[inputs.itemById('EdgeCurves').selectedItem.name]
+        sketch = None
+        writer = None
+        try:
+            if drawSketch:
+                input1 = inputs[1]     # sketch
+                sel1 = input1.selection(0)
+                plane = sel1.entity
+                product = _app.activeProduct
+                design = adsk.fusion.Design.cast(product)
+                root = design.rootComponent
+                sketch = root.sketches.add(plane)
+                lines = sketch.sketchCurves.sketchLines
+                sketch.isComputeDeferred = True
+            if exportName:
+                writer = openWriter(exportPath(exportName))
+            yield
+
+            for isheet, sheet in enumerate(self.sheets):
+                x0 = isheet * (width + _sheetSpacing)
+                if sketch is not None:
+                    lines.addTwoPointRectangle(adsk.core.Point3D.create(x0, 0., 0.),
+                                               adsk.core.Point3D.create(x0 + width, height, 0.))
+                if writer is not None:
+                    writer.addSheet(x0, 0., width, height)
+                for placement in sheet.placements:
+                    loop = loops[placement.part]
+                    placement.apply(loop)
+                    loop.translateBy(x0, 0.)
+                    if writer is not None:
+                        with profiler.stage('export', placement.part):
+                            writer.addLoop(loop, 0., 0., tolerance, mode)
+                    for edge in [edge for l in [loop] + loop.holes for edge in l.edges]:
+                        if sketch is not None:
+                            with profiler.stage('sketch', placement.part):
+                                xe, ye = edge.xy()
+                                addSketchSpline(xe, ye, sketch, tolerance, mode, self.stats)
+                        yield
+        finally:
+            if writer is not None:
+                writer.close()
+            if sketch is not None:
+                with profiler.stage('sketch compute'):
+                    sketch.isComputeDeferred = False
+                profiler.count('sketch points kept', self.stats.kept)
+                profiler.count('sketch points dropped', self.stats.dropped)
+
+# flat.schedule progress sink showing a Fusion progress dialog, Fusion handles
+# its events, the cancel button among them, at every report
+class ProgressDialogSink:
+    def __init__(self, title):
+        self.dialog = _ui.createProgressDialog()
+        self.dialog.isCancelButtonShown = True
+        self.dialog.show(title, 'Starting', 0, 1, 0)
+
+    def report(self, done, total, eta, label):
+        dialog = self.dialog
+        dialog.maximumValue = max(total, 1)
+        dialog.progressValue = min(done, total)
+        if eta is None:
+            dialog.message = label or ''
+        else:
+            dialog.message = '{}, about {:.0f} s left'.format(label or '', eta)
+        adsk.doEvents()
+
+    @property
+    def cancelled(self):
+        return self.dialog.wasCancelled
+
+    def close(self):
+        self.dialog.hide()
+
 class FlattenCommandDestroyHandler(adsk.core.CommandEventHandler):
     def __init__(self):
         super().__init__()
@@ -127,9 +423,10 @@ class FlattenCommandCreatedHandler(adsk.core.CommandCreatedEventHandler):
             
             #define the inputs
             inputs = cmd.commandInputs
-            i0 = inputs.addSelectionInput('FlattenFaces', 'Faces to flatten', 'Please select faces to flatten')
+            i0 = inputs.addSelectionInput('FlattenFaces', 'Faces to flatten', 'Please select faces or bodies to flatten')
             i0.setSelectionLimits(1, 0)
             i0.addSelectionFilter(adsk.core.SelectionCommandInput.Faces)
+            i0.addSelectionFilter(adsk.core.SelectionCommandInput.Bodies)
             
             #i1 = inputs.addSelectionInput('Sketch', 'Flattened Sketch', 'Sketch to add flattened faces to')
             #i1.addSelectionFilter(adsk.core.SelectionCommandInput.Sketches)
@@ -137,6 +434,43 @@ class FlattenCommandCreatedHandler(adsk.core.CommandCreatedEventHandler):
             i1 = inputs.addSelectionInput('ConstPlane', 'Construction Plane', 'Please select a construction plane')
             i1.addSelectionFilter(adsk.core.SelectionCommandInput.ConstructionPlanes)
             i1.addSelectionFilter(adsk.core.SelectionCommandInput.RootComponents)
+            # only needed for the sketch
+            i1.setSelectionLimits(0, 1)
+
+            # sheet stock the flattened faces are nested onto
+            inputs.addValueInput('SheetWidth', 'Sheet width', 'cm', adsk.core.ValueInput.createByReal(120.))
+            inputs.addValueInput('SheetHeight', 'Sheet height', 'cm', adsk.core.ValueInput.createByReal(240.))
+            inputs.addValueInput('SheetGap', 'Gap between parts', 'cm', adsk.core.ValueInput.createByReal(1.))
+
+            # how the sampled edges are integrated
+            i3 = inputs.addDropDownCommandInput('Integration', 'Integration', adsk.core.DropDownStyles.TextListDropDownStyle)
+            for name in _integrations:
+                i3.listItems.add(name, name == 'Quadrature')
+
+            # how closely the flattened loops have to close, 0 to turn the budget off
+            inputs.addValueInput('ClosureBudget', 'Closure budget', 'cm', adsk.core.ValueInput.createByReal(0.))
+
+            # how closely the sketch follows the flattened edges
+            inputs.addValueInput('CutTolerance', 'Cut tolerance', 'cm', adsk.core.ValueInput.createByReal(.01))
+            i2 = inputs.addDropDownCommandInput('EdgeCurves', 'Edge curves', adsk.core.DropDownStyles.TextListDropDownStyle)
+            for name in _edgeCurves:
+                i2.listItems.add(name, name == 'Fitted splines')
+
+            # reuse flattened loops of unchanged faces from earlier runs
+            inputs.addBoolValueInput('UseCache', 'Reuse unchanged faces', True, '', True)
+
+            # where the nested outlines go, a relative export file name is next to the save file
+            inputs.addBoolValueInput('DrawSketch', 'Draw sketch', True, '', True)
+            inputs.addStringValueInput('ExportFile', 'Export file (.dxf or .svg)', '')
+
+            # flatten holes too and share the geometry of the edges between faces
+            inputs.addBoolValueInput('WholeBody', 'Whole body (holes, shared edges)', True, '', False)
+
+            # check the Gaussian curvature of each face and skip the ones that cannot flatten
+            inputs.addBoolValueInput('Screen', 'Skip non-developable faces', True, '', True)
+
+            # write flat_profile.json and flat_profile.txt next to the save file
+            inputs.addBoolValueInput('Profile', 'Write profile', True, '', False)
 
         except:
             if _ui:
@@ -171,7 +505,20 @@ def run(context):
             _ui.messageBox('Failed:\n{}'.format(traceback.format_exc()))
 
 
-def addSketchSpline(xe, ye, sketch):
+# draw one edge, decimated to tolerance when it is given, as a fitted spline
+# or as connected lines, mode is 'spline', 'polyline' or 'auto'
+def addSketchSpline(xe, ye, sketch, tolerance=None, mode='spline', stats=None):
+    if tolerance is not None:
+        xe, ye = simplify(xe, ye, tolerance, stats)
+
+    if edgeStyle(xe, ye, mode) == 'polyline':
+        lines = sketch.sketchCurves.sketchLines
+        start = adsk.core.Point3D.create(xe[0], ye[0], 0.0)
+        for i in range(1, len(xe)):
+            line = lines.addByTwoPoints(start, adsk.core.Point3D.create(xe[i], ye[i], 0.0))
+            start = line.endSketchPoint
+        return
+
     points = adsk.core.ObjectCollection.create()
     for i in range(len(xe)):
         x = xe[i]
@@ -198,9 +545,67 @@ def unimport():
             # Key will not exist if a .py file wasn't imported; Attribute will be wrong if it isn't a module
             pass
 
+# the faces of a selection input, a selected body stands for all of its faces
+def selectedFaces(selectionInput):
+    faces = []
+    for isel in range(selectionInput.selectionCount):
+        entity = selectionInput.selection(isel).entity
+        # only a body has faces
+        bodyFaces = getattr(entity, 'faces', None)
+        if bodyFaces is None:
+            faces.append(entity)
+        else:
+            faces.extend(bodyFaces.item(iface) for iface in range(bodyFaces.count))
+    return faces
+
 def saveRaw(raw):
-    # pickle raw flattened data
+    # archive raw flattened data
     # path to folder containing this module
     dir = os.path.dirname(os.path.abspath(__file__))
-    fname = os.path.join(dir, "flat_save.p")    
-    pickle.dump(raw, open( fname, "wb" ))
+    fname = os.path.join(dir, "flat_save.flat")
+    writeArchive(fname, raw)
+
+def saveSamples(samples):
+    # the loops sampled in this run, not those read from the cache, next to
+    # the archive, offline.py --integrate runs phase two on them again in a
+    # process pool
+    dir = os.path.dirname(os.path.abspath(__file__))
+    writeSamples(os.path.join(dir, "flat_save" + samplesExtension), samples)
+
+def exportPath(name):
+    # relative export names are next to the archive
+    dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(dir, os.path.expanduser(name))
+
+def openStore():
+    # cache of flattened loops next to the archive
+    dir = os.path.dirname(os.path.abspath(__file__))
+    return LoopStore(os.path.join(dir, "flat_cache"), _cacheBytes, _cacheEntries)
+
+# message listing the selected faces the screen rejected or let through as
+# nearly developable, as (selection index, flat.screen.Screen) pairs
+def screenReport(rejected, near):
+    lines = []
+    if rejected:
+        lines.append('Skipped faces that are not developable:')
+        for (isel, result) in rejected:
+            lines.append('  face {}: angle defect {:.3g} rad'.format(isel + 1, result.defect))
+    if near:
+        lines.append('Flattened faces that are only nearly developable, their outlines may not close:')
+        for (isel, result) in near:
+            lines.append('  face {}: angle defect {:.3g} rad'.format(isel + 1, result.defect))
+    return '\n'.join(lines)
+
+# message with the points the sketch splines were drawn through and how many
+# the cut tolerance let the decimation drop, empty if no sketch was drawn
+def sketchReport(stats):
+    total = stats.kept + stats.dropped
+    if total == 0:
+        return ''
+    return 'Drew the sketch through {} of {} points, {} dropped within the cut tolerance.'.format(
+        stats.kept, total, stats.dropped)
+
+def saveProfile(profiler):
+    # profile report next to the archive
+    dir = os.path.dirname(os.path.abspath(__file__))
+    profiler.write(os.path.join(dir, "flat_profile"))
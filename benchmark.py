@@ -0,0 +1,168 @@
+from flat.analytic import patches, patch, exactPoints
+from flat.raw import RawLoop, RawEdge
+from flat.ode23 import ode23, estimateH, SolverOptions
+from flat.solvers import methods
+from flat.batch import np
+import sys, json, math, time, argparse
+from functools import partial
+
+# flattening benchmarks on the analytic stand-in surfaces, one JSON line per
+# case with the wall time, evaluation counts and the closure and shape errors
+# a baseline file from an earlier run turns it into a regression check
+
+engines = list(methods) + ['auto', 'quad']
+# the batch engine needs numpy
+if np is not None:
+    engines.append('batch')
+
+# largest distance between matching points after the best rigid fit of
+# points onto exact, reflections allowed since the flat side is arbitrary
+def shapeError(points, exact):
+    n = len(points)
+    (px, py) = (sum(p[0] for p in points) / n, sum(p[1] for p in points) / n)
+    (ex, ey) = (sum(p[0] for p in exact) / n, sum(p[1] for p in exact) / n)
+    best = math.inf
+    for mirror in (1., -1.):
+        a = [(p[0] - px, mirror * (p[1] - py)) for p in points]
+        b = [(p[0] - ex, p[1] - ey) for p in exact]
+        theta = math.atan2(sum(u[0]*v[1] - u[1]*v[0] for u, v in zip(a, b)),
+                           sum(u[0]*v[0] + u[1]*v[1] for u, v in zip(a, b)))
+        (c, s) = (math.cos(theta), math.sin(theta))
+        worst = max(math.hypot(c*u[0] - s*u[1] - v[0], s*u[0] + c*u[1] - v[1]) for u, v in zip(a, b))
+        best = min(best, worst)
+    return best
+
+# flatten and assemble the outer loop of a standard patch
+def loopCase(name, engine, rtol, subdivide, warp, repeat):
+    (surface, corners) = patches()[name]
+    best = math.inf
+    for i in range(repeat):
+        face = patch(surface, corners, subdivide, warp)
+        loop = face.loops[0]
+        t0 = time.perf_counter()
+        raw = RawLoop(loop, engine, SolverOptions(rtol))
+        closure = raw.assemble()
+        best = min(best, time.perf_counter() - t0)
+
+    nfev = sum(edge.solverStats.nfev for edge in raw.edges)
+    points = []
+    exact = []
+    for ce, edge in zip(loop.coEdges, raw.edges):
+        points.extend(edge.point(i) for i in range(len(edge)))
+        if exact is not None:
+            ep = exactPoints(ce, edge.tvec)
+            exact = None if ep is None else exact + ep
+
+    return {"group": "loop", "surface": name, "engine": engine, "rtol": rtol,
+            "warp": warp, "edges": len(raw.edges), "points": len(points), "time": best,
+            "nfev": nfev, "evaluations": sum(face.calls.values()), "closure": closure,
+            "shape": None if exact is None else shapeError(points, exact)}
+
+# one edge of a patch on its own through the fixed step ode23 or, for a
+# solver named method + 'Adaptive', one of the adaptive methods
+def edgeCase(name, solver, rtol, warp, repeat):
+    (surface, corners) = patches()[name]
+    face = patch(surface, corners, 1, warp)
+    ce = face.loops[0].coEdges.item(0)
+    edge = RawEdge(ce, None)
+    counted = [0]
+    def rhs(t, state):
+        counted[0] = counted[0] + 1
+        return edge.rhs(ce.edge, face, t, state)
+
+    best = math.inf
+    for i in range(repeat):
+        edge.cache.clear()
+        face.calls.clear()
+        counted[0] = 0
+        t0 = time.perf_counter()
+        if solver == 'ode23':
+            (xOut, success) = ode23(rhs, edge.x0, edge.tvec)
+        else:
+            options = SolverOptions(rtol)
+            h = min(edge.tvec[1] - edge.tvec[0], estimateH(rhs, edge.x0, edge.tvec[0], options))
+            (xOut, stats) = methods[solver[:-len('Adaptive')]](rhs, edge.x0, edge.tvec, h, options)
+        best = min(best, time.perf_counter() - t0)
+
+    exact = exactPoints(ce, edge.tvec)
+    if exact is not None and ce.isOpposedToEdge:
+        exact.reverse()
+    return {"group": "edge", "surface": name, "engine": solver, "rtol": rtol,
+            "warp": warp, "edges": 1, "points": len(xOut), "time": best, "nfev": counted[0],
+            "evaluations": sum(face.calls.values()), "closure": None,
+            "shape": None if exact is None else shapeError([x[:2] for x in xOut], exact)}
+
+# warp is how unevenly the edges are parameterized, see flat.analytic
+def cases(quick):
+    tolerances = [1.e-4] if quick else [1.e-3, 1.e-4, 1.e-6]
+    subdivisions = [1] if quick else [1, 4]
+    warps = [0., .8]
+    for name in patches():
+        for warp in warps:
+            for rtol in tolerances:
+                if rtol == tolerances[0]:
+                    yield partial(edgeCase, name, 'ode23', rtol, warp)
+                for method in methods:
+                    yield partial(edgeCase, name, method + 'Adaptive', rtol, warp)
+                for engine in engines:
+                    for subdivide in subdivisions:
+                        yield partial(loopCase, name, engine, rtol, subdivide, warp)
+
+def key(result):
+    return (result["group"], result["surface"], result["engine"], result["rtol"], result.get("warp", 0.), result["edges"])
+
+# results slower than the baseline by more than slack, or less accurate
+def regressions(results, baseline, slack):
+    found = []
+    for result in results:
+        base = baseline.get(key(result))
+        if base is None:
+            continue
+        if result["time"] > base["time"] * (1. + slack):
+            found.append((result, "time {:.4g} s baseline {:.4g} s".format(result["time"], base["time"])))
+        for error in ("closure", "shape"):
+            if result[error] is not None and base[error] is not None and result[error] > 2. * base[error] + 1.e-12:
+                found.append((result, "{} {:.3g} baseline {:.3g}".format(error, result[error], base[error])))
+        if result["nfev"] > base["nfev"] * (1. + slack):
+            found.append((result, "nfev {} baseline {}".format(result["nfev"], base["nfev"])))
+    return found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark flattening on analytic surfaces, writes JSON lines.")
+    parser.add_argument("-o", "--output", default="-", help="JSON lines output file, - for stdout")
+    parser.add_argument("--quick", action="store_true", help="one tolerance and edge count per case")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the fastest is reported")
+    parser.add_argument("--baseline", default=None, help="JSON lines from an earlier run to compare against")
+    parser.add_argument("--slack", type=float, default=.25, help="fraction a time or count may exceed the baseline by")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    baseline[key(result)] = result
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    results = []
+    t0 = time.perf_counter()
+    try:
+        for case in cases(args.quick):
+            result = case(args.repeat)
+            results.append(result)
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print("{} cases in {:.3f} s".format(len(results), time.perf_counter() - t0), file=sys.stderr)
+    found = regressions(results, baseline, args.slack)
+    for (result, reason) in found:
+        print("regression {} {} {} rtol {} warp {} edges {}: {}".format(*key(result), reason), file=sys.stderr)
+    return 1 if found else 0
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    sys.exit(main())
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Analytic stand-ins for the Fusion objects the flattening uses.
+
+A face is a patch of an analytic surface bounded by straight lines in its
+(u, v) parameter space.  The evaluators implement the methods RawEdge and
+RawLoop call on the adsk ones, so flat can run and be timed without Fusion.
+Every evaluator call is counted by method name in the face's calls.
+
+The developable surfaces know their exact flat pattern, flat(u, v), to
+measure the shape error of a flattened loop against.  The twisted strip is a
+hyperbolic paraboloid, it is not developable and its loops cannot close.
+"""
+import math, collections
+
+class Vector3D:
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @classmethod
+    def create(cls, x=0., y=0., z=0.):
+        return cls(x, y, z)
+
+    @property
+    def length(self):
+        return math.sqrt(self.x*self.x + self.y*self.y + self.z*self.z)
+
+    def dotProduct(self, other):
+        return self.x*other.x + self.y*other.y + self.z*other.z
+
+    def crossProduct(self, other):
+        return Vector3D(self.y*other.z - self.z*other.y,
+                        self.z*other.x - self.x*other.z,
+                        self.x*other.y - self.y*other.x)
+
+    def normalize(self):
+        l = self.length
+        if l > 0.:
+            self.scaleBy(1. / l)
+        return True
+
+    def copy(self):
+        return type(self)(self.x, self.y, self.z)
+
+    def scaleBy(self, scale):
+        self.x = self.x * scale
+        self.y = self.y * scale
+        self.z = self.z * scale
+        return True
+
+    def angleTo(self, other):
+        c = self.dotProduct(other) / (self.length * other.length)
+        return math.acos(max(-1., min(1., c)))
+
+    def asArray(self):
+        return [self.x, self.y, self.z]
+
+# points remember the surface parameters they were evaluated at so the face
+# evaluator does not have to invert the surface
+class Point3D(Vector3D):
+    uv = None
+
+    def distanceTo(self, other):
+        return math.sqrt((self.x - other.x)**2 + (self.y - other.y)**2 + (self.z - other.z)**2)
+
+    def copy(self):
+        p = Point3D(self.x, self.y, self.z)
+        p.uv = self.uv
+        return p
+
+# surface parameters (u, v), like the adsk Point2D
+class Point2D:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    @classmethod
+    def create(cls, x=0., y=0.):
+        return cls(x, y)
+
+    def copy(self):
+        return Point2D(self.x, self.y)
+
+class BoundingBox2D:
+    def __init__(self, minPoint, maxPoint):
+        self.minPoint = minPoint
+        self.maxPoint = maxPoint
+
+def combine(*terms):
+    x = y = z = 0.
+    for (k, v) in terms:
+        x = x + k * v[0]
+        y = y + k * v[1]
+        z = z + k * v[2]
+    return (x, y, z)
+
+# surfaces give the point and its first and second partial derivatives as
+# tuples, and flat(u, v) is the exact development or None
+class Cylinder:
+    def __init__(self, radius):
+        self.radius = radius
+
+    def point(self, u, v):
+        r = self.radius
+        return (r*math.cos(u), r*math.sin(u), v)
+
+    def derivatives(self, u, v):
+        r = self.radius
+        (c, s) = (math.cos(u), math.sin(u))
+        zero = (0., 0., 0.)
+        return ((-r*s, r*c, 0.), (0., 0., 1.), (-r*c, -r*s, 0.), zero, zero)
+
+    def flat(self, u, v):
+        return (self.radius * u, v)
+
+# apex at the origin, v is the distance from the apex along a ruling
+class Cone:
+    def __init__(self, halfAngle):
+        self.sa = math.sin(halfAngle)
+        self.ca = math.cos(halfAngle)
+
+    def point(self, u, v):
+        return (v*self.sa*math.cos(u), v*self.sa*math.sin(u), v*self.ca)
+
+    def derivatives(self, u, v):
+        (c, s) = (math.cos(u), math.sin(u))
+        sa = self.sa
+        return ((-v*sa*s, v*sa*c, 0.), (sa*c, sa*s, self.ca),
+                (-v*sa*c, -v*sa*s, 0.), (-sa*s, sa*c, 0.), (0., 0., 0.))
+
+    def flat(self, u, v):
+        phi = u * self.sa
+        return (v*math.cos(phi), v*math.sin(phi))
+
+# tangent lines of the helix c(u) = (r cos u, r sin u, pitch u), v is the
+# distance along the tangent in units of |c'|, v = 0 is the edge of regression
+class TangentDevelopable:
+    def __init__(self, radius, pitch):
+        self.radius = radius
+        self.pitch = pitch
+        self.speed = math.hypot(radius, pitch)
+
+    def point(self, u, v):
+        r = self.radius
+        (c, s) = (math.cos(u), math.sin(u))
+        return (r*c - v*r*s, r*s + v*r*c, self.pitch*(u + v))
+
+    def derivatives(self, u, v):
+        r = self.radius
+        (c, s) = (math.cos(u), math.sin(u))
+        c1 = (-r*s, r*c, self.pitch)
+        c2 = (-r*c, -r*s, 0.)
+        c3 = (r*s, -r*c, 0.)
+        return (combine((1., c1), (v, c2)), c1, combine((1., c2), (v, c3)), c2, (0., 0., 0.))
+
+    # the helix develops into a circle with the same curvature and the
+    # tangents develop into its tangents
+    def flat(self, u, v):
+        w = self.speed
+        theta = self.radius * u / w
+        rho = w * w / self.radius
+        (c, s) = (math.cos(theta), math.sin(theta))
+        return (rho*s + v*w*c, rho*(1. - c) + v*w*s)
+
+# z = k u v, doubly ruled and twisted, Gaussian curvature is negative everywhere
+class TwistedStrip:
+    def __init__(self, twist):
+        self.twist = twist
+
+    def point(self, u, v):
+        return (u, v, self.twist * u * v)
+
+    def derivatives(self, u, v):
+        k = self.twist
+        zero = (0., 0., 0.)
+        return ((1., 0., k*v), (0., 1., k*u), zero, (0., 0., k), zero)
+
+    def flat(self, u, v):
+        return None
+
+class Collection:
+    def __init__(self, items):
+        self.items = list(items)
+
+    @property
+    def count(self):
+        return len(self.items)
+
+    def item(self, i):
+        return self.items[i]
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+# straight line from a to b in the parameter space of the surface, t in [0, 1]
+# warp in (-1, 1) moves along the line by g(t) = t + warp t (1 - t) so the
+# curve is not parameterized in proportion to arc length, like most NURBS
+class CurveEvaluator:
+    maxStrokeDepth = 16
+
+    def __init__(self, surface, a, b, calls, warp=0.):
+        self.surface = surface
+        self.a = a
+        self.b = b
+        self.du = b[0] - a[0]
+        self.dv = b[1] - a[1]
+        self.calls = calls
+        self.warp = warp
+
+    def uv(self, t):
+        g = t + self.warp * t * (1. - t)
+        return (self.a[0] + g*self.du, self.a[1] + g*self.dv)
+
+    def position(self, t):
+        (u, v) = self.uv(t)
+        p = Point3D(*self.surface.point(u, v))
+        p.uv = (u, v)
+        return p
+
+    def derivatives(self, t):
+        (su, sv, suu, suv, svv) = self.surface.derivatives(*self.uv(t))
+        (du, dv) = (self.du, self.dv)
+        g1 = 1. + self.warp * (1. - 2.*t)
+        g2 = -2. * self.warp
+        r_g = combine((du, su), (dv, sv))
+        r_gg = combine((du*du, suu), (2.*du*dv, suv), (dv*dv, svv))
+        return Vector3D(*combine((g1, r_g))), Vector3D(*combine((g1*g1, r_gg), (g2, r_g)))
+
+    def getParameterExtents(self):
+        self.calls['getParameterExtents'] += 1
+        return (True, 0., 1.)
+
+    def getPointAtParameter(self, t):
+        self.calls['getPointAtParameter'] += 1
+        return (True, self.position(t))
+
+    def getFirstDerivative(self, t):
+        self.calls['getFirstDerivative'] += 1
+        return (True, self.derivatives(t)[0])
+
+    def getSecondDerivative(self, t):
+        self.calls['getSecondDerivative'] += 1
+        return (True, self.derivatives(t)[1])
+
+    def getTangent(self, t):
+        self.calls['getTangent'] += 1
+        tangent = self.derivatives(t)[0]
+        tangent.normalize()
+        return (True, tangent)
+
+    # unit direction of the curvature vector and its magnitude
+    def getCurvature(self, t):
+        self.calls['getCurvature'] += 1
+        (r_t, r_tt) = self.derivatives(t)
+        speed = r_t.length
+        k = r_t.crossProduct(r_tt).length / speed**3
+        along = r_tt.dotProduct(r_t) / (speed * speed)
+        direction = Vector3D(r_tt.x - along*r_t.x, r_tt.y - along*r_t.y, r_tt.z - along*r_t.z)
+        if direction.length == 0.:
+            # a straight line, any direction normal to it
+            direction = r_t.crossProduct(Vector3D(0., 0., 1.) if abs(r_t.z) < .9 * speed else Vector3D(1., 0., 0.))
+        direction.normalize()
+        return (True, direction, k)
+
+    # points along the curve with no chord further than tol from the curve
+    def getStrokes(self, t0, t1, tol):
+        self.calls['getStrokes'] += 1
+        points = [self.position(t0)]
+        self.strokes(t0, t1, points[0], self.position(t1), tol, points, 0)
+        return (True, points)
+
+    def strokes(self, t0, t1, p0, p1, tol, points, depth):
+        tm = (t0 + t1) / 2.
+        pm = self.position(tm)
+        sag = math.sqrt(sum((c - (a + b) / 2.)**2 for a, b, c in zip(p0.asArray(), p1.asArray(), pm.asArray())))
+        if depth < 2 or (sag > tol and depth < self.maxStrokeDepth):
+            self.strokes(t0, tm, p0, pm, tol, points, depth + 1)
+            self.strokes(tm, t1, pm, p1, tol, points, depth + 1)
+        else:
+            points.append(p1)
+
+    # arc length by composite Gauss-Legendre quadrature
+    def length(self, panels=64):
+        nodes = (-0.9061798459386640, -0.5384693101056831, 0., 0.5384693101056831, 0.9061798459386640)
+        weights = (0.2369268850561891, 0.4786286704993665, 0.5688888888888889, 0.4786286704993665, 0.2369268850561891)
+        h = 1. / panels
+        total = 0.
+        for i in range(panels):
+            for x, w in zip(nodes, weights):
+                total = total + w * h / 2. * self.derivatives(h * (i + (x + 1.) / 2.))[0].length
+        return total
+
+class SurfaceEvaluator:
+    def __init__(self, surface, calls):
+        self.surface = surface
+        self.calls = calls
+        # (umin, vmin, umax, vmax), patch sets it to the corners of the face
+        self.bounds = (0., 0., 1., 1.)
+
+    def parametricRange(self):
+        self.calls['parametricRange'] += 1
+        (u0, v0, u1, v1) = self.bounds
+        return BoundingBox2D(Point2D(u0, v0), Point2D(u1, v1))
+
+    def getFirstDerivatives(self, parameters):
+        self.calls['getFirstDerivatives'] += 1
+        partialsU = []
+        partialsV = []
+        for p in parameters:
+            (su, sv) = self.surface.derivatives(p.x, p.y)[:2]
+            partialsU.append(Vector3D(*su))
+            partialsV.append(Vector3D(*sv))
+        return (True, partialsU, partialsV)
+
+    # principal directions and curvatures from the fundamental forms
+    def getCurvatures(self, parameters):
+        self.calls['getCurvatures'] += 1
+        maxTangents = []
+        maxCurvatures = []
+        minCurvatures = []
+        for p in parameters:
+            (su, sv, suu, suv, svv) = (Vector3D(*d) for d in self.surface.derivatives(p.x, p.y))
+            normal = su.crossProduct(sv)
+            normal.normalize()
+            (E, F, G) = (su.dotProduct(su), su.dotProduct(sv), sv.dotProduct(sv))
+            (L, M, N) = (suu.dotProduct(normal), suv.dotProduct(normal), svv.dotProduct(normal))
+            det = E*G - F*F
+            K = (L*N - M*M) / det
+            H = (E*N - 2.*F*M + G*L) / (2. * det)
+            root = math.sqrt(max(H*H - K, 0.))
+            (kmax, kmin) = (H + root, H - root)
+
+            # (a, b) with (L - k E) a + (M - k F) b = 0, su at an umbilic
+            (a, b) = (M - kmax*F, kmax*E - L)
+            if abs(a) + abs(b) <= 1.e-12 * (abs(L) + abs(M) + abs(N) + 1.):
+                (a, b) = (kmax*G - N, M - kmax*F)
+            if abs(a) + abs(b) <= 1.e-12 * (abs(L) + abs(M) + abs(N) + 1.):
+                (a, b) = (1., 0.)
+            tangent = Vector3D(*combine((a, su.asArray()), (b, sv.asArray())))
+            tangent.normalize()
+            maxTangents.append(tangent)
+            maxCurvatures.append(kmax)
+            minCurvatures.append(kmin)
+        return (True, maxTangents, maxCurvatures, minCurvatures)
+
+    def getParameterAtPoint(self, point):
+        self.calls['getParameterAtPoint'] += 1
+        (u, v) = point.uv if point.uv is not None else self.parameters(point)
+        return (True, Point2D(u, v))
+
+    def getFirstDerivative(self, parameter):
+        self.calls['getFirstDerivative'] += 1
+        (su, sv) = self.surface.derivatives(parameter.x, parameter.y)[:2]
+        return (True, Vector3D(*su), Vector3D(*sv))
+
+    def getSecondDerivative(self, parameter):
+        self.calls['getSecondDerivative'] += 1
+        (suu, suv, svv) = self.surface.derivatives(parameter.x, parameter.y)[2:]
+        return (True, Vector3D(*suu), Vector3D(*suv), Vector3D(*svv))
+
+    def getNormalAtParameter(self, parameter):
+        self.calls['getNormalAtParameter'] += 1
+        (su, sv) = self.surface.derivatives(parameter.x, parameter.y)[:2]
+        normal = Vector3D(*su).crossProduct(Vector3D(*sv))
+        normal.normalize()
+        return (True, normal)
+
+    # unit normal su x sv, at the parameters the point was evaluated at
+    def getNormalAtPoint(self, point):
+        self.calls['getNormalAtPoint'] += 1
+        (u, v) = point.uv if point.uv is not None else self.parameters(point)
+        (su, sv, suu, suv, svv) = self.surface.derivatives(u, v)
+        normal = Vector3D(*su).crossProduct(Vector3D(*sv))
+        normal.normalize()
+        return (True, normal)
+
+    # Gauss-Newton for a point that did not come from an evaluator
+    def parameters(self, point, start=(0., 0.), iterations=50):
+        (u, v) = start
+        target = point.asArray()
+        for i in range(iterations):
+            p = self.surface.point(u, v)
+            (su, sv) = self.surface.derivatives(u, v)[:2]
+            r = [a - b for a, b in zip(target, p)]
+            (a, b, c) = (sum(x*x for x in su), sum(x*y for x, y in zip(su, sv)), sum(x*x for x in sv))
+            (e, f) = (sum(x*y for x, y in zip(su, r)), sum(x*y for x, y in zip(sv, r)))
+            det = a*c - b*b
+            (du, dv) = ((c*e - b*f) / det, (a*f - b*e) / det)
+            u = u + du
+            v = v + dv
+            if abs(du) + abs(dv) < 1.e-14:
+                break
+        return (u, v)
+
+class BRepEdge:
+    def __init__(self, evaluator, body=None, tempId=0):
+        self.evaluator = evaluator
+        self.length = evaluator.length()
+        self.body = body
+        self.tempId = tempId
+
+class BRepCoEdge:
+    def __init__(self, edge, isOpposedToEdge, loop):
+        self.edge = edge
+        self.isOpposedToEdge = isOpposedToEdge
+        self.loop = loop
+
+class BRepLoop:
+    def __init__(self, face, isOuter=True):
+        self.face = face
+        self.isOuter = isOuter
+        self.coEdges = Collection([])
+
+class BRepFace:
+    def __init__(self, surface, body=None):
+        self.surface = surface
+        self.body = body
+        self.calls = collections.Counter() if body is None else body.calls
+        self.evaluator = SurfaceEvaluator(surface, self.calls)
+        self.loops = Collection([])
+
+# faces that share their edges, every evaluator call of the body is counted
+# in its calls
+class BRepBody:
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.faces = Collection([])
+        self.edges = Collection([])
+
+    # edge of the body along the straight (u, v) line from a to b
+    def addEdge(self, surface, a, b, warp=0.):
+        edge = BRepEdge(CurveEvaluator(surface, a, b, self.calls, warp), self, len(self.edges))
+        self.edges.items.append(edge)
+        return edge
+
+    # face with a loop for each list of (edge, isOpposedToEdge), the first is
+    # the outer loop
+    def addFace(self, surface, loops, bounds):
+        face = BRepFace(surface, self)
+        faceLoops = []
+        for iloop, coEdges in enumerate(loops):
+            loop = BRepLoop(face, iloop == 0)
+            loop.coEdges = Collection([BRepCoEdge(edge, opposed, loop) for (edge, opposed) in coEdges])
+            faceLoops.append(loop)
+        face.loops = Collection(faceLoops)
+        face.evaluator.bounds = bounds
+        self.faces.items.append(face)
+        return face
+
+# face bounded by the straight (u, v) polygon through corners, which runs
+# counterclockwise, every other edge runs against the loop like Fusion's
+# edges often do, each side is split into subdivide edges and the edges are
+# parameterized with warp
+def patch(surface, corners, subdivide=1, warp=0.):
+    face = BRepFace(surface)
+    loop = BRepLoop(face)
+    coEdges = []
+    n = len(corners)
+    for i in range(n):
+        (a, b) = (corners[i], corners[(i+1) % n])
+        for j in range(subdivide):
+            p0 = (a[0] + (b[0] - a[0]) * j / subdivide, a[1] + (b[1] - a[1]) * j / subdivide)
+            p1 = (a[0] + (b[0] - a[0]) * (j + 1) / subdivide, a[1] + (b[1] - a[1]) * (j + 1) / subdivide)
+            opposed = len(coEdges) % 2 == 1
+            if opposed:
+                (p0, p1) = (p1, p0)
+            edge = BRepEdge(CurveEvaluator(surface, p0, p1, face.calls, warp))
+            coEdges.append(BRepCoEdge(edge, opposed, loop))
+    loop.coEdges = Collection(coEdges)
+    face.loops = Collection([loop])
+    face.evaluator.bounds = (min(c[0] for c in corners), min(c[1] for c in corners),
+                             max(c[0] for c in corners), max(c[1] for c in corners))
+    face.calls.clear()
+    return face
+
+# body of the faces of a grid over the surface, cell (i, j) covers
+# [us[i], us[i+1]] x [vs[j], vs[j+1]] and neighbouring cells share the edge
+# between them, holes maps a cell to the (u0, v0, u1, v1) rectangle of a hole
+# in its face, which is filled by a face of its own when plugged
+def body(surface, us, vs, holes=None, plugged=False, warp=0.):
+    solid = BRepBody()
+    # edges along u at vs[j] and along v at us[i], both in increasing parameter
+    along = {}
+    across = {}
+    for j in range(len(vs)):
+        for i in range(len(us) - 1):
+            along[i, j] = solid.addEdge(surface, (us[i], vs[j]), (us[i+1], vs[j]), warp)
+    for i in range(len(us)):
+        for j in range(len(vs) - 1):
+            across[i, j] = solid.addEdge(surface, (us[i], vs[j]), (us[i], vs[j+1]), warp)
+
+    for i in range(len(us) - 1):
+        for j in range(len(vs) - 1):
+            # counterclockwise in (u, v)
+            loops = [[(along[i, j], False), (across[i+1, j], False), (along[i, j+1], True), (across[i, j], True)]]
+            hole = (holes or {}).get((i, j))
+            if hole is not None:
+                (u0, v0, u1, v1) = hole
+                bottom = solid.addEdge(surface, (u0, v0), (u1, v0), warp)
+                right = solid.addEdge(surface, (u1, v0), (u1, v1), warp)
+                top = solid.addEdge(surface, (u0, v1), (u1, v1), warp)
+                left = solid.addEdge(surface, (u0, v0), (u0, v1), warp)
+                # clockwise around the hole
+                loops.append([(left, False), (top, False), (right, True), (bottom, True)])
+                if plugged:
+                    solid.addFace(surface, [[(bottom, False), (right, False), (top, True), (left, True)]],
+                                  (u0, v0, u1, v1))
+            solid.addFace(surface, loops, (us[i], vs[j], us[i+1], vs[j+1]))
+    solid.calls.clear()
+    return solid
+
+# the standard patches, name -> (surface, corners)
+def patches():
+    return {
+        'cylinder': (Cylinder(10.), [(0., 0.), (1.5, 0.), (1.5, 20.), (0., 20.)]),
+        'cone': (Cone(0.6), [(0., 5.), (2.5, 5.), (2.5, 25.), (0., 25.)]),
+        'tangent': (TangentDevelopable(5., 2.), [(0., .5), (3., .5), (3., 4.), (0., 4.)]),
+        'twisted': (TwistedStrip(.05), [(-5., -5.), (5., -5.), (5., 5.), (-5., 5.)]),
+    }
+
+# exact flat points of a coedge at the curve parameters t in loop order,
+# None if the surface is not developable
+def exactPoints(coEdge, t):
+    evaluator = coEdge.edge.evaluator
+    points = []
+    for ti in t:
+        xy = evaluator.surface.flat(*evaluator.uv(ti))
+        if xy is None:
+            return None
+        points.append(xy)
+    if coEdge.isOpposedToEdge:
+        points.reverse()
+    return points
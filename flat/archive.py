@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Versioned binary archive of flattened loops.
+
+All values are little endian and every block starts on an 8 byte boundary.
+
+    header   magic b'SDFLAT\\0\\0', version u32, loop count u32, index offset u64
+    loops    one block per loop, see below
+    index    loop count u64 offsets of the loop blocks
+
+    loop     edge count u32, angle count u32, flags u32, hole count u32,
+             closure f64, bounding box 4 f64
+             relAngle f64 per angle
+             per edge: point count u32, flags u32, length3d f64
+             per edge: d, points (x, y pairs), tangents (x, y pairs) as f64
+             per hole: a loop block without holes of its own
+
+Holes are the inner loops of a face placed in its outline, version 1 archives
+have none and the hole count was reserved.
+
+The reader memory maps the file and only decodes the loops it is asked for.
+"""
+import array, mmap, struct, sys
+from .raw import RawLoop, RawEdge
+
+magic = b'SDFLAT\0\0'
+version = 2
+
+headerFormat = struct.Struct('<8sIIQ')
+loopFormat = struct.Struct('<IIIIddddd')
+edgeFormat = struct.Struct('<IId')
+
+# loop flags
+assembledFlag = 1
+# edge flags
+reverseFlag = 1
+
+def doubles(values):
+    if sys.byteorder != 'little':
+        values = array.array('d', values)
+        values.byteswap()
+    elif not isinstance(values, array.array):
+        values = array.array('d', values)
+    return values.tobytes()
+
+class ArchiveWriter:
+    def __init__(self, fname):
+        self.file = open(fname, 'wb')
+        self.offsets = array.array('Q')
+        self.file.write(headerFormat.pack(magic, version, 0, 0))
+
+    def add(self, loop):
+        self.offsets.append(self.file.tell())
+        self.write(loop)
+
+    def write(self, loop):
+        holes = loop.holes
+        closure = loop.closure
+        flags = 0
+        if closure is not None:
+            bb = loop.boundingBox
+            flags = assembledFlag
+        else:
+            bb = [0., 0., 0., 0.]
+            closure = 0.
+
+        f = self.file
+        f.write(loopFormat.pack(len(loop.edges), len(loop.relAngle), flags, len(holes), closure, bb[0], bb[1], bb[2], bb[3]))
+        f.write(doubles(loop.relAngle))
+        for edge in loop.edges:
+            f.write(edgeFormat.pack(len(edge), reverseFlag if edge.needsReverse else 0, edge.length3d))
+        for edge in loop.edges:
+            f.write(doubles(edge.d))
+            f.write(doubles(edge.points))
+            f.write(doubles(edge.tangents))
+        for hole in holes:
+            self.write(hole)
+
+    def close(self):
+        indexOffset = self.file.tell()
+        offsets = self.offsets
+        if sys.byteorder != 'little':
+            offsets = array.array('Q', offsets)
+            offsets.byteswap()
+        self.file.write(offsets.tobytes())
+        self.file.seek(0)
+        self.file.write(headerFormat.pack(magic, version, len(self.offsets), indexOffset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def writeArchive(fname, loops):
+    with ArchiveWriter(fname) as writer:
+        for loop in loops:
+            writer.add(loop)
+
+class ArchiveReader:
+    def __init__(self, fname, useMmap=True):
+        self.file = open(fname, 'rb')
+        if useMmap:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.buffer = self.file.read()
+        self.view = memoryview(self.buffer)
+
+        (m, v, count, indexOffset) = headerFormat.unpack_from(self.view, 0)
+        if m != magic:
+            raise ValueError("{} is not a flattened loop archive".format(fname))
+        if v > version:
+            raise ValueError("archive version {} is newer than supported version {}".format(v, version))
+        self.version = v
+        self.indexOffset = indexOffset
+        self.offsets = self.array('Q', indexOffset, count)
+
+    def array(self, typecode, offset, count):
+        size = array.array(typecode).itemsize
+        a = array.array(typecode, self.view[offset:offset + count*size].cast(typecode))
+        if sys.byteorder != 'little':
+            a.byteswap()
+        return a
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # closure error and bounding box without decoding the points,
+    # None if the loop was not assembled when it was saved
+    def summary(self, i):
+        (nedges, nangles, flags, nholes, closure, x0, y0, x1, y1) = loopFormat.unpack_from(self.view, self.offsets[i])
+        if not flags & assembledFlag:
+            return None
+        return closure, [x0, y0, x1, y1]
+
+    def loop(self, i):
+        return self.decode(self.offsets[i])[0]
+
+    # the loop in the block at offset with its holes, and the offset after it
+    def decode(self, offset):
+        (nedges, nangles, flags, nholes, closure, x0, y0, x1, y1) = loopFormat.unpack_from(self.view, offset)
+        offset = offset + loopFormat.size
+        relAngle = self.array('d', offset, nangles)
+        offset = offset + 8 * nangles
+
+        headers = []
+        for iedge in range(nedges):
+            headers.append(edgeFormat.unpack_from(self.view, offset))
+            offset = offset + edgeFormat.size
+
+        edges = []
+        for (npts, eflags, length3d) in headers:
+            d = self.array('d', offset, npts)
+            offset = offset + 8 * npts
+            points = self.array('d', offset, 2 * npts)
+            offset = offset + 16 * npts
+            tangents = self.array('d', offset, 2 * npts)
+            offset = offset + 16 * npts
+            edges.append(RawEdge.fromPoints(bool(eflags & reverseFlag), length3d, d, points, tangents))
+
+        raw = RawLoop.fromEdges(edges, relAngle)
+        if flags & assembledFlag:
+            raw.closure = closure
+            raw.boundingBox = array.array('d', [x0, y0, x1, y1])
+        for ihole in range(nholes):
+            (hole, offset) = self.decode(offset)
+            raw.holes.append(hole)
+        return raw, offset
+
+    # the bytes loop i is stored as, a key for anything derived from it
+    def block(self, i):
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.indexOffset
+        return self.view[self.offsets[i]:end]
+
+    def loops(self):
+        for i in range(len(self)):
+            yield self.loop(i)
+
+    def close(self):
+        self.view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def readArchive(fname):
+    with ArchiveReader(fname) as reader:
+        return list(reader.loops())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Arc length to curve parameter table.
+
+The arc length s(t) is the integral of the speed |r_t| over [t0, t].  It is
+integrated once per edge by adaptive 5 point Gauss-Legendre quadrature, the
+panel ends become the knots of a monotone cubic (Fritsch-Carlson) for t(s)
+so looking a parameter up costs a bisection and a cubic.
+"""
+import bisect, math
+
+gaussNodes = (-0.9061798459386640, -0.5384693101056831, 0., 0.5384693101056831, 0.9061798459386640)
+gaussWeights = (0.2369268850561891, 0.4786286704993665, 0.5688888888888889, 0.4786286704993665, 0.2369268850561891)
+
+class ArcLengthTable:
+    # speed(t) -> |r_t|, panels start out uniform in t and are halved until the
+    # two halves agree with the whole to rtol
+    def __init__(self, speed, t0, t1, rtol=1.e-8, panels=2, maxDepth=20):
+        self.nfev = 0
+        self.t = [t0]
+        self.s = [0.]
+        h = (t1 - t0) / panels
+        for i in range(panels):
+            a = t0 + i * h
+            b = t1 if i == panels - 1 else a + h
+            self.panel(speed, a, b, self.gauss(speed, a, b), rtol, maxDepth)
+        self.length = self.s[-1]
+        self.slopes = monotoneSlopes(self.s, self.t)
+
+    def gauss(self, speed, a, b):
+        self.nfev = self.nfev + len(gaussNodes)
+        half = (b - a) / 2.
+        return half * math.fsum(w * speed(a + half * (x + 1.)) for x, w in zip(gaussNodes, gaussWeights))
+
+    def panel(self, speed, a, b, whole, rtol, depth):
+        m = (a + b) / 2.
+        left = self.gauss(speed, a, m)
+        right = self.gauss(speed, m, b)
+        if depth <= 0 or abs(left + right - whole) <= rtol * abs(left + right):
+            self.t.extend((m, b))
+            self.s.extend((self.s[-1] + left, self.s[-1] + left + right))
+            return
+        self.panel(speed, a, m, left, rtol, depth - 1)
+        self.panel(speed, m, b, right, rtol, depth - 1)
+
+    # parameter at arc length s from the start
+    def parameter(self, s):
+        i = min(max(bisect.bisect_right(self.s, s) - 1, 0), len(self.s) - 2)
+        return self.hermite(i, s)
+
+    # parameters at increasing arc lengths, one sweep through the knots
+    def parameters(self, distances):
+        tvec = []
+        i = 0
+        last = len(self.s) - 2
+        for s in distances:
+            while i < last and self.s[i+1] <= s:
+                i = i + 1
+            tvec.append(self.hermite(i, s))
+        return tvec
+
+    def hermite(self, i, s):
+        (s0, s1) = (self.s[i], self.s[i+1])
+        h = s1 - s0
+        if h <= 0.:
+            return self.t[i]
+        x = (s - s0) / h
+        (t0, t1) = (self.t[i], self.t[i+1])
+        (m0, m1) = (self.slopes[i] * h, self.slopes[i+1] * h)
+        x2 = x * x
+        x3 = x2 * x
+        return ((2.*x3 - 3.*x2 + 1.) * t0 + (x3 - 2.*x2 + x) * m0 +
+                (-2.*x3 + 3.*x2) * t1 + (x3 - x2) * m1)
+
+# Fritsch-Carlson slopes, the cubic through the knots with them is monotone
+# wherever the data is
+def monotoneSlopes(x, y):
+    n = len(x)
+    h = [x[k+1] - x[k] for k in range(n - 1)]
+    delta = [(y[k+1] - y[k]) / h[k] if h[k] > 0. else 0. for k in range(n - 1)]
+    slopes = [delta[0]]
+    for k in range(1, n - 1):
+        if delta[k-1] * delta[k] <= 0.:
+            slopes.append(0.)
+        else:
+            w1 = 2.*h[k] + h[k-1]
+            w2 = h[k] + 2.*h[k-1]
+            slopes.append((w1 + w2) / (w1 / delta[k-1] + w2 / delta[k]))
+    slopes.append(delta[-1])
+    return slopes
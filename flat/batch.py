@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched Bogacki-Shampine integration of all the edges of a loop at once.
+
+Each row of the (n_edges, 4) state array is one edge integrated over
+normalized parameter time s in [0, 1] so rows with different parameter
+ranges advance in lockstep.  Every row keeps its own step size and rows that
+reach the end of their edge are masked out of the remaining steps.
+
+numpy is optional for the rest of the package and only needed here.
+"""
+from .ode23 import defaultOptions, SolverStats
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# builds a batched rhs for edges whose rhs is linear in the velocity,
+# x_tt + i y_tt = (A + iB)(x_t + i y_t), from per edge coefficient functions
+# coefs[i](t) -> (A, B)
+def linearRhs(coefs):
+    def f(rows, t, x):
+        AB = np.array([coefs[r](tr) for r, tr in zip(rows, t)]).reshape(-1, 2)
+        A = AB[:, 0]
+        B = AB[:, 1]
+        x_t = np.empty_like(x)
+        x_t[:, 0] = x[:, 2]
+        x_t[:, 1] = x[:, 3]
+        x_t[:, 2] = A * x[:, 2] - B * x[:, 3]
+        x_t[:, 3] = A * x[:, 3] + B * x[:, 2]
+        return x_t
+    return f
+
+# f(rows, t, x) returns dx/dt for the state rows x at parameter values t
+# x0 is the initial state of every row, tvecs the output parameters of each row
+# returns the states at each row's tvec as lists of lists like ode23 and a
+# SolverStats per row
+def ode23Batch(f, x0, tvecs, options=None, maxSteps=100000):
+    if np is None:
+        raise ImportError("the batch integrator requires numpy")
+
+    if options is None:
+        options = defaultOptions
+    rtol = options.rtol
+    x = np.array(x0, dtype=float)
+    n, m = x.shape
+    threshold = np.asarray(options.thresholds(m), dtype=float)
+
+    t0 = np.array([tv[0] for tv in tvecs], dtype=float)
+    span = np.array([tv[-1] - tv[0] for tv in tvecs], dtype=float)
+    nodes = [(np.asarray(tv, dtype=float) - tv[0]) / (tv[-1] - tv[0]) for tv in tvecs]
+
+    s = np.zeros(n)
+    inext = np.ones(n, dtype=int)
+    snext = np.array([nd[1] for nd in nodes])
+    allRows = np.arange(n)
+
+    # derivatives are with respect to s
+    def g(rows, sr, xr):
+        return f(rows, t0[rows] + sr * span[rows], xr) * span[rows, None]
+
+    s1 = g(allRows, s, x)
+    nfev = np.ones(n, dtype=int)
+
+    # initial step, 1 / max (dx/ds / x0_threshold), capped by the first node
+    scale = np.maximum(threshold, np.abs(x))
+    rh = np.max(np.abs(s1) / scale, axis=1)
+    h = np.where(rh > 0., 1. / np.where(rh > 0., rh, 1.), 1.)
+    h = np.minimum(h, snext)
+
+    xOut = [[list(x0[i])] for i in range(n)]
+    active = np.ones(n, dtype=bool)
+    accepted = np.zeros(n, dtype=int)
+    rejected = np.zeros(n, dtype=int)
+    # sum of the local error estimates of the accepted steps
+    error = np.zeros((n, m))
+    # and of their components across the velocity, see SolverStats.angle
+    angle = np.zeros(n)
+    steps = 0
+    while active.any():
+        steps = steps + 1
+        if steps > maxSteps:
+            raise RuntimeError("batch integration did not converge")
+
+        rows = allRows[active]
+        xr = x[rows]
+        sr = s[rows]
+        k1 = s1[rows]
+
+        # never step past the next output node
+        hr = h[rows]
+        remaining = snext[rows] - sr
+        hitNode = hr >= remaining
+        hr = np.where(hitNode, remaining, hr)
+        hc = hr[:, None]
+
+        k2 = g(rows, sr + hr/2., xr + hc/2. * k1)
+        k3 = g(rows, sr + 3.*hr/4., xr + 3.*hc/4. * k2)
+        snew = np.where(hitNode, snext[rows], sr + hr)
+        xnew = xr + hc/9. * (2.*k1 + 3.*k2 + 4.*k3)
+        k4 = g(rows, snew, xnew)
+        nfev[rows] = nfev[rows] + 3
+
+        e = hc/72. * (-5.*k1 + 6.*k2 + 8.*k3 - 9.*k4)
+        err = np.max(np.abs(e) / np.maximum(threshold, np.abs(xnew)), axis=1)
+        ok = err <= rtol
+
+        # per row step control, grow or shrink h from the local error
+        fac = np.where(err > 0., 0.9 * (rtol / np.where(err > 0., err, 1.)) ** (1./3.), 5.)
+        h[rows] = hr * np.clip(fac, 0.2, 5.)
+
+        # accepted rows move forward, FSAL so s4 becomes s1 of the next step
+        good = rows[ok]
+        accepted[rows] = accepted[rows] + ok
+        rejected[rows] = rejected[rows] + ~ok
+        error[good] = error[good] + np.abs(e[ok])
+        if m >= 4:
+            v = xnew[ok]
+            speed2 = v[:, 2]**2 + v[:, 3]**2
+            cross = np.abs(v[:, 2] * e[ok, 3] - v[:, 3] * e[ok, 2])
+            angle[good] = angle[good] + np.where(speed2 > 0., cross / np.where(speed2 > 0., speed2, 1.), 0.)
+        x[good] = xnew[ok]
+        s[good] = snew[ok]
+        s1[good] = k4[ok]
+
+        # record rows that landed on an output node and retire finished rows
+        for i in good[hitNode[ok]]:
+            xOut[i].append(x[i].tolist())
+            inext[i] = inext[i] + 1
+            if inext[i] < len(nodes[i]):
+                snext[i] = nodes[i][inext[i]]
+            else:
+                active[i] = False
+
+    stats = []
+    for i in range(n):
+        row = SolverStats(m)
+        (row.accepted, row.rejected, row.nfev) = (int(accepted[i]), int(rejected[i]), int(nfev[i]))
+        row.error = error[i].tolist()
+        row.angle = float(angle[i])
+        stats.append(row)
+    return xOut, stats
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Whole body flattening with the curve geometry shared between faces.
+
+Neighbouring faces meet at an edge and each of them has a coedge on it.
+What the flattening takes from the curve, the strokes and arc lengths that
+place the output nodes and the position, derivatives, tangent and curvature
+at every rhs sample, is the same for both coedges.  Only the surface normal
+that turns the curvature into geodesic curvature depends on the face.
+
+A BodyWalk orders the selected faces breadth first over their face-edge
+adjacency so the faces on either side of an edge are flattened close
+together.  It keeps an EdgeGeometry with the curve quantities of each edge
+until the last coedge on it has been sampled, and each face only adds its
+normals.  Flattening face by face evaluates all of it once per coedge, so
+about half the evaluator calls of an interior edge go away.
+
+Every loop of a face is flattened, not only the outer one.  A hole is placed
+in the flattened outline by a bridge from the nearest vertex of the outer
+loop to the nearest vertex of the hole.  The bridge is the straight line
+between them in the face's parameter space, flattened from the surface
+derivatives like an edge.  It carries the position and direction across the
+face, so it assumes the surface is smooth between the two vertices.
+"""
+import math, collections
+from functools import partial
+from .raw import RawEdge, cornerAngles, edgeEnds, cacheSize
+from .cache import ParameterCache
+from .pipeline import EdgeSamples, LoopSamples
+from .quad import flattenQuad
+
+# the curve quantities of one BRepEdge for every coedge on it, made from the
+# first coedge reached with its options and stroke tolerance
+class EdgeGeometry:
+    def __init__(self, coEdge, options=None, fitTol=None):
+        self.edge = coEdge.edge
+        # the strokes, arc lengths and start state
+        self.prepared = RawEdge(coEdge, None, options, fitTol)
+        self.ends = edgeEnds(self.edge)
+        # (p, A, tangent, curvature, speed) by curve parameter
+        self.cache = ParameterCache(self.prepared.tvec[0], self.prepared.tvec[-1], cacheSize)
+
+    # copies of the ends for flat.raw.cornerAngles, which reverses them in place
+    def endsCopy(self):
+        return tuple(v.copy() for v in self.ends)
+
+    # RawEdge.coefficients split into what the curve gives
+    def curve(self, t):
+        q = self.cache.get(t)
+        if q is not None:
+            return q
+
+        edgeEval = self.edge.evaluator
+        (ret, p) = edgeEval.getPointAtParameter(t)
+        (ret, r_t) = edgeEval.getFirstDerivative(t)
+        (ret, r_tt) = edgeEval.getSecondDerivative(t)
+        (ret, tangent) = edgeEval.getTangent(t)
+        tangent.normalize()
+        (ret, curveDir, curveMag) = edgeEval.getCurvature(t)
+        curveDir.normalize()
+        curvature = curveDir.copy()
+        curvature.scaleBy(curveMag)
+
+        A = r_t.dotProduct(r_tt) / r_t.dotProduct(r_t)
+        q = (p, A, tangent, curvature, r_t.length)
+        self.cache.put(t, q)
+        return q
+
+    # and what the face gives, edge is a RawEdge made with RawEdge.sharing
+    # from this geometry, the result is the same as RawEdge.coefficients
+    def coefficients(self, edge, face, t):
+        AB = edge.cache.get(t)
+        if AB is not None:
+            return AB
+
+        (p, A, tangent, curvature, speed) = self.curve(t)
+        (ret, surfaceNormal) = face.evaluator.getNormalAtPoint(p)
+        surfaceNormal.normalize()
+        tmp = surfaceNormal.crossProduct(tangent)
+        B = curvature.dotProduct(tmp) * speed
+        edge.cache.put(t, (A, B))
+        return (A, B)
+
+# the faces of a selection in the order they are flattened, breadth first
+# over the edges they share, and the EdgeGeometry of the edges in use
+class BodyWalk:
+    def __init__(self, faces):
+        self.bodies = []
+        users = collections.defaultdict(list)
+        keys = []
+        for iface, face in enumerate(faces):
+            faceKeys = []
+            for loop in faceLoops(face):
+                for iedge in range(loop.coEdges.count):
+                    k = self.key(loop.coEdges.item(iedge).edge)
+                    faceKeys.append(k)
+                    users[k].append(iface)
+            keys.append(faceKeys)
+        self.keys = keys
+
+        # indices into faces, one run of faces per connected group
+        self.order = []
+        self.groups = 0
+        reached = [False] * len(faces)
+        for first in range(len(faces)):
+            if reached[first]:
+                continue
+            self.groups = self.groups + 1
+            reached[first] = True
+            queue = collections.deque([first])
+            while queue:
+                iface = queue.popleft()
+                self.order.append(iface)
+                for k in keys[iface]:
+                    for other in users[k]:
+                        if not reached[other]:
+                            reached[other] = True
+                            queue.append(other)
+
+        # coedges on each edge left to sample
+        self.uses = {k: len(faceList) for k, faceList in users.items()}
+        self.shared = sum(1 for faceList in users.values() if len(set(faceList)) > 1)
+        self.geometry = {}
+
+    # Fusion hands out a new object every time an edge is reached, edges are
+    # told apart by their tempId within a body and the bodies by comparing them
+    def key(self, edge):
+        body = edge.body
+        for ibody, other in enumerate(self.bodies):
+            if other == body:
+                return (ibody, edge.tempId)
+        self.bodies.append(body)
+        return (len(self.bodies) - 1, edge.tempId)
+
+    def geometryOf(self, coEdge, options=None, fitTol=None):
+        k = self.key(coEdge.edge)
+        geometry = self.geometry.get(k)
+        if geometry is None:
+            geometry = EdgeGeometry(coEdge, options, fitTol)
+            self.geometry[k] = geometry
+        return k, geometry
+
+    # one coedge on the edge is done, the geometry goes with the last one
+    def release(self, k):
+        self.uses[k] = self.uses[k] - 1
+        if self.uses[k] <= 0:
+            self.geometry.pop(k, None)
+
+    # a face that is not sampled, from a cache or cancelled, by walk index
+    def skip(self, iface):
+        for k in self.keys[iface]:
+            self.release(k)
+
+# the loops of a face, the outer loop first
+def faceLoops(face):
+    loops = [face.loops.item(i) for i in range(face.loops.count)]
+    loops.sort(key=lambda loop: not loop.isOuter)
+    return loops
+
+# the sampled loops of a face and where each of their coedges starts, as
+# (point, first derivative) in the direction of the loop
+class FaceSamples:
+    def __init__(self):
+        self.loops = []
+        self.starts = []
+
+# flat.pipeline.extractSteps for every loop of a face with the curve
+# geometry taken from the walk, loops are the face's BRepLoops from
+# faceLoops, or stand-ins for them, yields per loop prepared and per edge
+# sampled and returns the FaceSamples
+def sampleSteps(walk, loops, options=None, fitTol=None):
+    samples = FaceSamples()
+    for loop in loops:
+        coEdges = [loop.coEdges.item(iedge) for iedge in range(loop.coEdges.count)]
+        shared = [walk.geometryOf(ce, options, fitTol) for ce in coEdges]
+        relAngle = cornerAngles(coEdges, lambda edge: walk.geometry[walk.key(edge)].endsCopy())
+
+        starts = []
+        for ce, (k, geometry) in zip(coEdges, shared):
+            (p0, tang0, p1, tang1) = geometry.endsCopy()
+            if ce.isOpposedToEdge:
+                tang1.scaleBy(-1.)
+                starts.append((p1, tang1))
+            else:
+                starts.append((p0, tang0))
+        samples.starts.append(starts)
+        yield
+
+        edges = []
+        for ce, (k, geometry) in zip(coEdges, shared):
+            edge = RawEdge.sharing(ce, geometry.prepared)
+            coef = partial(EdgeGeometry.coefficients, geometry, edge, ce.loop.face)
+            edges.append(EdgeSamples(edge, coef))
+            walk.release(k)
+            yield
+        samples.loops.append(LoopSamples(relAngle, edges))
+    return samples
+
+# put the assembled holes into the assembled outline of a face, starts are
+# the FaceSamples starts of the outline then the holes, the holes are moved
+# into place and become the outline's holes
+def placeHoles(outline, holes, starts, face, options=None):
+    for hole, holeStarts in zip(holes, starts[1:]):
+        placeHole(outline, hole, starts[0], holeStarts, face.evaluator, options)
+        outline.holes.append(hole)
+
+def placeHole(outline, hole, outerStarts, holeStarts, faceEval, options=None):
+    pairs = [(i, j) for i in range(len(outerStarts)) for j in range(len(holeStarts))]
+    (i, j) = min(pairs, key=lambda ij: outerStarts[ij[0]][0].distanceTo(holeStarts[ij[1]][0]))
+    (p, tp) = outerStarts[i]
+    (q, tq) = holeStarts[j]
+
+    # heading of the outline at p in the plane, turned onto the bridge and
+    # along it, then onto the hole
+    (x0, y0) = outline.edges[i].point(0)
+    to = outline.edges[i].tangent(0)
+    heading = math.atan2(to[1], to[0])
+    if p.distanceTo(q) > 0.:
+        (b0, n0, b1, n1, (x, y, xt, yt)) = bridge(faceEval, p, q, options)
+        heading = heading + signedAngle(tp.asArray(), b0, n0)
+        (c, s) = (math.cos(heading), math.sin(heading))
+        (qx, qy) = (x0 + c*x - s*y, y0 + s*x + c*y)
+        heading = heading + math.atan2(yt, xt) + signedAngle(b1, tq.asArray(), n1)
+    else:
+        (ret, n) = faceEval.getNormalAtPoint(p)
+        (qx, qy) = (x0, y0)
+        heading = heading + signedAngle(tp.asArray(), tq.asArray(), n.asArray())
+
+    th = hole.edges[j].tangent(0)
+    hole.rotate(heading - math.atan2(th[1], th[0]))
+    (hx, hy) = hole.edges[j].point(0)
+    hole.translateBy(qx - hx, qy - hy)
+
+# flatten the straight line in the parameter space of the face from the
+# points p to q, returns its first derivative and the surface normal at
+# either end and the flat state (x, y, x_t, y_t) at q, starting at the
+# origin along x
+def bridge(faceEval, p, q, options=None):
+    (ret, uv0) = faceEval.getParameterAtPoint(p)
+    (ret, uv1) = faceEval.getParameterAtPoint(q)
+    (du, dv) = (uv1.x - uv0.x, uv1.y - uv0.y)
+
+    def geometry(t):
+        uv = uv0.copy()
+        uv.x = uv0.x + t*du
+        uv.y = uv0.y + t*dv
+        (ret, su, sv) = faceEval.getFirstDerivative(uv)
+        (ret, suu, suv, svv) = faceEval.getSecondDerivative(uv)
+        (ret, n) = faceEval.getNormalAtParameter(uv)
+        (su, sv, suu, suv, svv) = (su.asArray(), sv.asArray(), suu.asArray(), suv.asArray(), svv.asArray())
+        r_t = [du*a + dv*b for a, b in zip(su, sv)]
+        r_tt = [du*du*a + 2.*du*dv*b + dv*dv*c for a, b, c in zip(suu, suv, svv)]
+        return r_t, r_tt, normalized(n.asArray())
+
+    # the rhs coefficients of an edge from the derivatives alone, the
+    # geodesic curvature times the speed is r_tt . (n x r_t) / |r_t|^2
+    def coef(t):
+        (r_t, r_tt, n) = geometry(t)
+        speed2 = dot(r_t, r_t)
+        return (dot(r_t, r_tt) / speed2, dot(r_tt, cross(n, r_t)) / speed2)
+
+    (b0, tt0, n0) = geometry(0.)
+    (b1, tt1, n1) = geometry(1.)
+    [xOut, stats] = flattenQuad(coef, [0., 0., math.sqrt(dot(b0, b0)), 0.], [0., 1.], options)
+    return b0, n0, b1, n1, xOut[-1]
+
+def dot(a, b):
+    return a[0]*b[0] + a[1]*b[1] + a[2]*b[2]
+
+def cross(a, b):
+    return [a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2], a[0]*b[1] - a[1]*b[0]]
+
+def normalized(a):
+    l = math.sqrt(dot(a, a))
+    return [c / l for c in a] if l > 0. else a
+
+# angle from a to b, positive counterclockwise about n
+def signedAngle(a, b, n):
+    c = cross(a, b)
+    return math.atan2(math.copysign(math.sqrt(dot(c, c)), dot(c, n)), dot(a, b))
@@ -0,0 +1,39 @@
+import collections
+
+# bounded least recently used cache of geometry evaluated at a curve parameter
+# keys are quantized to a fraction of the parameter range so stage times that
+# land on the same node from different step sizes share an entry
+class ParameterCache:
+    def __init__(self, t0, t1, maxSize=4096, resolution=1.e-12):
+        self.t0 = t0
+        self.scale = 1. / (resolution * (abs(t1 - t0) or 1.))
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, t):
+        return int(round((t - self.t0) * self.scale))
+
+    def get(self, t):
+        k = self.key(t)
+        value = self.entries.get(k)
+        if value is None:
+            self.misses = self.misses + 1
+            return None
+        self.entries.move_to_end(k)
+        self.hits = self.hits + 1
+        return value
+
+    def put(self, t, value):
+        k = self.key(t)
+        self.entries[k] = value
+        self.entries.move_to_end(k)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
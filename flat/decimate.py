@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decimation of flattened edges before they are drawn.
+
+The integrator places stroke points for accuracy, not for drawing, so most of
+them can be dropped without the polyline through the rest moving more than
+the cut tolerance.  Douglas-Peucker keeps the end points of every edge so the
+edges of a loop still meet.
+
+That only bounds the distance of the points themselves.  An edge with a
+dense output is checked between its points first, with samples from the
+dense output added only where the curve between two of them strays from
+their chord, so the simplified polyline follows the curve and not only its
+points.
+"""
+import math
+
+class DecimationStats:
+    def __init__(self):
+        self.kept = 0
+        self.dropped = 0
+
+    def __repr__(self):
+        return "kept {} dropped {}".format(self.kept, self.dropped)
+
+# Douglas-Peucker simplification of a polyline, no point of the original is
+# further than tolerance from the simplified polyline
+def simplify(x, y, tolerance, stats=None):
+    n = len(x)
+    if n < 3:
+        keep = [True] * n
+    else:
+        keep = [False] * n
+        keep[0] = keep[-1] = True
+        stack = [(0, n - 1)]
+        while stack:
+            (i, j) = stack.pop()
+            worst = 0.
+            index = -1
+            for k in range(i + 1, j):
+                dist = pointSegment(x[k], y[k], x[i], y[i], x[j], y[j])
+                if dist > worst:
+                    worst = dist
+                    index = k
+            if worst > tolerance:
+                keep[index] = True
+                stack.append((i, index))
+                stack.append((index, j))
+
+    xs = [x[k] for k in range(n) if keep[k]]
+    ys = [y[k] for k in range(n) if keep[k]]
+    if stats is not None:
+        stats.kept = stats.kept + len(xs)
+        stats.dropped = stats.dropped + n - len(xs)
+    return xs, ys
+
+# points of a RawEdge with a dense output to simplify instead of its own, its
+# points with the dense output at the parameter midway between two of them
+# added while it is further than tolerance from their chord, the test is on
+# the plain dense states since the rigid transform and the small length
+# correction hardly change how far a curve strays from its chord, only the
+# samples that are added go through the edge's pointAt
+def denseSamples(edge, tolerance, maxDepth=8):
+    (xn, yn) = edge.xy()
+    if edge.tvec is None:
+        return list(xn), list(yn)
+    t = list(edge.tvec)
+    if edge.flipped:
+        t.reverse()
+    dense = edge.denseOutput()
+    states = [dense.state(v) for v in t]
+
+    x = [xn[0]]
+    y = [yn[0]]
+    for i in range(len(t) - 1):
+        stack = [(t[i], states[i], t[i+1], states[i+1], (xn[i+1], yn[i+1]), 0)]
+        while stack:
+            (ta, a, tb, b, end, depth) = stack.pop()
+            tm = (ta + tb) / 2.
+            m = dense.state(tm)
+            if depth < maxDepth and pointSegment(m[0], m[1], a[0], a[1], b[0], b[1]) > tolerance:
+                # the second half goes first so the points come off in order
+                stack.append((tm, m, tb, b, end, depth + 1))
+                stack.append((ta, a, tm, m, edge.pointAt(tm), depth + 1))
+            else:
+                x.append(end[0])
+                y.append(end[1])
+    return x, y
+
+# how an edge simplified to x, y should be drawn, 'polyline' or 'spline'
+# mode 'auto' draws straight edges as lines and everything else as a spline
+def edgeStyle(x, y, mode='auto'):
+    if mode != 'auto':
+        return mode
+    return 'polyline' if len(x) <= 2 else 'spline'
+
+def pointSegment(px, py, ax, ay, bx, by):
+    ex = bx - ax
+    ey = by - ay
+    ll = ex*ex + ey*ey
+    t = 0. if ll == 0. else max(0., min(1., ((px - ax)*ex + (py - ay)*ey) / ll))
+    return math.hypot(px - ax - t*ex, py - ay - t*ey)
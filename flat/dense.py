@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dense output of a flattened edge.
+
+The integrators append the state x = (x, y, x_t, y_t) and its derivative f at
+the end of every accepted step, a cubic Hermite through two neighbouring
+knots is Bogacki-Shampine's own interpolant and costs no extra evaluations.
+The position and velocity are then known at any parameter value, and with
+the arc length of the flat curve at any distance along it, so outlines can
+be resampled without integrating again.
+"""
+import array, bisect, math
+
+# 3 point Gauss-Legendre on [0, 1] for the arc length of one knot interval
+gaussNodes = (0.5 - math.sqrt(15.) / 10., 0.5, 0.5 + math.sqrt(15.) / 10.)
+gaussWeights = (5./18., 4./9., 5./18.)
+
+class DenseOutput:
+    def __init__(self):
+        self.t = array.array('d')
+        self.x = array.array('d')
+        self.f = array.array('d')
+        # arc length at each knot, built when first needed
+        self.s = None
+
+    def append(self, t, x, f):
+        self.t.append(t)
+        self.x.extend(x[:4])
+        self.f.extend(f[:4])
+        self.s = None
+
+    def __len__(self):
+        return len(self.t)
+
+    # index of the knot interval holding t
+    def interval(self, t):
+        return min(max(bisect.bisect_right(self.t, t) - 1, 0), len(self.t) - 2)
+
+    # state at t from the Hermite cubic of interval i
+    def hermite(self, i, t):
+        (t0, t1) = (self.t[i], self.t[i+1])
+        h = t1 - t0
+        r = (t - t0) / h
+        r2 = r * r
+        r3 = r2 * r
+        h00 = 2.*r3 - 3.*r2 + 1.
+        h10 = (r3 - 2.*r2 + r) * h
+        h01 = -2.*r3 + 3.*r2
+        h11 = (r3 - r2) * h
+        (x, f) = (self.x, self.f)
+        (j, k) = (4*i, 4*i + 4)
+        return [h00*x[j+c] + h10*f[j+c] + h01*x[k+c] + h11*f[k+c] for c in range(4)]
+
+    # [x, y, x_t, y_t] at t
+    def state(self, t):
+        return self.hermite(self.interval(t), t)
+
+    def speed(self, i, t):
+        v = self.hermite(i, t)
+        return math.hypot(v[2], v[3])
+
+    # flat arc length of interval i from its start to t
+    def partialLength(self, i, t):
+        t0 = self.t[i]
+        return (t - t0) * math.fsum(w * self.speed(i, t0 + (t - t0) * r)
+                                    for r, w in zip(gaussNodes, gaussWeights))
+
+    def lengths(self):
+        if self.s is None:
+            s = [0.]
+            for i in range(len(self.t) - 1):
+                s.append(s[-1] + self.partialLength(i, self.t[i+1]))
+            self.s = array.array('d', s)
+        return self.s
+
+    # flat arc length from the first knot to t, the whole length without t
+    def length(self, t=None):
+        s = self.lengths()
+        if t is None:
+            return s[-1]
+        i = self.interval(t)
+        return s[i] + self.partialLength(i, t)
+
+    # parameter at flat arc length s from the first knot, Newton steps kept
+    # inside the knot interval by bisection
+    def parameter(self, s, tol=1.e-12, maxIterations=50):
+        lengths = self.lengths()
+        if s <= 0.:
+            return self.t[0]
+        if s >= lengths[-1]:
+            return self.t[-1]
+        i = min(bisect.bisect_right(lengths, s) - 1, len(self.t) - 2)
+        (lo, hi) = (self.t[i], self.t[i+1])
+        target = s - lengths[i]
+        t = lo + (hi - lo) * target / max(lengths[i+1] - lengths[i], 1.e-300)
+        for iteration in range(maxIterations):
+            g = self.partialLength(i, t) - target
+            if abs(g) <= tol * lengths[-1]:
+                break
+            if g > 0.:
+                hi = t
+            else:
+                lo = t
+            v = self.speed(i, t)
+            tn = t - g / v if v > 0. else lo - 1.
+            t = tn if lo < tn < hi else (lo + hi) / 2.
+        return t
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming DXF and SVG export of flattened loops.
+
+Outlines are written out as they are added so an export only holds the loop
+being written, however many go into the file.  The extents the headers need
+are only known at the end, they are written as fixed width fields and filled
+in when the writer is closed, like the header of an archive.
+
+Edges are drawn the way the sketch draws them, simplified to the cut
+tolerance and then as a fitted spline or a polyline by
+flat.decimate.edgeStyle.  Edges that still have the dense output of their
+integration get samples from it between their points where the points alone
+would miss the curve, see flat.decimate.denseSamples.  A spline is the
+Hermite cubic through the points with the flat end tangents.  SVG gets a path per loop with the splines as
+cubic Beziers and DXF gets LWPOLYLINE entities and SPLINE entities with the
+same Beziers as their control points, in an R2000 drawing with the tables,
+blocks and dictionary strict readers expect.
+
+Units are cm like the outlines, y points up in both files.
+"""
+import os, math
+from .decimate import simplify, denseSamples, edgeStyle
+
+# digits after the point of every coordinate, cm
+precision = 6
+# SVG stroke widths in cm
+strokeWidth = .02
+sheetStrokeWidth = .05
+# handles of the DXF entities start here so they are all eight hex digits
+# and $HANDSEED can be filled in when the writer is closed
+firstHandle = 0x10000000
+
+# the curves an assembled loop is drawn with, (style, x, y, startTangent,
+# endTangent) per edge with unit tangents, style is 'spline' or 'polyline'
+# the points are simplified to tolerance when it is given, from the dense
+# output of edges that have one
+def loopCurves(loop, tolerance=None, mode='spline', stats=None):
+    curves = []
+    for edge in loop.edges:
+        (x, y) = edge.xy()
+        if tolerance is not None:
+            if edge.dense is not None:
+                (x, y) = denseSamples(edge, tolerance)
+            (x, y) = simplify(x, y, tolerance, stats)
+        curves.append((edgeStyle(x, y, mode), list(x), list(y),
+                       unit(edge.tangent(0)), unit(edge.tangent(-1))))
+    return curves
+
+# loopCurves of the outline then of each of its holes
+def outlineCurves(loop, tolerance=None, mode='spline', stats=None):
+    return [loopCurves(l, tolerance, mode, stats) for l in [loop] + loop.holes]
+
+def unit(v):
+    l = math.hypot(v[0], v[1])
+    return (v[0] / l, v[1] / l) if l > 0. else (1., 0.)
+
+# writer for a file name ending in one of the extensions of formats
+def openWriter(fname):
+    writer = formats.get(os.path.splitext(fname)[1].lower())
+    if writer is None:
+        raise ValueError("cannot tell the export format of {}, expected one of {}".format(
+            fname, ", ".join(sorted(formats))))
+    return writer(fname)
+
+# what the DXF and SVG writers share, the file, the extents and the placement
+# of curves by a rotation theta in radians about the origin then dx, dy
+class OutlineWriter:
+    def __init__(self, fname):
+        self.file = open(fname, 'w', newline='\n')
+        self.extents = None
+        self.loops = 0
+        self.header()
+
+    # draw an assembled loop and its holes, see loopCurves
+    def addLoop(self, loop, dx=0., dy=0., tolerance=None, mode='spline', stats=None):
+        self.addOutline(outlineCurves(loop, tolerance, mode, stats), 0., dx, dy)
+
+    # curves from outlineCurves placed by theta, dx, dy
+    def addOutline(self, paths, theta=0., dx=0., dy=0.):
+        for curves in paths:
+            self.addCurves(curves, theta, dx, dy)
+
+    # curves from loopCurves placed by theta, dx, dy
+    def addCurves(self, curves, theta=0., dx=0., dy=0.):
+        self.writeLoop([self.place(curve, theta, dx, dy) for curve in curves])
+        self.loops = self.loops + 1
+
+    # outline of a sheet of stock with its lower left corner at x, y
+    def addSheet(self, x, y, width, height):
+        self.grow([x, x + width], [y, y + height])
+        self.writeSheet(x, y, width, height)
+
+    def place(self, curve, theta, dx, dy):
+        (style, x, y, t0, t1) = curve
+        (c, s) = (math.cos(theta), math.sin(theta))
+        xp = [c*a - s*b + dx for a, b in zip(x, y)]
+        yp = [s*a + c*b + dy for a, b in zip(x, y)]
+        self.grow(xp, yp)
+        return (style, xp, yp, (c*t0[0] - s*t0[1], s*t0[0] + c*t0[1]), (c*t1[0] - s*t1[1], s*t1[0] + c*t1[1]))
+
+    def grow(self, x, y):
+        box = (min(x), min(y), max(x), max(y))
+        if self.extents is None:
+            self.extents = box
+        else:
+            e = self.extents
+            self.extents = (min(e[0], box[0]), min(e[1], box[1]), max(e[2], box[2]), max(e[3], box[3]))
+
+    def close(self):
+        self.footer()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def number(v):
+    return '%.*f' % (precision, v)
+
+# %-format template with every {} replaced by a coordinate, one format call
+# per point is most of the cost of writing
+def template(text):
+    return text.replace('{}', '%.{}f'.format(precision))
+
+# fixed width so the field can be filled in when the writer is closed
+def field(v):
+    return '{:024.{}f}'.format(v, precision)
+
+# $EXTMIN and $EXTMAX, the same length whatever the values
+def extentsVariables(x0, y0, x1, y1):
+    return '9\n$EXTMIN\n10\n{}\n20\n{}\n30\n{}\n9\n$EXTMAX\n10\n{}\n20\n{}\n30\n{}\n'.format(
+        field(x0), field(y0), field(0.), field(x1), field(y1), field(0.))
+
+class DxfWriter(OutlineWriter):
+    def header(self):
+        f = self.file
+        self.handle = 0
+        tables = self.tables()
+        f.write('0\nSECTION\n2\nHEADER\n9\n$ACADVER\n1\nAC1015\n9\n$INSUNITS\n70\n5\n')
+        # the extents and the next free handle are filled in by footer
+        self.extentsOffset = f.tell()
+        f.write(extentsVariables(0., 0., 0., 0.))
+        f.write('9\n$HANDSEED\n5\n')
+        self.handseedOffset = f.tell()
+        f.write('{:X}\n'.format(firstHandle))
+        f.write('0\nENDSEC\n0\nSECTION\n2\nCLASSES\n0\nENDSEC\n')
+        f.write('\n'.join(tables))
+        f.write('\n0\nSECTION\n2\nENTITIES\n')
+        self.handle = firstHandle - 1
+
+    def newHandle(self):
+        self.handle = self.handle + 1
+        return '{:X}'.format(self.handle)
+
+    # the TABLES and BLOCKS sections, the symbol tables of an R2000 drawing
+    # with the line types and layers used and the model and paper space
+    # blocks the entities belong to, the root dictionary is written by footer
+    def tables(self):
+        self.rootHandle = self.newHandle()
+        # subclass and values after the name of the records of each table
+        records = {
+            'LTYPE': [('AcDbLinetypeTableRecord', [name, '70', '0', '3', '', '72', '65', '73', '0', '40', '0.0'])
+                      for name in ('ByBlock', 'ByLayer', 'Continuous')],
+            'LAYER': [('AcDbLayerTableRecord', [name, '70', '0', '62', color, '6', 'Continuous'])
+                      for (name, color) in (('0', '7'), ('OUTLINE', '7'), ('SHEET', '8'))],
+            'APPID': [('AcDbRegAppTableRecord', ['ACAD', '70', '0'])],
+            'BLOCK_RECORD': [('AcDbBlockTableRecord', [name]) for name in ('*Model_Space', '*Paper_Space')],
+        }
+        handles = {}
+        lines = ['0', 'SECTION', '2', 'TABLES']
+        for name in ('VPORT', 'LTYPE', 'LAYER', 'STYLE', 'VIEW', 'UCS', 'APPID', 'DIMSTYLE', 'BLOCK_RECORD'):
+            table = self.newHandle()
+            lines.extend(['0', 'TABLE', '2', name, '5', table, '330', '0', '100', 'AcDbSymbolTable',
+                          '70', str(len(records.get(name, [])))])
+            if name == 'DIMSTYLE':
+                lines.extend(['100', 'AcDbDimStyleTable'])
+            handles[name] = []
+            for (subclass, values) in records.get(name, []):
+                record = self.newHandle()
+                handles[name].append(record)
+                lines.extend(['0', name, '5', record, '330', table, '100', 'AcDbSymbolTableRecord',
+                              '100', subclass, '2'] + values)
+            lines.extend(['0', 'ENDTAB'])
+        lines.extend(['0', 'ENDSEC', '0', 'SECTION', '2', 'BLOCKS'])
+        for (record, name, space) in zip(handles['BLOCK_RECORD'], ('*Model_Space', '*Paper_Space'), ('0', '1')):
+            lines.extend(['0', 'BLOCK', '5', self.newHandle(), '330', record, '100', 'AcDbEntity',
+                          '67', space, '8', '0', '100', 'AcDbBlockBegin', '2', name, '70', '0',
+                          '10', '0.0', '20', '0.0', '30', '0.0', '3', name, '1', '',
+                          '0', 'ENDBLK', '5', self.newHandle(), '330', record, '100', 'AcDbEntity',
+                          '67', space, '8', '0', '100', 'AcDbBlockEnd'])
+        lines.extend(['0', 'ENDSEC'])
+        self.modelHandle = handles['BLOCK_RECORD'][0]
+        return lines
+
+    def entity(self, kind, subclass, layer):
+        return ['0', kind, '5', self.newHandle(), '330', self.modelHandle, '100', 'AcDbEntity',
+                '8', layer, '100', subclass]
+
+    def writeLoop(self, curves):
+        lines = []
+        for (style, x, y, t0, t1) in curves:
+            (h, controls) = hermite(x, y, t0, t1)
+            if style == 'polyline' or not h:
+                lines.extend(self.polyline(x, y, False, 'OUTLINE'))
+                continue
+            # the Bezier segments as a clamped cubic B-spline, knots at the
+            # chord lengths, each three times
+            knots = [0.] * 4
+            s = 0.
+            for length in h[:-1]:
+                s = s + length
+                knots.extend([s] * 3)
+            knots.extend([s + h[-1]] * 4)
+            lines.extend(self.entity('SPLINE', 'AcDbSpline', 'OUTLINE'))
+            # planar, cubic
+            lines.extend(['210', '0.0', '220', '0.0', '230', '1.0', '70', '8', '71', '3',
+                          '72', str(len(knots)), '73', str(len(controls)), '74', '0',
+                          '42', '0.0000000001', '43', '0.0000000001'])
+            knot = template('40\n{}')
+            lines.extend(knot % k for k in knots)
+            control = template('10\n{}\n20\n{}\n30\n0.0')
+            lines.extend(control % p for p in controls)
+        lines.append('')
+        self.file.write('\n'.join(lines))
+
+    def polyline(self, x, y, closed, layer):
+        lines = self.entity('LWPOLYLINE', 'AcDbPolyline', layer)
+        lines.extend(['90', str(len(x)), '70', '1' if closed else '0'])
+        vertex = template('10\n{}\n20\n{}')
+        lines.extend(vertex % p for p in zip(x, y))
+        return lines
+
+    def writeSheet(self, x, y, width, height):
+        lines = self.polyline([x, x + width, x + width, x], [y, y, y + height, y + height], True, 'SHEET')
+        lines.append('')
+        self.file.write('\n'.join(lines))
+
+    def footer(self):
+        f = self.file
+        # the root dictionary with the group dictionary every drawing has
+        groups = self.newHandle()
+        f.write('\n'.join(['0', 'ENDSEC', '0', 'SECTION', '2', 'OBJECTS',
+                           '0', 'DICTIONARY', '5', self.rootHandle, '330', '0', '100', 'AcDbDictionary',
+                           '281', '1', '3', 'ACAD_GROUP', '350', groups,
+                           '0', 'DICTIONARY', '5', groups, '330', self.rootHandle, '100', 'AcDbDictionary',
+                           '281', '1', '0', 'ENDSEC', '0', 'EOF', '']))
+        (x0, y0, x1, y1) = self.extents if self.extents is not None else (0., 0., 0., 0.)
+        f.seek(self.extentsOffset)
+        f.write(extentsVariables(x0, y0, x1, y1))
+        f.seek(self.handseedOffset)
+        f.write('{:X}'.format(self.handle + 1))
+
+class SvgWriter(OutlineWriter):
+    def header(self):
+        f = self.file
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<svg xmlns="http://www.w3.org/2000/svg" ')
+        # the size and view box are filled in by footer
+        self.sizeOffset = f.tell()
+        f.write(' ' * 160 + '>\n')
+        f.write('<g fill="none" stroke="black" stroke-width="{}" stroke-linejoin="round">\n'.format(strokeWidth))
+
+    def writeLoop(self, curves):
+        parts = []
+        for (style, x, y, t0, t1) in curves:
+            if not parts:
+                parts.append('M{},{}'.format(number(x[0]), number(-y[0])))
+            if style == 'polyline':
+                line = template('L{},{}')
+                parts.extend(line % (a, -b) for a, b in zip(x[1:], y[1:]))
+            else:
+                parts.extend(bezier(x, y, t0, t1))
+        parts.append('Z')
+        self.file.write('<path d="{}"/>\n'.format(' '.join(parts)))
+
+    def writeSheet(self, x, y, width, height):
+        self.file.write('<rect x="{}" y="{}" width="{}" height="{}" stroke="gray" stroke-width="{}"/>\n'.format(
+            number(x), number(-y - height), number(width), number(height), sheetStrokeWidth))
+
+    def footer(self):
+        f = self.file
+        f.write('</g>\n</svg>\n')
+        (x0, y0, x1, y1) = self.extents if self.extents is not None else (0., 0., 0., 0.)
+        # room for the strokes on the outside of the extents
+        pad = max(strokeWidth, sheetStrokeWidth)
+        (w, h) = (x1 - x0 + 2.*pad, y1 - y0 + 2.*pad)
+        size = 'width="{}cm" height="{}cm" viewBox="{} {} {} {}"'.format(
+            number(w), number(h), number(x0 - pad), number(-y1 - pad), number(w), number(h))
+        f.seek(self.sizeOffset)
+        f.write(size[:160])
+
+# writer classes by file extension
+formats = {'.dxf': DxfWriter, '.svg': SvgWriter}
+
+# the Hermite cubics through the points x, y with derivatives along chord
+# length from the neighbours of each point and the given unit tangents at
+# the ends, as the chord length of each segment and the Bezier control
+# points, three per segment after the first point, repeated points are left
+# out
+def hermite(x, y, t0, t1):
+    points = [(x[0], y[0])]
+    for p in zip(x[1:], y[1:]):
+        if p != points[-1]:
+            points.append(p)
+    n = len(points)
+    h = [math.hypot(points[i+1][0] - points[i][0], points[i+1][1] - points[i][1]) for i in range(n - 1)]
+    m = [t0]
+    for i in range(1, n - 1):
+        span = h[i-1] + h[i]
+        m.append(((points[i+1][0] - points[i-1][0]) / span, (points[i+1][1] - points[i-1][1]) / span))
+    m.append(t1)
+    controls = [points[0]]
+    for i in range(n - 1):
+        k = h[i] / 3.
+        (p, q) = (points[i], points[i+1])
+        controls.extend([(p[0] + k*m[i][0], p[1] + k*m[i][1]), (q[0] - k*m[i+1][0], q[1] - k*m[i+1][1]), q])
+    return h, controls
+
+# cubic Bezier segments after the first point of the spline through x, y by
+# hermite, y is flipped for SVG
+def bezier(x, y, t0, t1):
+    (h, controls) = hermite(x, y, t0, t1)
+    cubic = template('C{},{} {},{} {},{}')
+    return [cubic % (a[0], -a[1], b[0], -b[1], c[0], -c[1])
+            for (a, b, c) in zip(controls[1::3], controls[2::3], controls[3::3])]
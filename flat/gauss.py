@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive 3 stage Gauss-Legendre collocation.
+
+An implicit method of order 6 with the same interface and output as
+ode23Adaptive.  The stage equations are solved by fixed point iteration,
+which converges quickly because the flattening equations are not stiff, and
+the repeated stage evaluations land on the same three parameter values so a
+cached rhs only goes to the evaluators once per stage.
+
+The local error is estimated against Simpson's rule through the start, the
+middle stage and the derivative at the new point, which is reused as the
+start derivative of the next step.  That estimate is of order 4 so the
+accepted solution is usually well inside the tolerance.
+"""
+import math
+from .ode23 import adaptive
+
+r15 = math.sqrt(15.)
+nodes = (0.5 - r15/10., 0.5, 0.5 + r15/10.)
+weights = (5./18., 4./9., 5./18.)
+coefficients = ((5./36., 2./9. - r15/15., 5./36. - r15/30.),
+                (5./36. + r15/24., 2./9., 5./36. - r15/24.),
+                (5./36. + r15/30., 2./9. + r15/15., 5./36.))
+
+# fixed point iterations per step before the step is retried smaller
+maxIterations = 12
+
+# one Gauss-Legendre step for flat.ode23.adaptive, None when the stage
+# equations do not converge, the error estimate is of order 4
+def gaussStep(f, t, x, s0, h, tNew, stats, options):
+    n = len(x)
+    rtol = options.rtol
+    threshold = options.thresholds(n)
+    # stage derivatives, starting from the derivative at the start
+    k = [s0, s0, s0]
+    for iteration in range(maxIterations):
+        kNew = [f(t + c*h, [x[idx] + h * sum(a[j] * k[j][idx] for j in range(3)) for idx in range(n)])
+                for c, a in zip(nodes, coefficients)]
+        stats.nfev = stats.nfev + 3
+        change = 0.
+        for idx in range(n):
+            scale = max(threshold[idx], abs(x[idx]))
+            change = max(change, h * max(abs(p[idx] - q[idx]) for p, q in zip(k, kNew)) / scale)
+        k = kNew
+        if change <= 1.e-3 * rtol:
+            break
+    else:
+        return None
+
+    xNew = [x[idx] + h * sum(w * kj[idx] for w, kj in zip(weights, k)) for idx in range(n)]
+    s1 = f(tNew, xNew)
+    stats.nfev = stats.nfev + 1
+    e = [xNew[idx] - x[idx] - h / 6. * (s0[idx] + 4.*k[1][idx] + s1[idx]) for idx in range(n)]
+    return xNew, s1, e
+
+# adaptive Gauss-Legendre, see flat.ode23.adaptive
+def gaussAdaptive(f, x0, tvec, h0=None, options=None, maxSteps=100000, dense=None):
+    return adaptive(gaussStep, 4, 'gauss', f, x0, tvec, h0, options, maxSteps, dense)
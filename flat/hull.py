@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Convex hulls and oriented bounding boxes of flat outlines.
+
+The hull is Andrew's monotone chain, O(n log n) for the sort and linear
+after that.  The smallest rectangle around a convex polygon has a side on
+one of its edges, rotating calipers walk the edges keeping the extreme
+points in three directions so every candidate rectangle is found in O(h)
+for a hull of h points.
+"""
+import math
+
+# counterclockwise hull of the points with coordinates x and y, as a list of
+# (x, y) without repeating the first point, collinear points are dropped
+def convexHull(x, y):
+    pts = sorted(set(zip(x, y)))
+    if len(pts) < 3:
+        return pts
+
+    def half(points):
+        chain = []
+        for p in points:
+            while len(chain) >= 2 and cross(chain[-2], chain[-1], p) <= 0.:
+                chain.pop()
+            chain.append(p)
+        return chain
+
+    lower = half(pts)
+    upper = half(reversed(pts))
+    return lower[:-1] + upper[:-1]
+
+# z of (a - o) x (b - o), positive when o, a, b turn left
+def cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+# rectangle with sides along (cos angle, sin angle) and its normal, width is
+# the extent along the first and height along the second
+class OrientedBox:
+    def __init__(self, cx, cy, width, height, angle):
+        self.cx = cx
+        self.cy = cy
+        self.width = width
+        self.height = height
+        self.angle = angle
+
+    @property
+    def area(self):
+        return self.width * self.height
+
+    # corners counterclockwise
+    def corners(self):
+        (c, s) = (math.cos(self.angle), math.sin(self.angle))
+        (w, h) = (self.width / 2., self.height / 2.)
+        return [(self.cx + c*u - s*v, self.cy + s*u + c*v)
+                for (u, v) in ((-w, -h), (w, -h), (w, h), (-w, h))]
+
+    def rotate(self, theta):
+        (c, s) = (math.cos(theta), math.sin(theta))
+        (self.cx, self.cy) = (c*self.cx - s*self.cy, s*self.cx + c*self.cy)
+        self.angle = self.angle + theta
+
+    def translateBy(self, dx, dy):
+        self.cx = self.cx + dx
+        self.cy = self.cy + dy
+
+    def __repr__(self):
+        return "OrientedBox(center=({:.6g}, {:.6g}), width={:.6g}, height={:.6g}, angle={:.6g})".format(
+            self.cx, self.cy, self.width, self.height, self.angle)
+
+# smallest rectangle around a counterclockwise convex hull by rotating
+# calipers, mode 'area' minimizes the area and 'width' the extent across the
+# narrowest direction, the hull edge the box rests on sets the width axis
+def minimumBox(hull, mode='area'):
+    if mode not in ('area', 'width'):
+        raise ValueError("unknown box mode {}".format(mode))
+    n = len(hull)
+    if n == 0:
+        return OrientedBox(0., 0., 0., 0., 0.)
+    if n < 3:
+        (x0, y0) = hull[0]
+        (x1, y1) = hull[-1]
+        return OrientedBox((x0 + x1) / 2., (y0 + y1) / 2., math.hypot(x1 - x0, y1 - y0), 0.,
+                           math.atan2(y1 - y0, x1 - x0))
+
+    def dot(p, u):
+        return p[0]*u[0] + p[1]*u[1]
+
+    best = None
+    # extreme points along the edge, along its inward normal and against the edge
+    (right, top, left) = (1, 1, 1)
+    for i in range(n):
+        p = hull[i]
+        q = hull[(i + 1) % n]
+        length = math.hypot(q[0] - p[0], q[1] - p[1])
+        if length == 0.:
+            continue
+        u = ((q[0] - p[0]) / length, (q[1] - p[1]) / length)
+        v = (-u[1], u[0])
+
+        # each caliper only ever moves forward around the hull
+        while dot(hull[(right + 1) % n], u) > dot(hull[right], u):
+            right = (right + 1) % n
+        if i == 0:
+            top = right
+        while dot(hull[(top + 1) % n], v) > dot(hull[top], v):
+            top = (top + 1) % n
+        if i == 0:
+            left = top
+        while dot(hull[(left + 1) % n], u) < dot(hull[left], u):
+            left = (left + 1) % n
+
+        lo = dot(hull[left], u)
+        hi = dot(hull[right], u)
+        base = dot(p, v)
+        width = hi - lo
+        height = dot(hull[top], v) - base
+        key = width * height if mode == 'area' else height
+        if best is None or key < best[0]:
+            mu = (lo + hi) / 2.
+            mv = base + height / 2.
+            best = (key, OrientedBox(mu*u[0] + mv*v[0], mu*u[1] + mv*v[1], width, height,
+                                     math.atan2(u[1], u[0])))
+    return best[1]
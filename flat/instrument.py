@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of a flatten.
+
+A Profiler hands out stand-ins for a BRepLoop whose evaluators count and time
+every call by method name, attributed to the face and edge being flattened.
+Stages are timed with profiler.stage(name, face) and the solver statistics of
+each edge are added with profiler.solver, anything else worth counting with
+profiler.count(name, n).  A disabled profiler returns the
+objects it is given and does nothing else.
+"""
+import json, time, collections
+
+class EdgeProfile:
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.times = collections.defaultdict(float)
+        self.solver = {}
+        self.integrate = 0.
+
+    def asDict(self):
+        return {"calls": dict(self.calls), "times": dict(self.times),
+                "solver": self.solver, "integrate": self.integrate}
+
+class FaceProfile:
+    def __init__(self):
+        self.stages = collections.defaultdict(float)
+        self.edges = collections.defaultdict(EdgeProfile)
+
+    def asDict(self):
+        return {"stages": dict(self.stages),
+                "edges": {str(i): edge.asDict() for i, edge in sorted(self.edges.items())}}
+
+class Profiler:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = collections.defaultdict(float)
+        self.counts = collections.Counter()
+        self.faces = collections.defaultdict(FaceProfile)
+
+    # time the body of a with statement, added to the face when one is given
+    def stage(self, name, face=None):
+        if not self.enabled:
+            return nullStage
+        return Stage(self, name, face)
+
+    # add n to the counter name
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counts[name] = self.counts[name] + n
+
+    # the loop of face number face with evaluators that record their calls,
+    # its edges are numbered from first on, after those of the face's other loops
+    def loop(self, loop, face, first=0):
+        if not self.enabled:
+            return loop
+        return ProfiledLoop(loop, self.faces[face], first)
+
+    # solver statistics and integration times of the edges of a flattened loop
+    def solver(self, face, raw, times=None, first=0):
+        if not self.enabled:
+            return
+        for iedge, edge in enumerate(raw.edges):
+            profile = self.faces[face].edges[first + iedge]
+            stats = edge.solverStats
+            if stats is not None:
+                profile.solver = {"accepted": stats.accepted, "rejected": stats.rejected, "nfev": stats.nfev}
+            if times is not None:
+                profile.integrate = profile.integrate + times[iedge]
+
+    # totals over every face and edge
+    def totals(self):
+        calls = collections.Counter()
+        times = collections.defaultdict(float)
+        solver = collections.Counter()
+        for face in self.faces.values():
+            for edge in face.edges.values():
+                calls.update(edge.calls)
+                for name, t in edge.times.items():
+                    times[name] = times[name] + t
+                solver.update(edge.solver)
+        return calls, times, solver
+
+    def asDict(self):
+        (calls, times, solver) = self.totals()
+        return {"stages": dict(self.stages), "counts": dict(self.counts),
+                "totals": {"calls": dict(calls), "times": dict(times), "solver": dict(solver)},
+                "faces": {str(i): face.asDict() for i, face in sorted(self.faces.items())}}
+
+    def summary(self):
+        (calls, times, solver) = self.totals()
+        lines = ["stage                      seconds"]
+        for name, t in sorted(self.stages.items(), key=lambda item: -item[1]):
+            lines.append("{:<24} {:>10.4f}".format(name, t))
+        lines.append("")
+        if self.counts:
+            lines.append("count                        total")
+            for name, n in sorted(self.counts.items()):
+                lines.append("{:<24} {:>10d}".format(name, n))
+            lines.append("")
+        lines.append("evaluator method           calls    seconds")
+        for name, n in sorted(calls.items(), key=lambda item: -times[item[0]]):
+            lines.append("{:<24} {:>8d} {:>10.4f}".format(name, n, times[name]))
+        lines.append("")
+        lines.append("solver  rhs evaluations {}  accepted {}  rejected {}".format(
+            solver["nfev"], solver["accepted"], solver["rejected"]))
+        lines.append("")
+        lines.append("face  edge    calls  evaluator s  integrate s   nfev  rejected")
+        for iface, face in sorted(self.faces.items()):
+            for iedge, edge in sorted(face.edges.items()):
+                lines.append("{:>4} {:>5} {:>8d} {:>12.4f} {:>12.4f} {:>6} {:>9}".format(
+                    iface, iedge, sum(edge.calls.values()), sum(edge.times.values()), edge.integrate,
+                    edge.solver.get("nfev", ""), edge.solver.get("rejected", "")))
+        return "\n".join(lines) + "\n"
+
+    # basename.json with everything and basename.txt with the summary
+    def write(self, basename):
+        if not self.enabled:
+            return
+        with open(basename + ".json", "w") as f:
+            json.dump(self.asDict(), f, indent=1)
+        with open(basename + ".txt", "w") as f:
+            f.write(self.summary())
+
+class Stage:
+    def __init__(self, profiler, name, face):
+        self.profiler = profiler
+        self.name = name
+        self.face = face
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        dt = time.perf_counter() - self.t0
+        self.profiler.stages[self.name] = self.profiler.stages[self.name] + dt
+        if self.face is not None:
+            stages = self.profiler.faces[self.face].stages
+            stages[self.name] = stages[self.name] + dt
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+nullStage = NullStage()
+
+# evaluator whose methods record their calls in an EdgeProfile
+class TimedEvaluator:
+    def __init__(self, evaluator, profile):
+        self._evaluator = evaluator
+        self._profile = profile
+
+    def __getattr__(self, name):
+        method = getattr(self._evaluator, name)
+        if not callable(method):
+            return method
+        profile = self._profile
+
+        def timed(*args):
+            t0 = time.perf_counter()
+            try:
+                return method(*args)
+            finally:
+                profile.times[name] = profile.times[name] + time.perf_counter() - t0
+                profile.calls[name] = profile.calls[name] + 1
+
+        # later lookups find the wrapper without going through __getattr__
+        setattr(self, name, timed)
+        return timed
+
+# stand-ins for the BRep objects reachable from a loop, anything reached
+# through an edge of the loop records into that edge's profile
+class Profiled:
+    def __init__(self, obj, profile):
+        self._obj = obj
+        self._profile = profile
+
+    def __getattr__(self, name):
+        value = getattr(self._obj, name)
+        if name == 'evaluator':
+            value = TimedEvaluator(value, self._profile)
+        elif name in ('edge', 'loop', 'face'):
+            value = Profiled(value, self._profile)
+        setattr(self, name, value)
+        return value
+
+class ProfiledCoEdges:
+    def __init__(self, coEdges, face, first=0):
+        self._coEdges = coEdges
+        self._face = face
+        self._first = first
+        self._items = {}
+
+    @property
+    def count(self):
+        return self._coEdges.count
+
+    def item(self, i):
+        ce = self._items.get(i)
+        if ce is None:
+            ce = Profiled(self._coEdges.item(i), self._face.edges[self._first + i])
+            self._items[i] = ce
+        return ce
+
+    def __getitem__(self, i):
+        return self.item(i)
+
+class ProfiledLoop:
+    def __init__(self, loop, face, first=0):
+        self._loop = loop
+        self.coEdges = ProfiledCoEdges(loop.coEdges, face, first)
+
+    def __getattr__(self, name):
+        return getattr(self._loop, name)
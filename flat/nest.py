@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Nesting of flattened outlines onto sheets.
+
+Parts are first packed as rectangles with a bottom left skyline packer, each
+part trying the allowed rotations of its bounding box.  A refinement pass then
+slides every part down and left against the actual outlines of the parts
+already on the sheet, found through a uniform grid of outline segments.
+A simplified outline keeps a margin of its tolerance to the sheet edges and
+to the other outlines so the loop it came from stays on the sheet and clear.
+
+Units are the same as the outlines, cm for flattened loops.
+"""
+import math
+from .decimate import simplify, pointSegment
+
+# bounds on the outline refinement, down and left passes per part, times the
+# search band below a part may double and halvings of a slide that ends up
+# closer than the gap to another outline
+compactPasses = 2
+maxBandDoublings = 6
+maxBackoffs = 6
+
+# an outline to nest, x and y are the closed polygon in the loop's own frame
+# margin is how far the loop may be outside x, y, simplifying by tolerance
+# adds the tolerance to it
+class Part:
+    def __init__(self, x, y, tolerance=None, margin=0.):
+        if tolerance is not None:
+            (x, y) = simplify(x, y, tolerance)
+            margin = margin + tolerance
+        self.x = list(x)
+        self.y = list(y)
+        self.margin = margin
+        self.area = abs(polygonArea(self.x, self.y))
+
+    # the outline of an assembled RawLoop
+    @classmethod
+    def fromLoop(cls, loop, tolerance=None):
+        x = []
+        y = []
+        for edge in loop.edges:
+            (xe, ye) = edge.xy()
+            x.extend(xe)
+            y.extend(ye)
+        return cls(x, y, tolerance)
+
+    # outline rotated by a multiple of 90 degrees and moved so its box grown
+    # by the margin starts at the origin, with the offset that moves it there
+    def rotated(self, rotation):
+        (c, s) = quarterTurn(rotation)
+        xr = [c*a - s*b for a, b in zip(self.x, self.y)]
+        yr = [s*a + c*b for a, b in zip(self.x, self.y)]
+        dx = self.margin - min(xr)
+        dy = self.margin - min(yr)
+        return [a + dx for a in xr], [b + dy for b in yr], dx, dy
+
+# part number part placed on a sheet, the part's points map to the sheet by
+# rotating by rotation degrees about the origin then translating by x, y
+class Placement:
+    def __init__(self, part, rotation, x, y):
+        self.part = part
+        self.rotation = rotation
+        self.x = x
+        self.y = y
+
+    # move a RawLoop (or anything with rotate and translateBy) into place
+    def apply(self, loop):
+        if self.rotation:
+            loop.rotate(math.radians(self.rotation))
+        loop.translateBy(self.x, self.y)
+
+    def asDict(self):
+        return {"part": self.part, "rotation": self.rotation, "x": self.x, "y": self.y}
+
+class Sheet:
+    def __init__(self, width, height, gap):
+        self.width = width
+        self.height = height
+        self.placements = []
+        self.usedArea = 0.
+        # skyline segments [x, y, width] spanning the sheet plus one gap
+        self.skyline = [[0., 0., width + gap]]
+
+# nest parts onto as many width x height sheets as needed
+# rotations are the allowed rotations in degrees, multiples of 90
+# returns the list of Sheets with placements referring to parts by index
+def nest(parts, width, height, gap=1., rotations=(0, 90), refine=True):
+    for rotation in rotations:
+        if rotation % 90.:
+            raise ValueError("part rotations have to be multiples of 90 degrees, got {}".format(rotation))
+    order = sorted(range(len(parts)), key=lambda i: -parts[i].area)
+    sheets = []
+    shapes = {}
+    for ipart in order:
+        part = parts[ipart]
+        options = []
+        for rotation in rotations:
+            (xr, yr, dx, dy) = part.rotated(rotation)
+            w = max(xr) + part.margin
+            h = max(yr) + part.margin
+            if w <= width and h <= height:
+                options.append((rotation, xr, yr, dx, dy, w, h))
+        if not options:
+            raise ValueError("part {} does not fit on a {} x {} sheet".format(ipart, width, height))
+
+        best = None
+        for sheet in sheets:
+            if sheet.usedArea + part.area > width * height:
+                continue
+            for option in options:
+                position = skylineFit(sheet, option[5] + gap, option[6] + gap)
+                if position is not None and (best is None or position[:2] < best[1][:2]):
+                    best = (sheet, position, option)
+            if best is not None:
+                break
+
+        if best is None:
+            sheet = Sheet(width, height, gap)
+            sheets.append(sheet)
+            for option in options:
+                position = skylineFit(sheet, option[5] + gap, option[6] + gap)
+                if position is not None and (best is None or position[:2] < best[1][:2]):
+                    best = (sheet, position, option)
+
+        (sheet, (y, x, iseg), (rotation, xr, yr, dx, dy, w, h)) = best
+        skylineAdd(sheet, iseg, x, y, w + gap, h + gap)
+        sheet.usedArea = sheet.usedArea + part.area
+        sheet.placements.append(Placement(ipart, rotation, x + dx, y + dy))
+        shapes[ipart] = (xr, yr, dx, dy, part.margin)
+
+    if refine:
+        for sheet in sheets:
+            compact(sheet, shapes, gap)
+    return sheets
+
+# lowest then leftmost position for a w x h rectangle on the skyline,
+# (y, x, first segment index) or None if it does not fit
+def skylineFit(sheet, w, h):
+    skyline = sheet.skyline
+    right = skyline[-1][0] + skyline[-1][2]
+    best = None
+    for i in range(len(skyline)):
+        x = skyline[i][0]
+        if x + w > right + 1.e-9:
+            break
+        # the rectangle rests on the highest segment under it
+        y = 0.
+        j = i
+        remaining = w
+        while remaining > 1.e-9:
+            y = max(y, skyline[j][1])
+            remaining = remaining - skyline[j][2]
+            j = j + 1
+        if y + h <= sheet.height + (right - sheet.width) + 1.e-9:
+            if best is None or (y, x) < best[:2]:
+                best = (y, x, i)
+    return best
+
+def skylineAdd(sheet, i, x, y, w, h):
+    skyline = sheet.skyline
+    new = [x, y + h, w]
+    # trim or drop the segments the rectangle covers
+    j = i
+    while j < len(skyline) and skyline[j][0] < x + w - 1.e-9:
+        seg = skyline[j]
+        end = seg[0] + seg[2]
+        if end <= x + w + 1.e-9:
+            del skyline[j]
+        else:
+            seg[2] = end - (x + w)
+            seg[0] = x + w
+            break
+    skyline.insert(i, new)
+    # merge neighbours at the same height
+    k = 0
+    while k < len(skyline) - 1:
+        if abs(skyline[k][1] - skyline[k+1][1]) < 1.e-9:
+            skyline[k][2] = skyline[k][2] + skyline[k+1][2]
+            del skyline[k+1]
+        else:
+            k = k + 1
+
+# uniform grid of outline segments for the outline aware refinement
+class SegmentGrid:
+    def __init__(self, cell):
+        self.cell = cell
+        self.cells = {}
+        self.owned = {}
+
+    def keys(self, x0, y0, x1, y1):
+        c = self.cell
+        for i in range(int(math.floor(x0 / c)), int(math.floor(x1 / c)) + 1):
+            for j in range(int(math.floor(y0 / c)), int(math.floor(y1 / c)) + 1):
+                yield (i, j)
+
+    def add(self, owner, x, y):
+        n = len(x)
+        keys = set()
+        for k in range(n):
+            seg = (x[k], y[k], x[(k+1) % n], y[(k+1) % n], owner)
+            for key in self.keys(min(seg[0], seg[2]), min(seg[1], seg[3]), max(seg[0], seg[2]), max(seg[1], seg[3])):
+                self.cells.setdefault(key, []).append(seg)
+                keys.add(key)
+        self.owned[owner] = keys
+
+    def remove(self, owner):
+        for key in self.owned.pop(owner, ()):
+            self.cells[key] = [seg for seg in self.cells[key] if seg[4] != owner]
+
+    # segments of other owners that may lie in the box, each segment once
+    def query(self, x0, y0, x1, y1, skip=None):
+        seen = set()
+        for key in self.keys(x0, y0, x1, y1):
+            for seg in self.cells.get(key, ()):
+                if seg[4] != skip and id(seg) not in seen:
+                    seen.add(id(seg))
+                    yield seg
+
+# slide every part down and left against the outlines around it, the
+# simplified outlines keep the gap plus the largest margin on the sheet on
+# either side from each other
+def compact(sheet, shapes, gap):
+    # bottom left parts first so they settle before the parts resting on them
+    sheet.placements.sort(key=lambda p: (p.y - shapes[p.part][3], p.x - shapes[p.part][2]))
+    spacing = gap + 2. * max(shapes[p.part][4] for p in sheet.placements)
+    cell = max(spacing, 1.e-3) * 8.
+    grid = SegmentGrid(cell)
+    outlines = {}
+    for placement in sheet.placements:
+        (xr, yr, dx, dy, margin) = shapes[placement.part]
+        x = [a + placement.x - dx for a in xr]
+        y = [b + placement.y - dy for b in yr]
+        outlines[placement.part] = (x, y)
+        grid.add(placement.part, x, y)
+
+    for placement in sheet.placements:
+        (x, y) = outlines[placement.part]
+        margin = shapes[placement.part][4]
+        start = (placement.x, placement.y)
+        for ipass in range(compactPasses):
+            moved = 0.
+            for axis in (1, 0):
+                d = slide(grid, placement.part, x, y, axis, spacing, margin)
+                if d > 0.:
+                    if axis:
+                        y = [b - d for b in y]
+                        placement.y = placement.y - d
+                    else:
+                        x = [a - d for a in x]
+                        placement.x = placement.x - d
+                    moved = moved + d
+            if moved < spacing * 1.e-3:
+                break
+        if (placement.x, placement.y) != start:
+            grid.remove(placement.part)
+            grid.add(placement.part, x, y)
+
+# the segments of a moving outline in strips across the direction it slides,
+# a segment of another outline only meets the few segments in its strips
+class Strips:
+    def __init__(self, u, v):
+        n = len(u)
+        self.segments = [(u[k], v[k], u[(k+1) % n], v[(k+1) % n]) for k in range(n)]
+        (self.umin, self.umax) = (min(u), max(u))
+        (self.v0, self.v1) = (min(v), max(v))
+        self.width = 2. * (self.v1 - self.v0) / n or 1.
+        self.last = self.key(self.v1)
+        self.strips = {}
+        for k, seg in enumerate(self.segments):
+            for i in range(self.key(min(seg[1], seg[3])), self.key(max(seg[1], seg[3])) + 1):
+                self.strips.setdefault(i, []).append(k)
+
+    def key(self, v):
+        return int(math.floor((v - self.v0) / self.width))
+
+    # indices of the segments that may reach across [lo, hi], each once
+    def near(self, lo, hi):
+        seen = set()
+        for i in range(max(self.key(lo), 0), min(self.key(hi), self.last) + 1):
+            for k in self.strips.get(i, ()):
+                if k not in seen:
+                    seen.add(k)
+                    yield k
+
+# how far the outline can move towards 0 along axis (0 x, 1 y) staying margin
+# inside the sheet and at least gap away from the other outlines in the grid
+def slide(grid, owner, x, y, axis, gap, margin=0.):
+    (u, v) = (y, x) if axis else (x, y)
+    (umin, umax, vmin, vmax) = (min(u), max(u), min(v), max(v))
+    edge = umin - margin
+    if edge <= 0.:
+        return 0.
+    strips = Strips(u, v)
+    moving = strips.segments
+
+    # search a growing band of the swept area, an outline further away than
+    # the band cannot be reached before something inside it
+    band = max(4. * gap, (umax - umin) / 2.)
+    reach = 0.
+    for iband in range(maxBandDoublings + 1):
+        reach = min(reach + band, edge + gap)
+        lo = umin - reach - gap
+        if axis:
+            segs = grid.query(vmin - gap, lo, vmax + gap, umax, owner)
+            obstacles = [obstacle(seg[1], seg[0], seg[3], seg[2]) for seg in segs]
+        else:
+            segs = grid.query(lo, vmin - gap, umax, vmax + gap, owner)
+            obstacles = [obstacle(*seg[:4]) for seg in segs]
+
+        # contact distance along the axis, vertices of one outline against the
+        # segments of the other, no tunnelling since it is the first contact
+        # nearest first, nothing is met before the outline has come down to
+        # it so the search stops at the first obstacle that is too far
+        obstacles.sort(key=lambda o: -o[5])
+        contact = math.inf
+        for (a0, b0, a1, b1, alo, ahi, blo, bhi) in obstacles:
+            if umin - ahi >= contact:
+                break
+            if bhi < vmin or blo > vmax:
+                continue
+            for k in strips.near(blo, bhi):
+                (m0, n0, m1, n1) = moving[k]
+                if (b0 - n0) * (b1 - n0) <= 0.:
+                    contact = min(contact, rayDistance(m0, n0, a0, b0, a1, b1))
+                if (n0 - b0) * (n1 - b0) <= 0.:
+                    contact = min(contact, -rayDistance(a0, b0, m0, n0, m1, n1, -1.))
+                if (n0 - b1) * (n1 - b1) <= 0.:
+                    contact = min(contact, -rayDistance(a1, b1, m0, n0, m1, n1, -1.))
+
+        if contact - gap <= reach or reach >= edge + gap:
+            break
+        band = band * 2.
+
+    # nothing past the band was looked at, the gap is the true distance
+    # between the outlines so back off until it holds
+    d = min(edge, contact - gap, reach)
+    for iback in range(maxBackoffs):
+        if d <= gap * 1.e-2:
+            break
+        if keepsClear(strips, obstacles, d, gap * (1. - 1.e-9)):
+            return d
+        d = d / 2.
+    return 0.
+
+# segment of another outline in slide coordinates with its bounds
+def obstacle(a0, b0, a1, b1):
+    return (a0, b0, a1, b1, min(a0, a1), max(a0, a1), min(b0, b1), max(b0, b1))
+
+# distance from (u, v) backwards along u to the segment, inf if it misses
+# with sign -1. the distance is measured forwards and returned negated
+def rayDistance(u, v, a0, b0, a1, b1, sign=1.):
+    if (b0 - v) * (b1 - v) > 0. or b0 == b1:
+        return math.inf * sign
+    a = a0 + (a1 - a0) * (v - b0) / (b1 - b0)
+    dist = (u - a) * sign
+    if dist < -1.e-12:
+        return math.inf * sign
+    return max(dist, 0.) * sign
+
+# whether the moving segments shifted back by d stay gap away from the
+# obstacles sorted nearest first, only the segments in the strips near each
+# obstacle are measured
+def keepsClear(strips, obstacles, d, gap):
+    moving = strips.segments
+    for (c0, d0, c1, d1, clo, chi, dlo, dhi) in obstacles:
+        if chi + gap < strips.umin - d:
+            break
+        if clo - gap > strips.umax - d or dhi + gap < strips.v0 or dlo - gap > strips.v1:
+            continue
+        for k in strips.near(dlo - gap, dhi + gap):
+            (a0, b0, a1, b1) = moving[k]
+            if min(a0, a1) - d > chi + gap or max(a0, a1) - d < clo - gap:
+                continue
+            if segmentDistance(a0 - d, b0, a1 - d, b1, c0, d0, c1, d1) < gap:
+                return False
+    return True
+
+def segmentDistance(ax, ay, bx, by, cx, cy, dx, dy):
+    if segmentsCross(ax, ay, bx, by, cx, cy, dx, dy):
+        return 0.
+    return min(pointSegment(ax, ay, cx, cy, dx, dy), pointSegment(bx, by, cx, cy, dx, dy),
+               pointSegment(cx, cy, ax, ay, bx, by), pointSegment(dx, dy, ax, ay, bx, by))
+
+def segmentsCross(ax, ay, bx, by, cx, cy, dx, dy):
+    d1 = (bx - ax)*(cy - ay) - (by - ay)*(cx - ax)
+    d2 = (bx - ax)*(dy - ay) - (by - ay)*(dx - ax)
+    d3 = (dx - cx)*(ay - cy) - (dy - cy)*(ax - cx)
+    d4 = (dx - cx)*(by - cy) - (dy - cy)*(bx - cx)
+    return d1 * d2 < 0. and d3 * d4 < 0.
+
+def quarterTurn(rotation):
+    turns = int(round(rotation / 90.)) % 4
+    return ((1., 0.), (0., 1.), (-1., 0.), (0., -1.))[turns]
+
+def polygonArea(x, y):
+    n = len(x)
+    return 0.5 * sum(x[k]*y[(k+1) % n] - x[(k+1) % n]*y[k] for k in range(n))
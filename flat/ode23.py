@@ -5,31 +5,87 @@ Created on Sun Jan  6 19:29:35 2019
 
 @author: mschafer
 """
-import math
+import math, collections
 from functools import partial
 
-absTol = None
-relTol = 1.e-4
+defaultRelTol = 1.e-4
 defaultAbsTol = 1.e-6
 
+# tolerances of an integration, atol is a sequence with the absolute
+# tolerance of each state component or None for defaultAbsTol
+# immutable so one instance can be shared by any number of integrations
+# running at once, in threads or after a pickle in other processes
+class SolverOptions(collections.namedtuple('SolverOptions', ('rtol', 'atol'))):
+    __slots__ = ()
+
+    def __new__(cls, rtol=defaultRelTol, atol=None):
+        if atol is not None:
+            atol = tuple(atol)
+        return super().__new__(cls, rtol, atol)
+
+    # atol / rtol of each of n state components, the smallest magnitude the
+    # error is measured relative to
+    def thresholds(self, n):
+        if self.atol is None:
+            return [defaultAbsTol / self.rtol for idx in range(n)]
+        return [a / self.rtol for a in self.atol]
+
+    # the same options with rtol multiplied by factor
+    def tightened(self, factor):
+        return self._replace(rtol=self.rtol * factor)
+
+defaultOptions = SolverOptions()
+
+# step size controller constants, the exponents depend on the order of the
+# embedded error, see adaptive
+safety = 0.9
+minFactor = 0.2
+maxFactor = 5.
+
 # estimate intial step size
 # 1 / max (dx/dt / x0_threshold)
-def estimateH(f, x0, t0):
+def estimateH(f, x0, t0, options=None):
     f0 = f(t0, x0)
+    return initialStep(x0, f0, options)
+
+def initialStep(x0, f0, options=None):
+    if options is None:
+        options = defaultOptions
+    threshold = options.thresholds(len(x0))
     rh = 0.
     for i in range(len(x0)):
-        atol = defaultAbsTol
-        if absTol != None:
-            atol = absTol[i]
-
-        x = max(atol/relTol, abs(x0[i]))
+        x = max(threshold[i], abs(x0[i]))
         rh = max(abs(f0[i]) / x, rh)
 
+    if rh == 0.:
+        return math.inf
     return 1. / rh
 
+# accepted and rejected step counts, rhs evaluations and the accumulated
+# magnitude of the local error estimate of each state component
+class SolverStats:
+    def __init__(self, n):
+        self.accepted = 0
+        self.rejected = 0
+        self.nfev = 0
+        self.error = [0. for i in range(n)]
+        # sum of the local errors in the direction of the velocity (x_t, y_t)
+        # in radians, a direction error turns the rest of the loop about the
+        # point where it is made while a speed error is taken out by the
+        # length correction
+        self.angle = 0.
+
+    def __repr__(self):
+        return "accepted: {} rejected: {} nfev: {}".format(self.accepted, self.rejected, self.nfev)
+
 
 # https://blogs.mathworks.com/cleve/2014/05/26/ordinary-differential-equation-solvers-ode23-and-ode45/
-def ode23(f, x0, tvec):
+# dense is an optional flat.dense.DenseOutput that gets every step
+def ode23(f, x0, tvec, options=None, dense=None):
+    if options is None:
+        options = defaultOptions
+    rtol = options.rtol
+    threshold = options.thresholds(len(x0))
     x = x0[:]
     t = tvec[0]
     
@@ -38,6 +94,8 @@ def ode23(f, x0, tvec):
     eOut = []
     
     s1 = f(t, x)
+    if dense is not None:
+        dense.append(t, x, s1)
     for it in range(1, len(tvec)):
         h = tvec[it] - tvec[it-1]
     
@@ -59,23 +117,19 @@ def ode23(f, x0, tvec):
         xOut.append(x[:])
         # s4 is same as s1 for next step    
         s4 = f(t, x)
+        if dense is not None:
+            dense.append(t, x, s4)
 
         # error: h*(-5*s1 + 6*s2 + 8*s3 + -9*s4)/72
         # err = absh * norm(e ./ max(max(abs(y),abs(ynew)),threshold),inf);
         # fail if err > rtol            
         # threshold is atol / rtol
-        threshold = [.01 for idx in range(len(x))]
         success = True
         e = [0 for idx in range(len(x))]
         for idx in range(len(x)):
-            atol = defaultAbsTol
-            if absTol != None:
-                atol = absTol[idx]
-
-            threshold = atol / relTol
             e[idx] = h / 72. * (-5.*s1[idx] + 6*s2[idx] + 8*s3[idx] - 9.*s4[idx])
-            err = e[idx] / max(threshold, abs(x[idx]))
-            if err > relTol:
+            err = e[idx] / max(threshold[idx], abs(x[idx]))
+            if err > rtol:
                 success = False
 
 
@@ -85,6 +139,114 @@ def ode23(f, x0, tvec):
         
     return xOut, success
         
+# the adaptive stepping the integrators share, steps are accepted or
+# rejected individually from the embedded error estimate and h is grown or
+# shrunk by a PI controller
+# step(f, t, x, s, h, tNew, stats, options) takes one step of size h from
+# the state x with derivative s at t to tNew, counts its rhs evaluations in
+# stats and returns the new state, its derivative and the local error estimate, or None
+# when it cannot take the step and it is retried smaller
+# order is the order of the error estimate and name goes into the errors
+# returns the state at every value of tvec and the solver statistics
+# dense is an optional flat.dense.DenseOutput that gets every accepted step
+def adaptive(step, order, name, f, x0, tvec, h0=None, options=None, maxSteps=100000, dense=None):
+    if options is None:
+        options = defaultOptions
+    rtol = options.rtol
+    n = len(x0)
+    threshold = options.thresholds(n)
+    alpha = 0.7 / order
+    beta = 0.4 / order
+
+    stats = SolverStats(n)
+    x = x0[:]
+    t = tvec[0]
+    xOut = []
+    xOut.append(x0[:])
+
+    s = f(t, x)
+    stats.nfev = 1
+    if dense is not None:
+        dense.append(t, x, s)
+    h = h0
+    if h is None:
+        h = initialStep(x, s, options)
+    h = min(h, tvec[-1] - tvec[0])
+    errOld = 1.e-4
+    for it in range(1, len(tvec)):
+        tEnd = tvec[it]
+        while t < tEnd:
+            if stats.accepted + stats.rejected >= maxSteps:
+                raise RuntimeError("{} exceeded {} steps".format(name, maxSteps))
+
+            # stretch the last step onto the output node instead of leaving a sliver
+            last = t + 1.1 * h >= tEnd
+            if last:
+                h = tEnd - t
+            if h <= 16. * math.ulp(max(abs(t), abs(tEnd))):
+                raise RuntimeError("{} step size too small at t = {}".format(name, t))
+
+            tNew = tEnd if last else t + h
+            taken = step(f, t, x, s, h, tNew, stats, options)
+            if taken is None:
+                stats.rejected = stats.rejected + 1
+                h = h * minFactor
+                continue
+            (xNew, sNew, e) = taken
+
+            err = 0.
+            for idx in range(n):
+                scale = max(threshold[idx], abs(x[idx]), abs(xNew[idx]))
+                err = max(err, abs(e[idx]) / scale)
+            err = err / rtol
+
+            if err <= 1.:
+                stats.accepted = stats.accepted + 1
+                for idx in range(n):
+                    stats.error[idx] = stats.error[idx] + abs(e[idx])
+                if n >= 4:
+                    speed2 = xNew[2] * xNew[2] + xNew[3] * xNew[3]
+                    if speed2 > 0.:
+                        stats.angle = stats.angle + abs(xNew[2] * e[3] - xNew[3] * e[2]) / speed2
+                t = tNew
+                x = xNew
+                # FSAL
+                s = sNew
+                if dense is not None:
+                    dense.append(t, x, s)
+                if err == 0.:
+                    factor = maxFactor
+                else:
+                    factor = safety * err**-alpha * errOld**beta
+                    factor = min(maxFactor, max(minFactor, factor))
+                errOld = max(err, 1.e-4)
+                h = h * factor
+            else:
+                # s is still valid at t, only the new stages are recomputed
+                stats.rejected = stats.rejected + 1
+                factor = max(minFactor, safety * err**-alpha)
+                h = h * min(1., factor)
+
+        xOut.append(x[:])
+
+    return xOut, stats
+
+# one Bogacki-Shampine step for adaptive, the error estimate is of order 3
+def bogackiShampineStep(f, t, x, s1, h, tNew, stats, options):
+    x1 = [a + h/2. * b for a, b in zip(x, s1)]
+    s2 = f(t + h/2., x1)
+    x2 = [a + 3.*h/4. * b for a, b in zip(x, s2)]
+    s3 = f(t + 3.*h/4., x2)
+    xNew = [a + h / 9. * (2.*p + 3*q + 4*r) for a, p, q, r in zip(x, s1, s2, s3)]
+    s4 = f(tNew, xNew)
+    stats.nfev = stats.nfev + 3
+    e = [h / 72. * (-5.*p + 6*q + 8*r - 9.*u) for p, q, r, u in zip(s1, s2, s3, s4)]
+    return xNew, s4, e
+
+# adaptive Bogacki-Shampine, see adaptive
+def ode23Adaptive(f, x0, tvec, h0=None, options=None, maxSteps=100000, dense=None):
+    return adaptive(bogackiShampineStep, 3, 'ode23', f, x0, tvec, h0, options, maxSteps, dense)
+
 def linspace(start, end, steps):
     ans = []
     d = (end-start) / (steps-1)
@@ -107,14 +269,14 @@ class Circle:
         return [-math.sin(t)*self.radius, math.cos(t)*self.radius]
 
 if __name__ == "__main__":
-    absTol = [1.e-5, 1.e-5]
+    options = SolverOptions(atol=[1.e-5, 1.e-5])
     print ("hello world")
     circ = Circle(1)
     # f= rhs
     f = partial(Circle.rhs, circ)
-    h0 = estimateH(f, [1., 0.], 0.)
+    h0 = estimateH(f, [1., 0.], 0., options)
 
     tvec = linspace(0., .4, 5)
-    [x, success] = ode23(f, [1, 0], tvec)
+    [x, success] = ode23(f, [1, 0], tvec, options)
     print (len(x))
     
\ No newline at end of file
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Two phase flattening.
+
+Phase one runs inside Fusion and samples everything the edges of a loop need
+from the evaluators into plain picklable arrays.  Phase two integrates and
+assembles the loops from those samples with no adsk dependency, in time
+slices between the command's progress updates or, with flattenParallel, as
+one job per edge in a process pool.  The command writes the samples it takes
+with writeSamples so offline.py can run phase two again without Fusion.
+"""
+import os, time, array, pickle, concurrent.futures
+from functools import partial
+from .raw import RawLoop, RawEdge
+from .dense import DenseOutput
+from .ode23 import SolverStats
+from .solvers import methods, chooseMethod
+from .quad import sampleCoefficients, integratePanels, PanelCoefficients
+from .schedule import finish
+
+# the flattening inputs of one edge, the rhs coefficients c = A + iB are
+# stored at the panel boundaries t and the panel midpoints
+# options default to the SolverOptions of the prepared edge
+class EdgeSamples:
+    def __init__(self, edge, coef, options=None):
+        self.needsReverse = edge.needsReverse
+        self.length3d = edge.length3d
+        self.options = edge.options if options is None else options
+        self.fitTol = edge.fitTol
+        self.turn = edge.turn
+        self.d = array.array('d', edge.d)
+        self.tvec = array.array('d', edge.tvec)
+        self.x0 = array.array('d', edge.x0)
+
+        # panels accepted and split and coefficient evaluations of the sampling
+        stats = SolverStats(4)
+        leaves = sampleCoefficients(coef, edge.tvec[0], edge.tvec[-1], self.options, stats)
+        self.counts = (stats.accepted, stats.rejected, stats.nfev)
+        self.t = array.array('d', [leaf[0] for leaf in leaves])
+        self.t.append(leaves[-1][1])
+        self.A = array.array('d')
+        self.B = array.array('d')
+        # the complex phase error of each panel split the same way
+        self.errA = array.array('d')
+        self.errB = array.array('d')
+        for (a, b, qa, qm, qb, err) in leaves:
+            self.A.extend([qa.real, qm.real])
+            self.B.extend([qa.imag, qm.imag])
+            self.errA.append(err.real)
+            self.errB.append(err.imag)
+        self.A.append(leaves[-1][4].real)
+        self.B.append(leaves[-1][4].imag)
+
+    # panels in the format used by flat.quad
+    def leaves(self):
+        leaves = []
+        for i in range(len(self.errA)):
+            qa = complex(self.A[2*i], self.B[2*i])
+            qm = complex(self.A[2*i+1], self.B[2*i+1])
+            qb = complex(self.A[2*i+2], self.B[2*i+2])
+            leaves.append((self.t[i], self.t[i+1], qa, qm, qb, complex(self.errA[i], self.errB[i])))
+        return leaves
+
+# extension of the files written by writeSamples
+samplesExtension = ".samples"
+
+class LoopSamples:
+    def __init__(self, relAngle, edges):
+        self.relAngle = array.array('d', relAngle)
+        self.edges = edges
+
+# phase one, sample a BRepLoop through the Fusion evaluators
+def extractLoop(loop, options=None, fitTol=None):
+    return finish(extractSteps(loop, options, fitTol))
+
+# extractLoop as flat.schedule steps, yields once the edges are prepared and
+# after sampling each edge, returns the LoopSamples
+def extractSteps(loop, options=None, fitTol=None):
+    raw = RawLoop(loop, None, options, fitTol)
+    yield
+    edges = []
+    for iedge, edge in enumerate(raw.edges):
+        ce = loop.coEdges.item(iedge)
+        coef = partial(RawEdge.coefficients, edge, ce.edge, ce.loop.face)
+        edges.append(EdgeSamples(edge, coef))
+        yield
+    return LoopSamples(raw.relAngle, edges)
+
+# accuracy budget mode, the worst edges of the flattened loop raw are sampled
+# again from the BRepLoop with their tolerances tightened by factor and the
+# loop flattened again, until it closes to within budget or maxRounds is used
+# up, the rest keep their cheaper solution, returns the final flattened loop
+# an edge sampled again in a later round goes on with the ParameterCache of
+# its previous round, the finer Simpson panels start from the same bisection
+# so the coefficients it already has are not evaluated again
+def closeSamples(loop, samples, raw, budget, engine='quad', factor=.1, maxRounds=4):
+    caches = {}
+    for iround in range(maxRounds):
+        if raw.closure <= budget:
+            break
+        for iedge in raw.worstEdges(budget):
+            ce = loop.coEdges.item(iedge)
+            es = samples.edges[iedge]
+            edge = RawEdge(ce, None, es.options.tightened(factor), es.fitTol * factor, caches.get(iedge))
+            caches[iedge] = edge.cache
+            coef = partial(RawEdge.coefficients, edge, ce.edge, ce.loop.face)
+            samples.edges[iedge] = EdgeSamples(edge, coef)
+        raw = flattenSamples(samples, engine)
+    return raw
+
+def sampledRhs(coef, t, state):
+    (A, B) = coef(t)
+    return [state[2], state[3], A * state[2] - B * state[3], A * state[3] + B * state[2]]
+
+# phase two, integrate and assemble one loop from its samples
+# engine is 'quad' to integrate the sampled panels directly or a method name
+# from flat.solvers or 'auto' to step through the piecewise quadratic
+# coefficients
+def flattenSamples(samples, engine='quad'):
+    raw = integrateSamples(samples, engine)
+    raw.assemble()
+    return raw
+
+# phase two without the assembly, the seconds spent on each edge are
+# appended to times when it is given
+def integrateSamples(samples, engine='quad', times=None):
+    return finish(integrateSteps(samples, engine, times))
+
+# integrateSamples as flat.schedule steps, yields after each edge and
+# returns the RawLoop
+def integrateSteps(samples, engine='quad', times=None):
+    edges = []
+    for es in samples.edges:
+        t0 = time.perf_counter()
+        edges.append(sampledEdge(es, integrateEdge(es, engine)))
+        if times is not None:
+            times.append(time.perf_counter() - t0)
+        yield
+
+    return RawLoop.fromEdges(edges, samples.relAngle)
+
+# phase two of one edge, the job a worker process runs, returns the states
+# at the output nodes, the SolverStats and the DenseOutput
+def integrateEdge(es, engine='quad'):
+    leaves = es.leaves()
+    x0 = list(es.x0)
+    tvec = list(es.tvec)
+    dense = DenseOutput()
+    if engine == 'quad':
+        stats = SolverStats(len(x0))
+        (stats.accepted, stats.rejected, stats.nfev) = es.counts
+        xOut = integratePanels(leaves, x0, tvec, stats, dense)
+    else:
+        rhsFun = partial(sampledRhs, PanelCoefficients(leaves))
+        method = chooseMethod(es.options.rtol, es.turn, False) if engine == 'auto' else engine
+        [xOut, stats] = methods[method](rhsFun, x0, tvec, None, es.options, dense=dense)
+    return xOut, stats, dense
+
+# the RawEdge of EdgeSamples es from what integrateEdge returned for it
+def sampledEdge(es, solution):
+    (xOut, stats, dense) = solution
+    edge = RawEdge.fromSolution(es.needsReverse, es.length3d, es.d, xOut, dense, es.tvec)
+    edge.solverStats = stats
+    return edge
+
+# phase two for many loops in a process pool with one job per edge, so a
+# few large loops spread over the workers as well as many small ones, the
+# edges are put back together in order and the loops assembled, results are
+# in the same order as samples whatever order the jobs finish in
+# maxWorkers of 1 runs in this process, None uses every core
+def flattenParallel(samples, engine='quad', maxWorkers=None):
+    jobs = [es for loop in samples for es in loop.edges]
+    work = partial(integrateEdge, engine=engine)
+    if maxWorkers == 1:
+        return assembleSolutions(samples, map(work, jobs))
+
+    chunk = max(1, len(jobs) // (4 * (maxWorkers or os.cpu_count() or 1)))
+    with concurrent.futures.ProcessPoolExecutor(maxWorkers) as pool:
+        return assembleSolutions(samples, pool.map(work, jobs, chunksize=chunk))
+
+# assembled RawLoops of samples from the integrateEdge solutions of all their
+# edges in order
+def assembleSolutions(samples, solutions):
+    solutions = iter(solutions)
+    loops = []
+    for loop in samples:
+        edges = [sampledEdge(es, next(solutions)) for es in loop.edges]
+        raw = RawLoop.fromEdges(edges, loop.relAngle)
+        raw.assemble()
+        loops.append(raw)
+    return loops
+
+# save a list of LoopSamples for flattenParallel, they are plain arrays and
+# numbers so they pickle without Fusion
+def writeSamples(fname, samples):
+    with open(fname, 'wb') as f:
+        pickle.dump(samples, f, pickle.HIGHEST_PROTOCOL)
+
+def readSamples(fname):
+    with open(fname, 'rb') as f:
+        return pickle.load(f)
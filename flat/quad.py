@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Flattening by quadrature instead of ODE stepping.
+
+The flattening rhs is linear in the velocity.  With z = x_t + i y_t and
+c(t) = A(t) + i B(t) it is z' = c z, so
+
+    z(t) = z0 exp(phi(t)),   phi(t) = integral of c from t0 to t
+    p(t) = p0 + integral of z from t0 to t
+
+c only depends on the geometry so it is sampled on an adaptive Simpson grid
+over the whole edge, independent of how closely the output nodes are spaced.
+Inside a panel c is the quadratic through its samples so phi, z and p are
+available at any output node without evaluating the geometry again.
+"""
+import bisect, cmath
+from .ode23 import SolverStats, defaultOptions
+
+maxDepth = 30
+
+# coef(t) -> (A, B), x0 = [x, y, x_t, y_t] at tvec[0]
+# returns the state at every value of tvec and the solver statistics in the
+# same format as ode23Adaptive, accepted counts the Simpson panels used and
+# rejected the panels that had to be split
+def flattenQuad(coef, x0, tvec, options=None, dense=None):
+    stats = SolverStats(len(x0))
+    leaves = sampleCoefficients(coef, tvec[0], tvec[-1], options, stats)
+    xOut = integratePanels(leaves, x0, tvec, stats, dense)
+    return xOut, stats
+
+# adaptive Simpson panels of c = A + iB over [t0, t1]
+# this is the only part of the quadrature that evaluates the geometry
+def sampleCoefficients(coef, t0, t1, options=None, stats=None):
+    if options is None:
+        options = defaultOptions
+    rtol = options.rtol
+    if stats is None:
+        stats = SolverStats(4)
+
+    def c(t):
+        stats.nfev = stats.nfev + 1
+        (A, B) = coef(t)
+        return complex(A, B)
+
+    # phase error allowed per unit parameter and the largest turn per panel
+    # that keeps the 4th order Simpson error of the position below rtol
+    phaseTol = rtol / abs(t1 - t0)
+    maxTurn = (2880. * rtol) ** 0.25
+
+    ca = c(t0)
+    cb = c(t1)
+    cm = c((t0 + t1) / 2.)
+    return panels(c, t0, t1, ca, cm, cb, phaseTol, maxTurn, stats, 0)
+
+# sweep the panels and output nodes together accumulating phi, z and p
+# dense is an optional flat.dense.DenseOutput that gets every panel end and
+# output node
+def integratePanels(leaves, x0, tvec, stats, dense=None):
+    t1 = leaves[-1][1]
+    p = complex(x0[0], x0[1])
+    z0 = complex(x0[2], x0[3])
+    z = z0
+    phi = 0j
+    xOut = []
+    xOut.append(x0[:])
+    if dense is not None:
+        dense.append(leaves[0][0], x0, stateDerivative(z, leaves[0][2]))
+    it = 1
+    # the position error is summed with its sign so the Simpson errors of a
+    # steady turn cancel as they do in the solution, a direction error turns
+    # the rest of the edge, turned and turnedAt sum it and its moments so
+    # that can be added once the end point is known
+    posErr = 0j
+    turned = 0.
+    turnedAt = 0j
+    for (a, b, qa, qm, qb, err) in leaves:
+        h = b - a
+        # Simpson error of integrating z over the panel, z'''' = c**4 z
+        posErr = posErr - h**5 * qm**4 * z / 2880.
+        stats.error[2] = stats.error[2] + abs(err) * abs(z)
+        stats.angle = stats.angle + abs(err.imag)
+
+        last = b == t1
+        while it < len(tvec) and ((tvec[it] - b) * (b - a) < 0. or (last and it == len(tvec) - 1)):
+            (pt, zt) = advance(h, qa, qm, qb, tvec[it] - a, phi, p, z, z0)
+            xOut.append([pt.real, pt.imag, zt.real, zt.imag])
+            if dense is not None and a < tvec[it] < b:
+                r = (tvec[it] - a) / h
+                q = qa + r * (-3.*qa + 4.*qm - qb) + r * r * 2. * (qa - 2.*qm + qb)
+                dense.append(tvec[it], xOut[-1], stateDerivative(zt, q))
+            it = it + 1
+
+        (p, z) = advance(h, qa, qm, qb, h, phi, p, z, z0)
+        phi = phi + h * (qa + 4.*qm + qb) / 6.
+        if dense is not None:
+            dense.append(b, [p.real, p.imag, z.real, z.imag], stateDerivative(z, qb))
+        turned = turned + err.imag
+        turnedAt = turnedAt + err.imag * p
+
+    posErr = posErr + 1j * (turned * p - turnedAt)
+    stats.error[0] = abs(posErr.real)
+    stats.error[1] = abs(posErr.imag)
+    stats.error[3] = stats.error[2]
+    return xOut
+
+# derivative of the state (x, y, x_t, y_t) with velocity z where A + iB is c
+def stateDerivative(z, c):
+    zt = c * z
+    return [z.real, z.imag, zt.real, zt.imag]
+
+# c(t) -> (A, B) from the quadratic model of each panel, lets the step
+# integrators run on sampled coefficients without the geometry
+class PanelCoefficients:
+    def __init__(self, leaves):
+        self.leaves = leaves
+        self.starts = [leaf[0] for leaf in leaves]
+
+    def __call__(self, t):
+        i = bisect.bisect_right(self.starts, t) - 1
+        (a, b, qa, qm, qb, err) = self.leaves[min(max(i, 0), len(self.leaves) - 1)]
+        r = (t - a) / (b - a)
+        q = qa + r * (-3.*qa + 4.*qm - qb) + r * r * 2. * (qa - 2.*qm + qb)
+        return (q.real, q.imag)
+
+# integral from the start of the panel to tau of the quadratic through
+# (0, qa), (h/2, qm), (h, qb)
+def phase(h, qa, qm, qb, tau):
+    r = tau / h
+    return tau * (qa + r * (-3.*qa + 4.*qm - qb) / 2. + r * r * 2. * (qa - 2.*qm + qb) / 3.)
+
+# position and velocity tau into a panel that starts at phi, p, z
+def advance(h, qa, qm, qb, tau, phi, p, z, z0):
+    zm = z0 * cmath.exp(phi + phase(h, qa, qm, qb, tau / 2.))
+    zt = z0 * cmath.exp(phi + phase(h, qa, qm, qb, tau))
+    return p + tau * (z + 4.*zm + zt) / 6., zt
+
+# adaptive Simpson panels covering [a, b], each panel is
+# (a, b, c(a), c(m), c(b), estimated phase error), the error is complex, its
+# real part is an error in the log of the speed and its imaginary part an
+# error in the direction
+def panels(c, a, b, ca, cm, cb, phaseTol, maxTurn, stats, depth):
+    h = b - a
+    cl = c(a + h / 4.)
+    cr = c(a + 3. * h / 4.)
+    coarse = h * (ca + 4.*cm + cb) / 6.
+    fine = h * (ca + 4.*cl + 2.*cm + 4.*cr + cb) / 12.
+    err = (fine - coarse) / 15.
+    turn = max(abs(ca), abs(cm), abs(cb)) * abs(h) / 2.
+
+    m = (a + b) / 2.
+    if depth >= maxDepth or (abs(err) <= phaseTol * abs(h) and turn <= maxTurn):
+        stats.accepted = stats.accepted + 2
+        return [(a, m, ca, cl, cm, err / 2.), (m, b, cm, cr, cb, err / 2.)]
+
+    stats.rejected = stats.rejected + 1
+    return (panels(c, a, m, ca, cl, cm, phaseTol, maxTurn, stats, depth + 1) +
+            panels(c, m, b, cm, cr, cb, phaseTol, maxTurn, stats, depth + 1))
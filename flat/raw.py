@@ -1,57 +1,73 @@
-import os, math, array, pickle, traceback, statistics
-from .ode23 import ode23, linspace, estimateH, absTol, relTol
+import math, array, itertools, operator, concurrent.futures
+from .ode23 import estimateH, defaultOptions
+from .quad import flattenQuad
+from .solvers import methods, chooseMethod, strokeTurn
+from .cache import ParameterCache
+from .dense import DenseOutput
+from .hull import convexHull, minimumBox
+from .arclength import ArcLengthTable
 from functools import partial
 
 fitTolerance = .01 # cm database units
+cacheSize = 4096 # parameter values of rhs coefficients kept per edge
+boxMode = 'area' # orientVertical minimizes the 'area' or 'width' of the bounding rectangle
 
 class RawLoop:
-    def __init__(self, loop):
-        self.edges = []
-        self.relAngle = array.array('d', [0])
-        for iedge in range(loop.coEdges.count):
+    __slots__ = ('edges', 'relAngle', 'closure', 'holes', '_hull', '_box', '_bounds')
+
+    # engine is a method name from flat.solvers to integrate each edge on its
+    # own, 'auto' to let each edge choose one, 'quad' to flatten each edge by
+    # quadrature or 'batch' to integrate all the edges of the loop together
+    # with the numpy batch solver, None only prepares the edges
+    # options are the SolverOptions of every edge, fitTol defaults to fitTolerance
+    # maxWorkers above 1 flattens that many edges at once in threads, which
+    # overlaps their evaluator calls when the evaluators release the GIL
+    # holes are the assembled inner loops of the face placed inside the
+    # outline, flat.body puts them there
+    def __init__(self, loop, engine='ode23', options=None, fitTol=None, maxWorkers=1):
+        coEdges = [loop.coEdges.item(iedge) for iedge in range(loop.coEdges.count)]
+        work = partial(RawEdge, engine=None if engine == 'batch' else engine, options=options, fitTol=fitTol)
+        if maxWorkers == 1 or len(coEdges) < 2:
+            self.edges = [work(ce) for ce in coEdges]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(maxWorkers) as pool:
+                self.edges = list(pool.map(work, coEdges))
+        self.relAngle = cornerAngles(coEdges)
+        self.closure = None
+        self.holes = []
+        self.invalidateHull()
+
+        if engine == 'batch':
+            self.flattenBatch(loop)
+
+    # loop from edges that are already flattened, no Fusion objects needed
+    @classmethod
+    def fromEdges(cls, edges, relAngle):
+        raw = cls.__new__(cls)
+        raw.edges = edges
+        raw.relAngle = array.array('d', relAngle)
+        raw.closure = None
+        raw.holes = []
+        raw.invalidateHull()
+        return raw
+
+    # integrate every edge of the loop in lockstep
+    def flattenBatch(self, loop):
+        from .batch import ode23Batch, linearRhs
+        coefs = []
+        x0 = []
+        tvecs = []
+        for iedge, edge in enumerate(self.edges):
             ce = loop.coEdges.item(iedge)
-            self.edges.append(RawEdge(ce))
+            coefs.append(partial(RawEdge.coefficients, edge, ce.edge, ce.loop.face))
+            x0.append(edge.x0)
+            tvecs.append(edge.tvec)
 
-            eeval = ce.edge.evaluator
-            feval = ce.loop.face.evaluator            
-            (ret, t0, t1) = eeval.getParameterExtents()
-
-            # first end
-            (ret, p0) = eeval.getPointAtParameter(t0)
-            (ret, n0) = feval.getNormalAtPoint(p0)
-            (ret, tang0) = eeval.getFirstDerivative(t0)
-
-            # second end
-            (ret, p1) = eeval.getPointAtParameter(t1)
-            (ret, n1) = feval.getNormalAtPoint(p1)
-            (ret, tang1) = eeval.getFirstDerivative(t1)
-            
-            # if reversed, swap tangents and reverse them
-            if ce.isOpposedToEdge:
-                tang0.scaleBy(-1.)
-                tang1.scaleBy(-1.)
-                tang0, tang1 = tang1, tang0
-                p0, p1 = p1, p0
-                n0, n1 = n1, n0
-            
-            if iedge > 0:
-                # need the signed angle
-                tangNormal = lastTangent.crossProduct(tang0)
-                angSign = tangNormal.dotProduct(n0)
-                ang = math.copysign(lastTangent.angleTo(tang0), angSign)
-                self.relAngle.append(ang)
-            else:
-                firstTangent = tang0
-                firstNormal = n0
-            
-            # tangent at end (in loop direction) for relAngle next time around
-            lastTangent = tang1
-
-        # first relative angle is between end of last edge and start of first
-        tangNormal = lastTangent.crossProduct(firstTangent)
-        angSign = tangNormal.dotProduct(firstNormal)
-        ang = math.copysign(lastTangent.angleTo(firstTangent), angSign)
-        self.relAngle.append(ang)
+        options = min((edge.options for edge in self.edges), key=lambda o: o.rtol)
+        [xOuts, stats] = ode23Batch(linearRhs(coefs), x0, tvecs, options)
+        for edge, xOut, edgeStats in zip(self.edges, xOuts, stats):
+            edge.setSolution(xOut)
+            edge.solverStats = edgeStats
 
     def assemble(self):
         # stretch edges to match length in 3d and reverse if needed
@@ -63,9 +79,9 @@ class RawLoop:
         # rotate edges to match corner angles in 3d
         for iedge in range(1, len(self.edges)):
             targetAngle = self.relAngle[iedge]
-            endTang = self.edges[iedge-1].tangents[-1]
+            endTang = self.edges[iedge-1].tangent(-1)
             endAngle = math.atan2(endTang[1], endTang[0])
-            startTang = self.edges[iedge].tangents[0]
+            startTang = self.edges[iedge].tangent(0)
             startAngle = math.atan2(startTang[1], startTang[0])
             actualAngle = startAngle - endAngle
             rAngle = targetAngle - actualAngle
@@ -73,91 +89,313 @@ class RawLoop:
 
         # translate edges so they are end to end
         for iedge in range(1, len(self.edges)):
-            endPt = self.edges[iedge-1].points[-1]
+            endPt = self.edges[iedge-1].point(-1)
             self.edges[iedge].translateTo(endPt[0], endPt[1])
 
         # orient the shape close to vertical for tiling in 2d
+        # which also leaves the bounding box at the origin
         self.orientVertical()
 
-        self.boundingBox = self.calcBoundingBox()
-
         # return the close error
-        startPt = self.edges[0].points[0]
-        endPt = self.edges[-1].points[-1]
-        return math.hypot(endPt[0] - startPt[0], endPt[1] - startPt[1])
-
+        startPt = self.edges[0].point(0)
+        endPt = self.edges[-1].point(-1)
+        self.closure = math.hypot(endPt[0] - startPt[0], endPt[1] - startPt[1])
+        return self.closure
+
+    # estimated contribution of each edge to the closure error, measured at
+    # the end of the last edge where the loop should meet its start
+    def closureErrors(self):
+        end = self.edges[-1].point(-1)
+        return [edge.closureError(end) for edge in self.edges]
+
+    # indices of the edges with the largest contributions to the closure error,
+    # as many as it takes for the estimate of the others to fit in budget, the
+    # chord errors of the others are added as vectors and the rest as sizes
+    def worstEdges(self, budget):
+        errors = self.closureErrors()
+        chords = [edge.chordError() for edge in self.edges]
+        others = [error - math.hypot(*chord) for error, chord in zip(errors, chords)]
+        rest = set(range(len(errors)))
+
+        def left():
+            return (math.hypot(math.fsum(chords[i][0] for i in rest), math.fsum(chords[i][1] for i in rest)) +
+                    math.fsum(others[i] for i in rest))
+
+        worst = []
+        for iedge in sorted(range(len(errors)), key=lambda i: -errors[i]):
+            if worst and left() <= budget:
+                break
+            worst.append(iedge)
+            rest.discard(iedge)
+        return worst
+
+    # the holes follow the outline through rotate and translateBy
     def rotate(self, theta):
         for edge in self.edges:
             edge.rotate(theta)
-
+        for hole in self.holes:
+            hole.rotate(theta)
+        (c, s) = (math.cos(theta), math.sin(theta))
+        if self._hull is not None:
+            self._hull = [(c*x - s*y, s*x + c*y) for (x, y) in self._hull]
+        if self._box is not None:
+            self._box.rotate(theta)
+        self._bounds = None
+
+    # (xmin, ymin, xmax, ymax) of the flat outline, kept through translateBy
+    # and found again from the hull after a rotation
     def calcBoundingBox(self):
-        bb = None
-        for edge in self.edges:
-            bbe = edge.calcBoundingBox()
-            if bb == None:
-                bb = bbe
+        if self._bounds is None:
+            if self._hull is not None:
+                x = [p[0] for p in self._hull]
+                y = [p[1] for p in self._hull]
+                self._bounds = array.array('d', [min(x), min(y), max(x), max(y)])
             else:
-                bb[0] = min(bb[0], bbe[0])
-                bb[1] = min(bb[1], bbe[1])
-                bb[2] = max(bb[2], bbe[2])
-                bb[3] = max(bb[3], bbe[3])
-        return bb
+                bb = None
+                for edge in self.edges:
+                    bbe = edge.calcBoundingBox()
+                    if bb == None:
+                        bb = bbe
+                    else:
+                        bb[0] = min(bb[0], bbe[0])
+                        bb[1] = min(bb[1], bbe[1])
+                        bb[2] = max(bb[2], bbe[2])
+                        bb[3] = max(bb[3], bbe[3])
+                self._bounds = bb
+        return array.array('d', self._bounds)
+
+    @property
+    def boundingBox(self):
+        return self.calcBoundingBox()
+
+    # bounds already known, an archive stores them with the loop
+    @boundingBox.setter
+    def boundingBox(self, bb):
+        self._bounds = array.array('d', bb)
     
     def translateBy(self, dx, dy):
         for edge in self.edges:
             edge.translateBy(dx, dy)
-
-    def orientVertical(self):
-        x = array.array('d', [])
-        y = array.array('d', [])
-        for edge in self.edges:
-            xe, ye = edge.xy()
-            x.extend(xe)
-            y.extend(ye)
-
-        xmean = statistics.mean(x)
-        ymean = statistics.mean(y)
-        xy = 0.
-        xx = 0.
-        for i in range(len(x)):
-            xy = xy + (x[i] - xmean)*(y[i] - ymean)
-            xx = xx + (x[i] - xmean)*(x[i] - xmean)
-
-        angle = math.atan2(xy, xx)
-        pi = 4. * math.atan(1.)
-        self.rotate(pi/2. - angle)
+        for hole in self.holes:
+            hole.translateBy(dx, dy)
+        if self._hull is not None:
+            self._hull = [(x + dx, y + dy) for (x, y) in self._hull]
+        if self._box is not None:
+            self._box.translateBy(dx, dy)
+        if self._bounds is not None:
+            bb = self._bounds
+            (bb[0], bb[1], bb[2], bb[3]) = (bb[0] + dx, bb[1] + dy, bb[2] + dx, bb[3] + dy)
+
+    # counterclockwise convex hull of the flat outline as (x, y) pairs, it
+    # follows the loop through rotate and translateBy
+    @property
+    def hull(self):
+        if self._hull is None:
+            x = []
+            y = []
+            for edge in self.edges:
+                for (hx, hy) in edge.hull():
+                    x.append(hx)
+                    y.append(hy)
+            self._hull = convexHull(x, y)
+        return self._hull
+
+    # smallest flat.hull.OrientedBox around the outline by boxMode
+    @property
+    def orientedBox(self):
+        if self._box is None:
+            self._box = minimumBox(self.hull, boxMode)
+        return self._box
+
+    # forget the hull and bounds after the edges have moved relative to each
+    # other, orientVertical starts with this since assemble has just moved them
+    def invalidateHull(self):
+        self._hull = None
+        self._box = None
+        self._bounds = None
+
+    # turn the smallest bounding rectangle of the shape upright with its
+    # longer side vertical for tiling in 2d, mode is 'area' or 'width'
+    # which also leaves the bounding box at the origin
+    def orientVertical(self, mode=None):
+        self.invalidateHull()
+        box = minimumBox(self.hull, boxMode if mode is None else mode)
+        self._box = box
+        if box.width <= box.height:
+            self.rotate(-box.angle)
+        else:
+            self.rotate(math.pi/2. - box.angle)
+
+        # the extreme points are on the hull so it gives the bounding box,
+        # which then follows the translation to the origin
         bb = self.calcBoundingBox()
         self.translateBy(-bb[0], -bb[1])
 
+# the relAngle of a loop of coedges, the signed angle about the face normal
+# from the end tangent of the previous edge to the start tangent of each
+# edge, ends(edge) gives the point and first derivative at the start and the
+# end of a BRepEdge in its own direction as (p0, tang0, p1, tang1)
+def cornerAngles(coEdges, ends=None):
+    if ends is None:
+        ends = edgeEnds
+    relAngle = array.array('d', [0])
+    for iedge, ce in enumerate(coEdges):
+        feval = ce.loop.face.evaluator
+        (p0, tang0, p1, tang1) = ends(ce.edge)
+
+        # if reversed, swap tangents and reverse them
+        if ce.isOpposedToEdge:
+            tang0.scaleBy(-1.)
+            tang1.scaleBy(-1.)
+            tang0, tang1 = tang1, tang0
+            p0, p1 = p1, p0
+        (ret, n0) = feval.getNormalAtPoint(p0)
+
+        if iedge > 0:
+            # need the signed angle
+            tangNormal = lastTangent.crossProduct(tang0)
+            angSign = tangNormal.dotProduct(n0)
+            ang = math.copysign(lastTangent.angleTo(tang0), angSign)
+            relAngle.append(ang)
+        else:
+            firstTangent = tang0
+            firstNormal = n0
+
+        # tangent at end (in loop direction) for relAngle next time around
+        lastTangent = tang1
+
+    # first relative angle is between end of last edge and start of first
+    tangNormal = lastTangent.crossProduct(firstTangent)
+    angSign = tangNormal.dotProduct(firstNormal)
+    ang = math.copysign(lastTangent.angleTo(firstTangent), angSign)
+    relAngle.append(ang)
+    return relAngle
+
+def edgeEnds(edge):
+    eeval = edge.evaluator
+    (ret, t0, t1) = eeval.getParameterExtents()
+    (ret, p0) = eeval.getPointAtParameter(t0)
+    (ret, tang0) = eeval.getFirstDerivative(t0)
+    (ret, p1) = eeval.getPointAtParameter(t1)
+    (ret, tang1) = eeval.getFirstDerivative(t1)
+    return (p0, tang0, p1, tang1)
+
+# 2d affine transform (a, b, c, d, e, f), x' = a x + b y + e, y' = c x + d y + f
+identity = (1., 0., 0., 1., 0., 0.)
+
+# points and tangents are contiguous (N, 2) buffers of interleaved x, y doubles
+# rotations and translations compose into a pending transform in O(1) and the
+# buffers are only rewritten when a consumer asks for points or tangents
 class RawEdge:
-    def __init__(self, coEdge):
+    __slots__ = ('needsReverse', 'length3d', 'd', 'l', '_points', '_tangents', 'xf',
+                 'x0', 'tvec', 'cache', 'solverStats', 'options', 'fitTol', 'stretch', 'turn', 'method',
+                 'dense', 'shift', 'flipped', 'frame', '_hullPoints', '_bounds')
+
+    # if engine is None the edge is only prepared and the caller is responsible
+    # for integrating from x0 over tvec and calling setSolution
+    # options are the SolverOptions and fitTol the stroke tolerance of the edge
+    # cache is a ParameterCache of the same BRepEdge to go on filling, a new
+    # one is made when it is None
+    def __init__(self, coEdge, engine='ode23', options=None, fitTol=None, cache=None):
+        self.clear()
+        self.cache = cache
         self.needsReverse = coEdge.isOpposedToEdge
         self.length3d = coEdge.edge.length
-        self.flatten(coEdge.edge, coEdge.loop.face)
-        
-    def flatten(self, edge, face):
+        self.options = defaultOptions if options is None else options
+        self.fitTol = fitTolerance if fitTol is None else fitTol
+        if engine is None:
+            self.prepare(coEdge.edge, coEdge.loop.face)
+        else:
+            self.flatten(coEdge.edge, coEdge.loop.face, engine)
+
+    # every slot as it is before anything is known about the edge, each
+    # constructor starts from here so no slot is ever missing
+    def clear(self):
+        self.needsReverse = False
+        self.length3d = 0.
+        self.d = array.array('d')
+        self.l = None
+        self.x0 = None
+        self.tvec = None
+        self.cache = None
+        self.solverStats = None
+        self.options = defaultOptions
+        self.fitTol = fitTolerance
+        self.turn = 0.
+        self.method = None
+        self.setPoints(array.array('d'), array.array('d'))
+
+    # edge from an already integrated solution, no Fusion objects needed
+    # tvec are the parameters of the points in xOut
+    @classmethod
+    def fromSolution(cls, needsReverse, length3d, d, xOut, dense=None, tvec=None):
+        edge = cls.__new__(cls)
+        edge.clear()
+        edge.needsReverse = needsReverse
+        edge.length3d = length3d
+        edge.d = array.array('d', d)
+        edge.tvec = None if tvec is None else list(tvec)
+        edge.setSolution(xOut, dense)
+        return edge
+
+    # edge of coEdge prepared like another prepared edge on the same BRepEdge,
+    # the strokes, arc lengths and start state only depend on the curve
+    @classmethod
+    def sharing(cls, coEdge, prepared):
+        edge = cls.__new__(cls)
+        edge.clear()
+        edge.needsReverse = coEdge.isOpposedToEdge
+        edge.length3d = prepared.length3d
+        edge.options = prepared.options
+        edge.fitTol = prepared.fitTol
+        edge.d = array.array('d', prepared.d)
+        edge.tvec = list(prepared.tvec)
+        edge.turn = prepared.turn
+        edge.x0 = list(prepared.x0)
+        edge.cache = ParameterCache(edge.tvec[0], edge.tvec[-1], cacheSize)
+        return edge
+
+    # edge from flat points and tangents as interleaved x, y sequences
+    @classmethod
+    def fromPoints(cls, needsReverse, length3d, d, points, tangents):
+        edge = cls.__new__(cls)
+        edge.clear()
+        edge.needsReverse = needsReverse
+        edge.length3d = length3d
+        edge.d = array.array('d', d)
+        edge.setPoints(array.array('d', points), array.array('d', tangents))
+        return edge
+
+    # parameter values to integrate to and the initial state
+    def prepare(self, edge, face):
         edgeEval = edge.evaluator
         
         # determine steps for IVP integration using fit strokes        
         (ret, t0, t1) = edgeEval.getParameterExtents()
-        (ret, strokes) = edgeEval.getStrokes(t0, t1, fitTolerance)
-        
+        (ret, strokes) = edgeEval.getStrokes(t0, t1, self.fitTol)
+
+        # rhs coefficients only depend on t so each parameter value only
+        # needs to go to the evaluators once across all the step retries,
+        # and again when the edge is flattened at a tighter tolerance
+        if self.cache is None:
+            self.cache = ParameterCache(t0, t1, cacheSize)
 
         # getParameterAtPoints thread is here:
         # https://forums.autodesk.com/t5/fusion-360-api-and-scripts/getparameteratpoint-returning-incorrect-value/m-p/8548381/highlight/true#M7248
         
         #(ret, tvec) = edgeEval.getParametersAtPoints(strokes)
-        # since getParametersAtPoints is currently broken
-        # approximate parameter values at strokes by assuming
-        # the curve is constant speed
-        self.d = array.array('d', [0.])
+        # since getParametersAtPoints is currently broken the parameter at
+        # each stroke comes from the table of true arc length against
+        # parameter, the strokes are placed at their distance along the curve
+        chord = [0.]
         for idx in range(1, len(strokes)):
-            self.d.append(self.d[idx-1] + strokes[idx].distanceTo(strokes[idx-1]))
+            chord.append(chord[idx-1] + strokes[idx].distanceTo(strokes[idx-1]))
 
-        # parameter value is proportional to distance for constant speed
-        tvec = [t0]
-        for idx in range(1, len(self.d)):
-            tvec.append(t0 + (t1-t0)*self.d[idx]/self.d[-1])
+        table = ArcLengthTable(partial(speedAt, edgeEval), t0, t1)
+        scale = table.length / chord[-1]
+        self.d = array.array('d', [c * scale for c in chord])
+        tvec = table.parameters(self.d)
+        self.turn = strokeTurn(strokes)
 
         # an error will occur if either endpoint is outside of range by eps so squeeze end in by a tiny amount
         dt = 1.e-13 * (tvec[-1] - tvec[0])
@@ -166,39 +404,97 @@ class RawEdge:
 
         # initial point on plane is 0,0 and speed is mag(first derivative of curve) in X
         (ret, r_t) = edgeEval.getFirstDerivative(t0)
-        x0 = [0., 0., r_t.length, 0.]
+        self.x0 = [0., 0., r_t.length, 0.]
+        self.tvec = tvec
+
+    def flatten(self, edge, face, engine='ode23'):
+        self.prepare(edge, face)
+        tvec = self.tvec
+        x0 = self.x0
+
+        dense = DenseOutput()
+        if engine == 'quad':
+            coefFun = partial(RawEdge.coefficients, self, edge, face)
+            [xOut, self.solverStats] = flattenQuad(coefFun, x0, tvec, self.options, dense)
+            self.setSolution(xOut, dense)
+            return
+
         rhsFun = partial(RawEdge.rhs, self, edge, face)
-        #[xOut, err] = ode23(rhsFun, x0, tvec)
-
-        xOut = []
-        xOut.append(x0)
-        for it in range(1, len(tvec)):
-            ts0 = tvec[it-1]
-            ts1 = tvec[it]
-            dt = ts1 - ts0
-            h = min(dt, estimateH(rhsFun, x0, tvec[it-1]))
-            steps = int(round(dt / h)) + 1
-            success = False
-            while not success:
-                tsvec = linspace(ts0, ts1, steps)
-                [xStep, success] = ode23(rhsFun, x0, tsvec)
-                steps = steps * 2
-            x0 = xStep[-1]
-            xOut.append(x0)
 
+        # adaptive steps are accepted or rejected individually, landing on each stroke
+        self.method = chooseMethod(self.options.rtol, self.turn) if engine == 'auto' else engine
+        h = min(tvec[1] - tvec[0], estimateH(rhsFun, x0, tvec[0], self.options))
+        [xOut, self.solverStats] = methods[self.method](rhsFun, x0, tvec, h, self.options, dense=dense)
+        self.setSolution(xOut, dense)
+
+    # integrated states at tvec to flat points and tangents, dense is the
+    # DenseOutput of the integration if there is one
+    def setSolution(self, xOut, dense=None):
         # tangent = math.atan2(dy, dx)
 
-        self.points = []
-        self.tangents = []
-        for idx in range(len(xOut)):
-            v = xOut[idx]
-            self.points.append([v[0], v[1]])
-            self.tangents.append([v[2], v[3]])
-        return
+        self.setPoints(array.array('d', [c for v in xOut for c in (v[0], v[1])]),
+                       array.array('d', [c for v in xOut for c in (v[2], v[3])]), dense)
+
+    def setPoints(self, points, tangents, dense=None):
+        self._points = points
+        self._tangents = tangents
+        self.xf = identity
+        self.stretch = 0.
+        # the length correction at the first and last point of the solution,
+        # along its velocity, whether the points are now in reverse order and
+        # the transform already applied to the buffers
+        self.dense = dense
+        self.shift = [0., 0.]
+        self.flipped = False
+        self.frame = identity
+        self.invalidateBounds()
+
+    # the hull and bounds are cached, anything that moves points other than
+    # rotate and translateBy has to call this
+    def invalidateBounds(self):
+        # hull of the buffers before the pending transform
+        self._hullPoints = None
+        self._bounds = None
+
+    @property
+    def points(self):
+        self.materialize()
+        return self._points
+
+    @property
+    def tangents(self):
+        self.materialize()
+        return self._tangents
+
+    # apply the pending transform to the buffers
+    def materialize(self):
+        if self.xf == identity:
+            return
+        (a, b, c, d, e, f) = self.xf
+        transformPairs(self._points, a, b, c, d, e, f)
+        transformPairs(self._tangents, a, b, c, d, 0., 0.)
+        if self.dense is not None:
+            self.frame = compose(self.xf, self.frame)
+        # the points have not moved, only where the transform is kept
+        if self._hullPoints is not None:
+            self._hullPoints = [(a*x + b*y + e, c*x + d*y + f) for (x, y) in self._hullPoints]
+        self.xf = identity
             
     # rhs for ODE, state vector is (x, y, x_t, y_t) 
     def rhs(self, edge, face, t, state):
+        (A, B) = self.coefficients(edge, face, t)
         state_t = [state[2], state[3], 0., 0.]
+        state_t[2] = A * state[2] - B * state[3]
+        state_t[3] = A * state[3] + B * state[2]
+        return state_t
+
+    # rhs is linear in the state, x_tt + i y_tt = (A + iB)(x_t + i y_t)
+    # where A and B only depend on the geometry at t
+    def coefficients(self, edge, face, t):
+        AB = self.cache.get(t)
+        if AB is not None:
+            return AB
+
         edgeEval = edge.evaluator
         faceEval = face.evaluator
         
@@ -212,9 +508,8 @@ class RawEdge:
         curvature = curveDir.copy()
         curvature.scaleBy(curveMag)
        
-        # TODO check the surface curvature to insure ruled surface? 
-        #(ret, sparam) = faceEval.getParameterAtPoint(p)
-        #(ret, maxTangent, maxCurvature, minCurvature) = faceEval.getCurvature(sparam)
+        # the surface curvature is checked once per face by flat.screen
+        # before any edge is flattened
                 
         (ret, surfaceNormal) = faceEval.getNormalAtPoint(p)
         surfaceNormal.normalize()
@@ -223,88 +518,241 @@ class RawEdge:
         
         A = r_t.dotProduct(r_tt) / r_t.dotProduct(r_t)
         B = curve_geo * r_t.length
-        state_t[2] = A * state[2] - B * state[3]
-        state_t[3] = A * state[3] + B * state[2]
-        return state_t
-
+        self.cache.put(t, (A, B))
+        return (A, B)
+
+    # the geometry cache is only needed while integrating
+    def __getstate__(self):
+        state = {}
+        for name in RawEdge.__slots__:
+            if name != 'cache':
+                state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        self.clear()
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    # number of points
+    def __len__(self):
+        return len(self._points) // 2
+
+    def point(self, i):
+        if i < 0:
+            i = i + len(self)
+        (a, b, c, d, e, f) = self.xf
+        x = self._points[2*i]
+        y = self._points[2*i+1]
+        return (a*x + b*y + e, c*x + d*y + f)
+
+    def tangent(self, i):
+        if i < 0:
+            i = i + len(self)
+        (a, b, c, d, e, f) = self.xf
+        x = self._tangents[2*i]
+        y = self._tangents[2*i+1]
+        return (a*x + b*y, c*x + d*y)
+
+    # point order commutes with the pending transform so it stays pending,
+    # the hull and bounds are of the same points
     def reverse(self):
         self.d.reverse()
-        self.points.reverse()
-
-        # 
-        self.tangents.reverse()
-        for i, t in enumerate(self.tangents):
-            t[0] = -1. * t[0]
-            t[1] = -1. * t[1]
-        
+        self._points = reversedPairs(self._points, 1.)
+        self._tangents = reversedPairs(self._tangents, -1.)
         self.needsReverse = (not self.needsReverse)
+        self.flipped = not self.flipped
+
+    # the dense output of the integration, edges read from an archive or
+    # integrated by the batch engine have none
+    def denseOutput(self):
+        if self.dense is None:
+            raise ValueError("edge has no dense output")
+        return self.dense
+
+    # flat point and tangent at edge parameter t between the points, with the
+    # length correction, reversal and pending transform of the points
+    def stateAt(self, t):
+        dense = self.denseOutput()
+        (x, y, vx, vy) = dense.state(t)
+        speed = math.hypot(vx, vy)
+        if speed > 0.:
+            # the correction moves each point along its tangent in proportion
+            # to its distance from where the correction started
+            (s0, s1) = self.shift
+            shift = (s0 + (s1 - s0) * dense.length(t) / dense.length()) / speed
+            x = x + shift * vx
+            y = y + shift * vy
+        if self.flipped:
+            (vx, vy) = (-vx, -vy)
+        (a, b, c, d, e, f) = compose(self.xf, self.frame)
+        return (a*x + b*y + e, c*x + d*y + f), (a*vx + b*vy, c*vx + d*vy)
+
+    def pointAt(self, t):
+        return self.stateAt(t)[0]
+
+    def tangentAt(self, t):
+        return self.stateAt(t)[1]
+
+    # length of the flat edge after the length correction
+    def denseLength(self):
+        return self.denseOutput().length() + self.shift[1] - self.shift[0]
+
+    # edge parameter at distance s along the flat edge from its first point
+    def parameterAtLength(self, s):
+        dense = self.denseOutput()
+        total = self.denseLength()
+        if self.flipped:
+            s = total - s
+        return dense.parameter(s * dense.length() / total)
+
+    # n (point, tangent) pairs evenly spaced along the flat edge from its
+    # first point to its last, no evaluator calls needed
+    def resample(self, n):
+        total = self.denseLength()
+        return [self.stateAt(self.parameterAtLength(total * i / (n - 1))) for i in range(n)]
 
     def rotate(self, theta):
         costh = math.cos(theta)
         sinth = math.sin(theta)
-        idx = 0
-        for pt in self.points:
-            xn = pt[0]*costh - pt[1]*sinth
-            yn = pt[0]*sinth + pt[1]*costh
-            pt[0] = xn
-            pt[1] = yn
-
-            # tangents
-            tt = self.tangents[idx]
-            xtn = tt[0]*costh - tt[1]*sinth
-            ytn = tt[0]*sinth + tt[1]*costh
-            tt[0] = xtn
-            tt[1] = ytn
-
-            idx = idx + 1
+        (a, b, c, d, e, f) = self.xf
+        self.xf = (costh*a - sinth*c, costh*b - sinth*d,
+                   sinth*a + costh*c, sinth*b + costh*d,
+                   costh*e - sinth*f, sinth*e + costh*f)
+        self._bounds = None
 
     def translateTo(self, x, y):
-        dx = x - self.points[0][0]
-        dy = y - self.points[0][1]
-        self.translateBy(dx, dy)
+        (x0, y0) = self.point(0)
+        self.translateBy(x - x0, y - y0)
 
     def translateBy(self, dx, dy):
-        for pt in self.points:
-            pt[0] = pt[0] + dx
-            pt[1] = pt[1] + dy
-
+        (a, b, c, d, e, f) = self.xf
+        self.xf = (a, b, c, d, e + dx, f + dy)
+        bb = self._bounds
+        if bb is not None:
+            (bb[0], bb[1], bb[2], bb[3]) = (bb[0] + dx, bb[1] + dy, bb[2] + dx, bb[3] + dy)
+
+    # lengths and the length correction are the same before and after a rigid
+    # transform so they work on the untransformed buffers
     def calcLength(self):
-        self.l = array.array('d', [0.])
-        for i in range(1, len(self.points)):
-            p0 = self.points[i-1]
-            p1 = self.points[i]
-            self.l.append(self.l[i-1] + math.hypot(p1[0]-p0[0], p1[1]-p0[1]))
+        x = self._points[0::2]
+        y = self._points[1::2]
+        self.l = array.array('d', itertools.accumulate(
+            map(math.hypot, map(operator.sub, x[1:], x), map(operator.sub, y[1:], y)),
+            initial=0.))
         return self.l[-1]
 
     def correctLength(self):
         tot = self.length3d - self.calcLength()
-        for i in range(1, len(self.points)):
-            pt = self.points[i]
-            tang = self.tangents[i]
-            tangLen = math.hypot(tang[0], tang[1])
-            delta = self.l[i] / self.l[-1] * tot
-            pt[0] = pt[0] + delta * tang[0] / tangLen
-            pt[1] = pt[1] + delta * tang[1] / tangLen
+        self.stretch = self.stretch + abs(tot)
+        if self.dense is not None:
+            if self.flipped:
+                self.shift[0] = self.shift[0] - tot
+            else:
+                self.shift[1] = self.shift[1] + tot
+        # one pass over the interleaved buffers, each point moves along its
+        # tangent in proportion to its length from the first point
+        scale = tot / self.l[-1]
+        points = iter(self._points)
+        tangents = iter(self._tangents)
+        out = []
+        for li, x, y, tx, ty in zip(self.l, points, points, tangents, tangents):
+            delta = scale * li / math.hypot(tx, ty) if li else 0.
+            out.append(x + delta * tx)
+            out.append(y + delta * ty)
+        self._points[:] = array.array('d', out)
+        self.invalidateBounds()
+
+    # the chord the length correction could not see, the polyline through the
+    # nodes is shorter than the flat curve so correctLength overshoots by the
+    # difference along the tangent at the end it moves, returned as a vector
+    # in the loop since the overshoots of different edges can cancel
+    def chordError(self):
+        if self.dense is None:
+            return (0., 0.)
+        short = max(0., self.denseLength() - self.calcLength())
+        (tx, ty) = self.tangent(0 if self.flipped else -1)
+        speed = math.hypot(tx, ty)
+        if speed == 0.:
+            return (0., 0.)
+        return (short * tx / speed, short * ty / speed)
+
+    # estimated contribution to the closure error of the loop, the chord
+    # error plus the solver's position error plus its direction error turning
+    # everything between the end of this edge and end, the point where the
+    # loop closes, edges without dense output count their whole stretch
+    def closureError(self, end):
+        error = math.hypot(*self.chordError()) if self.dense is not None else self.stretch
+        stats = self.solverStats
+        if stats is not None:
+            e = stats.error
+            p = self.point(-1)
+            error = error + math.hypot(e[0], e[1])
+            error = error + stats.angle * math.hypot(end[0] - p[0], end[1] - p[1])
+        return error
 
     def setStart(self, p0, tang0):
-        th1 = math.atan2(tang0[1], tang0[2])
-        th0 = math.atan2(self.tangents[0][1], self.tangents[0][0])
+        th1 = math.atan2(tang0[1], tang0[0])
+        tang = self.tangent(0)
+        th0 = math.atan2(tang[1], tang[0])
         self.rotate(th1 - th0)
         self.translateTo(p0[0], p0[1])
 
+    # convex hull of the transformed points, the hull of the buffers is kept
+    # and transformed so the pending transform stays pending
+    def hull(self):
+        if self._hullPoints is None:
+            self._hullPoints = convexHull(self._points[0::2], self._points[1::2])
+        (a, b, c, d, e, f) = self.xf
+        return [(a*x + b*y + e, c*x + d*y + f) for (x, y) in self._hullPoints]
+
+    # views of the x and y coordinates that share the point buffer
     def xy(self):
-        x = array.array('d', [])
-        y = array.array('d', [])
-        for pt in self.points:
-            x.append(pt[0])
-            y.append(pt[1])
-        return x, y
+        view = memoryview(self.points)
+        return view[0::2], view[1::2]
 
+    # (xmin, ymin, xmax, ymax) of the transformed points from the hull, kept
+    # through translateBy and found again from the hull after a rotation
     def calcBoundingBox(self):
-        x, y = self.xy()
-        bbox = array.array('d', [0., 0., 0., 0.])
-        bbox[0] = min(x)
-        bbox[1] = min(y)
-        bbox[2] = max(x)
-        bbox[3] = max(y)
-        return bbox
\ No newline at end of file
+        if self._bounds is None:
+            h = self.hull()
+            x = [p[0] for p in h]
+            y = [p[1] for p in h]
+            self._bounds = array.array('d', [min(x), min(y), max(x), max(y)])
+        return array.array('d', self._bounds)
+
+# |r_t| of an edge evaluator, the integrand of arc length
+def speedAt(edgeEval, t):
+    (ret, r_t) = edgeEval.getFirstDerivative(t)
+    return r_t.length
+
+# (N, 2) interleaved buffer in reverse point order, with each pair scaled
+def reversedPairs(pairs, scale):
+    out = array.array('d', pairs)
+    out[0::2] = pairs[-2::-2]
+    out[1::2] = pairs[-1::-2]
+    if scale != 1.:
+        out = array.array('d', [scale * c for c in out])
+    return out
+
+# the affine transform that applies first and then second
+def compose(second, first):
+    (a2, b2, c2, d2, e2, f2) = second
+    (a1, b1, c1, d1, e1, f1) = first
+    return (a2*a1 + b2*c1, a2*b1 + b2*d1, c2*a1 + d2*c1, c2*b1 + d2*d1,
+            a2*e1 + b2*f1 + e2, c2*e1 + d2*f1 + f2)
+
+# apply an affine transform to an (N, 2) interleaved buffer in place, in one
+# pass over it
+def transformPairs(pairs, a, b, c, d, e, f):
+    it = iter(pairs)
+    out = []
+    if (a, b, c, d) == (1., 0., 0., 1.):
+        for x, y in zip(it, it):
+            out.append(x + e)
+            out.append(y + f)
+    else:
+        for x, y in zip(it, it):
+            out.append(a*x + b*y + e)
+            out.append(c*x + d*y + f)
+    pairs[:] = array.array('d', out)
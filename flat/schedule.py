@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cooperative scheduling of long running work.
+
+Work is given as generators that yield after every unit of it, an edge
+sampled or integrated, a loop assembled or a curve drawn, and return their
+result.  Scheduler.run steps them in the order they were added and every
+time slice hands control to a progress sink with the units done, the units
+known so far and an estimate of the seconds left, which is where a user
+interface gets to handle its events.  When the sink says it was cancelled
+the scheduler stops between two units.  Whatever finished is kept, the
+generators that had not are closed so their finally clauses run.
+
+Nothing here knows about Fusion, ProgressLog is a sink for running headless.
+"""
+import time, collections
+
+class Task:
+    def __init__(self, steps, units, label, done):
+        self.steps = steps
+        # units expected, the generator may yield more or fewer
+        self.units = units
+        self.label = label
+        self.done = done
+        self.count = 0
+        self.finished = False
+        self.result = None
+
+# runs Tasks a time slice at a time, progress is a sink with
+# report(done, total, eta, label) and optionally a cancelled attribute
+class Scheduler:
+    def __init__(self, progress=None, timeSlice=.1, clock=time.perf_counter):
+        self.progress = progress
+        self.timeSlice = timeSlice
+        self.clock = clock
+        self.tasks = collections.deque()
+        self.total = 0
+        self.done = 0
+        # seconds spent in the work itself, for the estimate of what is left
+        self.elapsed = 0.
+        self.cancelled = False
+
+    # schedule the generator steps of about units units, done is called with
+    # its result when it finishes, returns the Task
+    def add(self, steps, units=1, label=None, done=None):
+        task = Task(steps, units, label, done)
+        self.tasks.append(task)
+        self.total = self.total + units
+        return task
+
+    def cancel(self):
+        self.cancelled = True
+
+    # seconds left at the average rate so far, None before any unit is done
+    def eta(self):
+        if self.done == 0:
+            return None
+        return self.elapsed * (self.total - self.done) / self.done
+
+    # run units until the time slice is used up, True while work is left
+    def runSlice(self):
+        t0 = self.clock()
+        label = None
+        while self.tasks and not self.cancelled:
+            task = self.tasks[0]
+            label = task.label
+            try:
+                next(task.steps)
+            except StopIteration as stop:
+                # units it said it would take and did not are done too
+                self.tasks.popleft()
+                self.done = self.done + max(task.units - task.count, 0)
+                task.finished = True
+                task.result = stop.value
+                if task.done is not None:
+                    task.done(task.result)
+            else:
+                task.count = task.count + 1
+                if task.count > task.units:
+                    task.units = task.units + 1
+                    self.total = self.total + 1
+                self.done = self.done + 1
+            if self.clock() - t0 >= self.timeSlice:
+                break
+        self.elapsed = self.elapsed + self.clock() - t0
+
+        if self.progress is not None:
+            if label is None and self.tasks:
+                label = self.tasks[0].label
+            self.progress.report(self.done, self.total, self.eta(), label)
+            # a cancel after the last unit is too late to stop anything
+            if self.tasks and getattr(self.progress, 'cancelled', False):
+                self.cancelled = True
+        return bool(self.tasks) and not self.cancelled
+
+    # run every task, or until cancelled, True when everything finished
+    def run(self):
+        while self.runSlice():
+            pass
+        if self.cancelled:
+            while self.tasks:
+                self.tasks.popleft().steps.close()
+        return not self.cancelled
+
+# run steps to the end at once and return its result
+def finish(steps):
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+# progress sink that keeps every report, cancelled once it has been given
+# cancelAfter reports
+class ProgressLog:
+    def __init__(self, cancelAfter=None):
+        self.reports = []
+        self.cancelAfter = cancelAfter
+
+    def report(self, done, total, eta, label):
+        self.reports.append((done, total, eta, label))
+
+    @property
+    def cancelled(self):
+        return self.cancelAfter is not None and len(self.reports) >= self.cancelAfter
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Developability pre-screen of faces.
+
+A face only flattens without stretching where its Gaussian curvature K is
+zero.  The screen samples the surface over a grid of the face's parameter
+range, with one batched evaluator call for the first derivatives and one for
+the principal curvatures of every sample, and sums |K| dA into the angle
+defect.  By Gauss-Bonnet that bounds the rotation, in radians, by which a
+flattened loop around any part of the face can fail to close.  A doubly
+curved face is then turned away after two evaluator calls instead of after
+its whole flatten.
+
+The grid covers the whole parameter range so trimmed away parts of the
+surface count too, which errs on the side of rejecting a face.
+"""
+import math
+
+# angle defect in radians up to which a face is developable, and up to which
+# it is near enough to flatten with loops that close to about the defect
+# times their size
+developableDefect = 1.e-4
+nearDefect = 1.e-2
+
+# samples along each parameter direction
+gridSize = 8
+
+class Screen:
+    def __init__(self, kind, defect, maxCurvature, area, samples):
+        # 'developable', 'near' or 'not'
+        self.kind = kind
+        self.defect = defect
+        # largest |K| of any sample, 1/cm^2 for Fusion faces
+        self.maxCurvature = maxCurvature
+        self.area = area
+        self.samples = samples
+
+    # whether the face is worth flattening
+    @property
+    def flattens(self):
+        return self.kind != 'not'
+
+    def __repr__(self):
+        return "Screen({}, defect={:.3g}, maxCurvature={:.3g}, area={:.6g})".format(
+            self.kind, self.defect, self.maxCurvature, self.area)
+
+def classify(defect):
+    if defect <= developableDefect:
+        return 'developable'
+    if defect <= nearDefect:
+        return 'near'
+    return 'not'
+
+# Screen of a BRepFace from an n x n grid at the centers of equal parameter
+# cells, which keeps the samples off singular boundaries like the apex of a
+# cone, the area is the midpoint rule over the same cells
+def screenFace(face, n=None):
+    if n is None:
+        n = gridSize
+    evaluator = face.evaluator
+    box = evaluator.parametricRange()
+    (u0, v0) = (box.minPoint.x, box.minPoint.y)
+    du = (box.maxPoint.x - u0) / n
+    dv = (box.maxPoint.y - v0) / n
+
+    # parameters are made from the range's own points so no adsk import is needed
+    parameters = []
+    for i in range(n):
+        for j in range(n):
+            p = box.minPoint.copy()
+            p.x = u0 + (i + .5) * du
+            p.y = v0 + (j + .5) * dv
+            parameters.append(p)
+
+    (ret, partialsU, partialsV) = evaluator.getFirstDerivatives(parameters)
+    (ret, maxTangents, maxCurvatures, minCurvatures) = evaluator.getCurvatures(parameters)
+
+    cell = abs(du * dv)
+    terms = []
+    areas = []
+    maxCurvature = 0.
+    for (su, sv, kmax, kmin) in zip(partialsU, partialsV, maxCurvatures, minCurvatures):
+        dA = su.crossProduct(sv).length * cell
+        K = abs(kmax * kmin)
+        terms.append(K * dA)
+        areas.append(dA)
+        maxCurvature = max(maxCurvature, K)
+
+    defect = math.fsum(terms)
+    return Screen(classify(defect), defect, maxCurvature, math.fsum(areas), len(parameters))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The step by step integrators by name.
+
+Every method is called as method(f, x0, tvec, h0, options) with SolverOptions
+and returns the state at every value of tvec and its SolverStats, so the
+flattening can swap them per edge.  'auto' picks one from the tolerance and how far the edge turns.
+"""
+import math
+from .ode23 import ode23Adaptive
+from .ode45 import ode45Adaptive
+from .gauss import gaussAdaptive
+
+methods = {'ode23': ode23Adaptive, 'ode45': ode45Adaptive, 'gauss': gaussAdaptive}
+
+# at or below this tolerance the higher order methods take enough fewer
+# steps on a curved edge to pay for their extra stages
+tightTol = 1.e-4
+# radians an edge may turn in space and still count as straight, its steps
+# are set by the stroke spacing so the cheapest stages win
+straightTurn = 0.1
+
+# name of the method to integrate an edge with at rtol, turn is the total
+# angle between successive chords of its strokes
+# cached is True when the rhs only goes to the evaluators once per parameter
+# value, the Gauss iterations are then nearly free and it makes the fewest
+# evaluator calls, otherwise ode45 makes the fewest rhs evaluations
+def chooseMethod(rtol, turn, cached=True):
+    if rtol > tightTol or turn < straightTurn:
+        return 'ode23'
+    return 'gauss' if cached else 'ode45'
+
+# angle the polyline through points turns through, points have x, y and z
+# like the adsk Point3D
+def strokeTurn(points):
+    turn = 0.
+    for idx in range(1, len(points) - 1):
+        (p0, p1, p2) = (points[idx-1], points[idx], points[idx+1])
+        u = (p1.x - p0.x, p1.y - p0.y, p1.z - p0.z)
+        v = (p2.x - p1.x, p2.y - p1.y, p2.z - p1.z)
+        dot = u[0]*v[0] + u[1]*v[1] + u[2]*v[2]
+        cross = math.sqrt((u[1]*v[2] - u[2]*v[1])**2 + (u[2]*v[0] - u[0]*v[2])**2 + (u[0]*v[1] - u[1]*v[0])**2)
+        turn = turn + math.atan2(cross, dot)
+    return turn
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of flattened loops.
+
+Loops are stored under a key, each in its own single loop archive in the
+cache directory.  For a BRepLoop the key is a fingerprint of its geometry and
+of the settings it was flattened with, so a face that has not changed since
+the last run is read back instead of flattened again.
+
+The least recently used entries are evicted when the cache grows past its
+size or entry limits.  Use is tracked by file modification time so several
+processes can share a directory.
+"""
+import os, struct, hashlib, tempfile
+from .archive import ArchiveWriter, ArchiveReader
+
+extension = ".flat"
+
+# bump to invalidate every stored loop when the flattening changes
+fingerprintVersion = 2
+
+# derivative samples per edge that go into the fingerprint
+fingerprintSamples = 5
+
+# hex key of the geometry of a BRepLoop and anything else the flattened
+# result depends on, settings is a tuple of plain values such as tolerances
+def fingerprint(loop, settings=()):
+    h = hashlib.sha1()
+    h.update(repr((fingerprintVersion,) + tuple(settings)).encode())
+    for iedge in range(loop.coEdges.count):
+        ce = loop.coEdges.item(iedge)
+        eeval = ce.edge.evaluator
+        feval = ce.loop.face.evaluator
+        (ret, t0, t1) = eeval.getParameterExtents()
+        values = [t0, t1, ce.edge.length]
+        for k in range(fingerprintSamples):
+            t = t0 + (t1 - t0) * k / (fingerprintSamples - 1)
+            (ret, p) = eeval.getPointAtParameter(t)
+            (ret, r_t) = eeval.getFirstDerivative(t)
+            (ret, r_tt) = eeval.getSecondDerivative(t)
+            (ret, n) = feval.getNormalAtPoint(p)
+            for v in (p, r_t, r_tt, n):
+                values.extend((v.x, v.y, v.z))
+        # ten significant digits so evaluator round off does not change the key
+        h.update(("{}:".format(ce.isOpposedToEdge) + ",".join("{:.10g}".format(v) for v in values) + ";").encode())
+    return h.hexdigest()
+
+# key of a face flattened with its holes from its loops, the outer loop first
+def faceFingerprint(loops, settings=()):
+    return fingerprint(loops[0], tuple(settings) + tuple(fingerprint(loop) for loop in loops[1:]))
+
+class LoopStore:
+    def __init__(self, directory, maxBytes=256*1024*1024, maxEntries=10000):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        # running size and entry count, only rescanned when a limit looks exceeded
+        self.total = None
+        self.count = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + extension)
+
+    # the stored RawLoop or None
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with ArchiveReader(path, useMmap=False) as reader:
+                loop = reader.loop(0)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses = self.misses + 1
+            return None
+        except (OSError, ValueError, IndexError, struct.error):
+            # damaged, by a crash or a disk problem, flattened and stored again
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return loop
+
+    def put(self, key, loop):
+        # write aside and rename so a reader never sees a partial file
+        (fd, tmp) = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        os.close(fd)
+        path = self.path(key)
+        try:
+            with ArchiveWriter(tmp) as writer:
+                writer.add(loop)
+            size = os.path.getsize(tmp)
+            # an entry overwritten under the same key gives its size back
+            try:
+                old = os.path.getsize(path)
+            except FileNotFoundError:
+                old = None
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        if self.total is None:
+            self.evict()
+        else:
+            self.total = self.total + size - (old or 0)
+            self.count = self.count + (1 if old is None else 0)
+            if self.total > self.maxBytes or self.count > self.maxEntries:
+                self.evict()
+
+    # (modification time, size, path) of every entry, oldest first
+    def entries(self):
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(extension):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                found.append((st.st_mtime, st.st_size, entry.path))
+        found.sort()
+        return found
+
+    # remove least recently used entries until the limits hold
+    def evict(self):
+        found = self.entries()
+        total = sum(size for (mtime, size, path) in found)
+        count = len(found)
+        for (mtime, size, path) in found:
+            if total <= self.maxBytes and count <= self.maxEntries:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total = total - size
+            count = count - 1
+        self.total = total
+        self.count = count
+
+    def clear(self):
+        for (mtime, size, path) in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.total = 0
+        self.count = 0
+
+    def __len__(self):
+        return len(self.entries())
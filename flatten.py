@@ -1,6 +1,8 @@
 import adsk.core, adsk.fusion, adsk.cam
 import os, math, array, pickle, traceback
 from flat.ode23 import ode23
+from flat.arclength import ArcLengthTable
+from flat.raw import speedAt
 from functools import partial
 
 fitTolerance = .01 # cm database units
@@ -119,17 +121,15 @@ class FlatEdge:
         # https://forums.autodesk.com/t5/fusion-360-api-and-scripts/getparameteratpoint-returning-incorrect-value/m-p/8548381/highlight/true#M7248
         
         #(ret, tvec) = edgeEval.getParametersAtPoints(strokes)
-        # since getParametersAtPoints is currently broken
-        # approximate parameter values at strokes by assuming
-        # the curve is constant speed
+        # since getParametersAtPoints is currently broken the parameter at
+        # each stroke comes from the table of true arc length against
+        # parameter, the strokes are placed at their distance along the curve
         d = [0.]
         for idx in range(1, len(strokes)):
             d.append(d[idx-1] + strokes[idx].distanceTo(strokes[idx-1]))
 
-        # parameter value is proportional to distance for constant speed
-        tvec = [t0]
-        for idx in range(1, len(d)):
-            tvec.append(t0 + (t1-t0)*d[idx]/d[-1])
+        table = ArcLengthTable(partial(speedAt, edgeEval), t0, t1)
+        tvec = table.parameters([c * table.length / d[-1] for c in d])
 
         # initial point on plane is 0,0 and speed is mag(first derivative of curve) in X
         (ret, r_t) = edgeEval.getFirstDerivative(t0)
@@ -1,16 +1,293 @@
-from flat.raw import RawLoop
-import os, pickle, math, statistics, array
+from flat.archive import ArchiveReader
+from flat.nest import Part, nest
+from flat.store import LoopStore
+from flat.export import openWriter, outlineCurves
+from flat.pipeline import readSamples, flattenParallel, samplesExtension
+from flat.solvers import methods
+import os, sys, json, math, time, hashlib, argparse, concurrent.futures
 
-if __name__ == "__main__":
-    # execute only if run as a script
+# flattened loop archives are streamed through assembly in a worker pool and
+# a JSON line is written for every loop as soon as it is done, or with
+# --integrate the sampled loops the command saved are integrated again, one
+# edge per job, and assembled
+
+archiveExtension = ".flat"
+
+# outlines are simplified to this fraction of the gap for nesting
+nestTolerance = 0.1
+
+# space between nested sheets in an export, cm
+sheetSpacing = 10.
+
+# archives opened by this process, a worker keeps a few files mapped
+_readers = {}
+_maxReaders = 8
+
+def reader(fname):
+    archive = _readers.get(fname)
+    if archive is None:
+        if len(_readers) >= _maxReaders:
+            oldest = next(iter(_readers))
+            _readers.pop(oldest).close()
+        archive = ArchiveReader(fname)
+        _readers[fname] = archive
+    return archive
+
+# loop stores opened by this process, keyed by directory
+_stores = {}
+
+def store(directory):
+    loopStore = _stores.get(directory)
+    if loopStore is None:
+        loopStore = LoopStore(directory)
+        _stores[directory] = loopStore
+    return loopStore
+
+# archive files named by paths, directories are searched recursively
+def archives(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for f in sorted(files):
+                    if f.endswith(archiveExtension):
+                        yield os.path.join(root, f)
+        else:
+            yield path
+
+# (archive, loop index) for every loop of every archive
+def jobs(paths):
+    for fname in archives(paths):
+        try:
+            count = len(reader(fname))
+        except Exception as e:
+            yield (fname, None, str(e))
+            continue
+        for i in range(count):
+            yield (fname, i, None)
+
+# assemble one loop and report on it, with outline set to a simplification
+# tolerance the result also carries the outline under "outline" for nesting
+# with cache set to a directory assembled loops are kept there by the hash
+# of their archived bytes and reused
+# with drawing set to (cut tolerance, edge curves mode) the result carries the
+# curves to export under "curves", see flat.export.outlineCurves
+def processLoop(job, assemble=True, outline=None, cache=None, drawing=None):
+    (fname, i, error) = job
+    result = {"archive": fname, "loop": i}
+    if error is not None:
+        result["error"] = error
+        return result
+
+    try:
+        archive = reader(fname)
+        t0 = time.perf_counter()
+        if not assemble:
+            summary = archive.summary(i)
+            if summary is not None:
+                result["closure"] = summary[0]
+                result["bbox"] = summary[1]
+            result["time"] = {"load": time.perf_counter() - t0}
+            return result
+
+        loop = None
+        if cache is not None:
+            key = hashlib.sha1(b"assemble" + archive.block(i)).hexdigest()
+            loop = store(cache).get(key)
+            result["cached"] = loop is not None
+        t1 = time.perf_counter()
+        if loop is None:
+            loop = archive.loop(i)
+            t1 = time.perf_counter()
+            loop.assemble()
+            if cache is not None:
+                store(cache).put(key, loop)
+        t2 = time.perf_counter()
+        describeLoop(loop, result, outline, drawing)
+        result["time"] = {"load": t1 - t0, "assemble": t2 - t1}
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+# what is reported of an assembled loop, see processLoop
+def describeLoop(loop, result, outline=None, drawing=None):
+    result["closure"] = loop.closure
+    result["bbox"] = list(loop.boundingBox)
+    result["edges"] = len(loop.edges)
+    result["points"] = sum(len(edge) for edge in loop.edges)
+    if outline is not None:
+        part = Part.fromLoop(loop, outline)
+        result["outline"] = (part.x, part.y)
+    if drawing is not None:
+        result["curves"] = outlineCurves(loop, *drawing)
+
+# integrate and assemble the sampled loops of each samples file in paths with
+# flat.pipeline.flattenParallel, calling emit with a result per loop like
+# processLoop, in the order of the files and their loops
+def integrate(paths, emit, workers=None, engine='quad', outline=None, drawing=None):
+    for fname in paths:
+        try:
+            samples = readSamples(fname)
+            t0 = time.perf_counter()
+            loops = flattenParallel(samples, engine, workers)
+            elapsed = time.perf_counter() - t0
+        except Exception as e:
+            emit({"archive": fname, "loop": None, "error": "{}: {}".format(type(e).__name__, e)})
+            continue
+        for i, loop in enumerate(loops):
+            result = {"archive": fname, "loop": i}
+            try:
+                describeLoop(loop, result, outline, drawing)
+                # the edges of every loop in the file were integrated together
+                result["time"] = {"integrate": elapsed / len(loops)}
+            except Exception as e:
+                result["error"] = "{}: {}".format(type(e).__name__, e)
+            emit(result)
+
+# run every job through processLoop, calling emit with results in completion order
+# at most window jobs are in flight so memory does not grow with the input
+def stream(jobList, emit, workers=None, window=None, assemble=True, outline=None, cache=None, drawing=None):
+    if workers == 1:
+        for job in jobList:
+            emit(processLoop(job, assemble, outline, cache, drawing))
+        return
+
+    if window is None:
+        window = 4 * (workers or os.cpu_count() or 1)
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        for job in jobList:
+            pending.add(pool.submit(processLoop, job, assemble, outline, cache, drawing))
+            if len(pending) >= window:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    emit(future.result())
+        for future in concurrent.futures.as_completed(pending):
+            emit(future.result())
+
+def main(argv=None):
     dir = os.path.dirname(os.path.abspath(__file__))
-    fname = os.path.join(dir, "flat_save.p")
-    raw = pickle.load( open(fname, "rb"))
+    parser = argparse.ArgumentParser(description="Assemble archived flattened loops and report on them as JSON lines.")
+    parser.add_argument("paths", nargs="*",
+                        help="archives or directories of archives, or samples files with --integrate")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes, 1 runs in this process")
+    parser.add_argument("-o", "--output", default="-", help="JSON lines output file, - for stdout")
+    parser.add_argument("--window", type=int, default=None, help="loops in flight at once")
+    parser.add_argument("--integrate", action="store_true",
+                        help="integrate the loops of samples files the command saved, one edge per job")
+    parser.add_argument("--engine", default="quad", choices=["quad", "auto"] + sorted(methods),
+                        help="how --integrate integrates the edges")
+    parser.add_argument("--summary-only", action="store_true",
+                        help="report the stored closure and bounding box without assembling")
+    parser.add_argument("--nest", metavar="WIDTHxHEIGHT", default=None,
+                        help="nest the loops onto sheets of this size and write a JSON line per sheet")
+    parser.add_argument("--gap", type=float, default=1., help="gap between nested parts")
+    parser.add_argument("--cache", default=None, help="directory to keep assembled loops in and reuse them from")
+    parser.add_argument("--rotations", default="0,90,180,270", help="allowed part rotations in degrees")
+    parser.add_argument("--export", metavar="FILE", default=None,
+                        help="write the outlines to a .dxf or .svg file, on their sheets with --nest or in a row")
+    parser.add_argument("--cut-tolerance", type=float, default=.01, help="how closely exported edges follow the outlines")
+    parser.add_argument("--edge-curves", choices=("spline", "polyline", "auto"), default="auto",
+                        help="draw exported edges as fitted splines, polylines or splines unless straight")
+    args = parser.parse_args(argv)
+    if not args.paths:
+        args.paths = [os.path.join(dir, "flat_save" + (samplesExtension if args.integrate else archiveExtension))]
+    if args.integrate and (args.summary_only or args.cache is not None):
+        parser.error("--integrate always assembles and does not use the cache")
 
-    for loop in raw:
-        print("loop --------------------------------------")
-        err = loop.assemble()
-        print("closure = ", err)
-        print("bbox: ", loop.boundingBox)
+    sheet = None
+    outline = None
+    if args.nest is not None:
+        if args.summary_only:
+            parser.error("--nest needs the loops assembled")
+        try:
+            sheet = [float(v) for v in args.nest.lower().split("x")]
+            if len(sheet) != 2:
+                raise ValueError
+        except ValueError:
+            parser.error("--nest expects WIDTHxHEIGHT, got {}".format(args.nest))
+        outline = args.gap * nestTolerance
+        try:
+            rotations = [float(r) for r in args.rotations.split(",")]
+        except ValueError:
+            parser.error("--rotations expects degrees separated by commas, got {}".format(args.rotations))
+        if any(r % 90. for r in rotations):
+            parser.error("--rotations have to be multiples of 90 degrees, got {}".format(args.rotations))
+    parts = []
+    owners = []
 
-    exit()
+    # loops are exported as they arrive in a row, or kept until the sheets
+    # are nested, as curves already simplified to the cut tolerance
+    writer = None
+    drawing = None
+    if args.export is not None:
+        if args.summary_only:
+            parser.error("--export needs the loops assembled")
+        try:
+            writer = openWriter(args.export)
+        except ValueError as e:
+            parser.error(str(e))
+        drawing = (args.cut_tolerance, args.edge_curves)
+    curves = []
+    row = [0.]
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    counts = {"loops": 0, "errors": 0}
+
+    def emit(result):
+        counts["loops"] = counts["loops"] + 1
+        if "error" in result:
+            counts["errors"] = counts["errors"] + 1
+        if "outline" in result:
+            (x, y) = result.pop("outline")
+            parts.append(Part(x, y, margin=outline))
+            owners.append((result["archive"], result["loop"]))
+            curves.append(result.pop("curves", None))
+        elif "curves" in result:
+            (x0, y0, x1, y1) = result["bbox"]
+            writer.addOutline(result.pop("curves"), 0., row[0] - x0, -y0)
+            row[0] = row[0] + x1 - x0 + args.gap
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+
+    t0 = time.perf_counter()
+    try:
+        if args.integrate:
+            integrate(args.paths, emit, args.workers, args.engine, outline, drawing)
+        else:
+            stream(jobs(args.paths), emit, args.workers, args.window, not args.summary_only, outline, args.cache, drawing)
+        if sheet is not None:
+            try:
+                sheets = nest(parts, sheet[0], sheet[1], args.gap, rotations)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 1
+            for isheet, nested in enumerate(sheets):
+                placements = []
+                for placement in nested.placements:
+                    entry = placement.asDict()
+                    (entry["archive"], entry["loop"]) = owners[entry.pop("part")]
+                    placements.append(entry)
+                out.write(json.dumps({"sheet": isheet, "width": sheet[0], "height": sheet[1], "placements": placements}) + "\n")
+                if writer is not None:
+                    x0 = isheet * (sheet[0] + sheetSpacing)
+                    writer.addSheet(x0, 0., sheet[0], sheet[1])
+                    for placement in nested.placements:
+                        if curves[placement.part] is not None:
+                            writer.addOutline(curves[placement.part], math.radians(placement.rotation),
+                                             placement.x + x0, placement.y)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if writer is not None:
+            writer.close()
+    print("{} loops, {} errors in {:.3f} s".format(counts["loops"], counts["errors"], time.perf_counter() - t0), file=sys.stderr)
+    if sheet is not None:
+        print("{} parts on {} sheets".format(len(parts), len(sheets)), file=sys.stderr)
+    if writer is not None:
+        print("{} outlines written to {}".format(writer.loops, args.export), file=sys.stderr)
+    return 1 if counts["errors"] else 0
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    sys.exit(main())
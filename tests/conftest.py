@@ -0,0 +1,4 @@
+# the tests import flat from the checkout they are in
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
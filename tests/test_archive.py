@@ -0,0 +1,42 @@
+# flattened loops come back from an archive as they were written
+from flat.analytic import patches, patch
+from flat.archive import ArchiveReader, writeArchive, readArchive
+from flat.raw import RawLoop
+
+def flattened(name, assemble=True):
+    (surface, corners) = patches()[name]
+    raw = RawLoop(patch(surface, corners, 2, .5).loops[0])
+    if assemble:
+        raw.assemble()
+    return raw
+
+def assertSameLoop(a, b):
+    assert list(a.relAngle) == list(b.relAngle)
+    assert a.closure == b.closure
+    assert len(a.edges) == len(b.edges)
+    for (ea, eb) in zip(a.edges, b.edges):
+        assert ea.needsReverse == eb.needsReverse
+        assert ea.length3d == eb.length3d
+        assert list(ea.d) == list(eb.d)
+        assert list(ea.points) == list(eb.points)
+        assert list(ea.tangents) == list(eb.tangents)
+    assert len(a.holes) == len(b.holes)
+    for (ha, hb) in zip(a.holes, b.holes):
+        assertSameLoop(ha, hb)
+
+def test_round_trip(tmp_path):
+    outline = flattened('cylinder')
+    outline.holes.append(flattened('cone'))
+    loops = [outline, flattened('tangent'), flattened('cone', assemble=False)]
+    fname = str(tmp_path / 'loops.flat')
+    writeArchive(fname, loops)
+
+    for (written, read) in zip(loops, readArchive(fname)):
+        assertSameLoop(written, read)
+    with ArchiveReader(fname, useMmap=False) as reader:
+        assert len(reader) == len(loops)
+        (closure, box) = reader.summary(0)
+        assert closure == outline.closure
+        assert box == list(outline.boundingBox)
+        assert reader.summary(2) is None
+        assertSameLoop(reader.loop(1), loops[1])
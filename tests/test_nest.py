@@ -0,0 +1,69 @@
+# nested outlines stay on their sheets and clear of each other
+import math, random
+import pytest
+from flat.nest import Part, nest, quarterTurn, segmentsCross
+
+def outlines(count, seed=1):
+    rng = random.Random(seed)
+    shapes = []
+    for i in range(count):
+        (r0, k, amp) = (rng.uniform(2., 8.), rng.randint(2, 6), rng.uniform(0., .4))
+        x = []
+        y = []
+        for j in range(60):
+            a = 2. * math.pi * j / 60
+            r = r0 * (1. + amp * math.sin(k * a)) + rng.uniform(-.01, .01)
+            x.append(r * math.cos(a))
+            y.append(r * math.sin(a))
+        shapes.append((x, y))
+    return shapes
+
+def placed(placement, x, y):
+    (c, s) = quarterTurn(placement.rotation)
+    return ([c*a - s*b + placement.x for a, b in zip(x, y)],
+            [s*a + c*b + placement.y for a, b in zip(x, y)])
+
+def inside(px, py, x, y):
+    n = len(x)
+    result = False
+    for i in range(n):
+        (ax, ay, bx, by) = (x[i], y[i], x[i - 1], y[i - 1])
+        if (ay > py) != (by > py) and px < ax + (py - ay) * (bx - ax) / (by - ay):
+            result = not result
+    return result
+
+def overlap(a, b):
+    (xa, ya) = a
+    (xb, yb) = b
+    if max(xa) < min(xb) or max(xb) < min(xa) or max(ya) < min(yb) or max(yb) < min(ya):
+        return False
+    (na, nb) = (len(xa), len(xb))
+    for i in range(na):
+        for j in range(nb):
+            if segmentsCross(xa[i - 1], ya[i - 1], xa[i], ya[i], xb[j - 1], yb[j - 1], xb[j], yb[j]):
+                return True
+    return inside(xa[0], ya[0], xb, yb) or inside(xb[0], yb[0], xa, ya)
+
+@pytest.mark.parametrize('refine', [False, True])
+def test_inside_and_clear(refine):
+    shapes = outlines(40)
+    # the parts are simplified, the loops they came from are nested
+    parts = [Part(x, y, .05, margin=.1) for (x, y) in shapes]
+    sheets = nest(parts, 60., 80., 1., (0, 90), refine)
+    assert sorted(p.part for sheet in sheets for p in sheet.placements) == list(range(len(parts)))
+
+    for sheet in sheets:
+        loops = [placed(p, *shapes[p.part]) for p in sheet.placements]
+        for (x, y) in loops:
+            assert min(x) >= .1 - 1.e-9 and max(x) <= sheet.width - .1 + 1.e-9
+            assert min(y) >= .1 - 1.e-9 and max(y) <= sheet.height - .1 + 1.e-9
+        for i in range(len(loops)):
+            for j in range(i):
+                assert not overlap(loops[i], loops[j])
+
+def test_rotations():
+    (x, y) = outlines(1)[0]
+    with pytest.raises(ValueError):
+        nest([Part(x, y)], 60., 80., 1., (0, 45))
+    with pytest.raises(ValueError):
+        nest([Part(x, y)], 5., 5.)
@@ -0,0 +1,41 @@
+# the closure budget picks the edges worth sampling again
+import math
+import pytest
+from flat.analytic import patches, patch
+from flat.pipeline import extractLoop, flattenSamples, closeSamples
+
+@pytest.fixture
+def tangent():
+    (surface, corners) = patches()['tangent']
+    loop = patch(surface, corners, 4, .8).loops[0]
+    samples = extractLoop(loop)
+    return loop, samples, flattenSamples(samples)
+
+def test_worst_edges(tangent):
+    (loop, samples, raw) = tangent
+    errors = raw.closureErrors()
+    assert len(errors) == len(raw.edges)
+    assert all(e >= 0. for e in errors)
+
+    worst = raw.worstEdges(raw.closure / 2.)
+    assert 0 < len(worst) < len(raw.edges)
+    assert worst == sorted(worst, key=lambda i: -errors[i])
+    # no budget takes every edge, an unlimited one still the worst edge
+    assert sorted(raw.worstEdges(0.)) == list(range(len(raw.edges)))
+    assert raw.worstEdges(math.inf) == [max(range(len(errors)), key=errors.__getitem__)]
+
+def test_close_samples(tangent):
+    (loop, samples, raw) = tangent
+    budget = raw.closure / 2.
+    worst = set(raw.worstEdges(budget))
+    before = list(samples.edges)
+    closed = closeSamples(loop, samples, raw, budget, maxRounds=1)
+    assert closed.closure < raw.closure
+    for iedge, (old, new) in enumerate(zip(before, samples.edges)):
+        assert (old is new) == (iedge not in worst)
+
+def test_within_budget(tangent):
+    (loop, samples, raw) = tangent
+    before = list(samples.edges)
+    assert closeSamples(loop, samples, raw, 2. * raw.closure) is raw
+    assert samples.edges == before
@@ -0,0 +1,42 @@
+# a cancelled Scheduler keeps what finished and closes what did not
+from flat.schedule import Scheduler, ProgressLog, finish
+
+def work(result, units, log):
+    try:
+        for i in range(units):
+            yield
+        return result
+    finally:
+        log.append(result)
+
+def test_run_to_the_end():
+    log = []
+    results = []
+    scheduler = Scheduler(ProgressLog(), timeSlice=0.)
+    scheduler.add(work('a', 2, log), 2, 'a', results.append)
+    scheduler.add(work('b', 3, log), 1, 'b', results.append)
+    assert scheduler.run()
+    assert results == ['a', 'b']
+    assert scheduler.done == scheduler.total == 5
+    assert finish(work('c', 4, log)) == 'c'
+
+def test_cancel_keeps_finished_results():
+    log = []
+    results = []
+    # a zero time slice reports after every unit, the fourth is b's first
+    progress = ProgressLog(cancelAfter=4)
+    scheduler = Scheduler(progress, timeSlice=0.)
+    a = scheduler.add(work('a', 2, log), 2, 'a', results.append)
+    b = scheduler.add(work('b', 3, log), 3, 'b', results.append)
+    c = scheduler.add(work('c', 3, log), 3, 'c', results.append)
+
+    assert not scheduler.run()
+    assert scheduler.cancelled
+    assert a.finished and a.result == 'a'
+    assert results == ['a']
+    assert not b.finished and b.result is None
+    assert not c.finished
+    # b was closed in the middle of its work, c never started
+    assert log == ['a', 'b']
+    assert len(progress.reports) == 4
+    assert progress.reports[-1][:2] == (3, 8)
@@ -0,0 +1,32 @@
+# the developability screen tells the analytic surfaces apart
+import pytest
+from flat.analytic import patches, patch, TwistedStrip
+from flat import screen
+
+@pytest.mark.parametrize('name', ['cylinder', 'cone', 'tangent'])
+def test_developable(name):
+    (surface, corners) = patches()[name]
+    face = patch(surface, corners)
+    result = screen.screenFace(face)
+    assert result.kind == 'developable'
+    assert result.flattens
+    assert result.samples == screen.gridSize**2
+    # one batched call for the derivatives and one for the curvatures
+    assert face.calls['getFirstDerivatives'] == 1
+    assert face.calls['getCurvatures'] == 1
+
+def test_twisted():
+    corners = patches()['twisted'][1]
+    slight = screen.screenFace(patch(TwistedStrip(.005), corners))
+    assert slight.kind == 'near'
+    assert slight.flattens
+    twisted = screen.screenFace(patch(TwistedStrip(.05), corners))
+    assert twisted.kind == 'not'
+    assert not twisted.flattens
+    assert twisted.defect > slight.defect > screen.developableDefect
+
+def test_classify():
+    assert screen.classify(0.) == 'developable'
+    assert screen.classify(screen.developableDefect) == 'developable'
+    assert screen.classify(screen.nearDefect) == 'near'
+    assert screen.classify(2. * screen.nearDefect) == 'not'